@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 统一的AI图片生成API客户端
-支持Gemini和豆包API
+支持Gemini和豆包API，以及用于压测的进程内Mock API
 """
 import requests
 import json
@@ -9,10 +9,11 @@ import base64
 import io
 import uuid
 import os
+import random
 import sys
-from PIL import Image
-from google import genai
+import time
 from dotenv import load_dotenv
+from provider_trace import new_call_id, trace_call
 
 # 加载环境变量
 load_dotenv()
@@ -20,29 +21,68 @@ load_dotenv()
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+# 生成结果写入 result_storage（本地目录或 S3 兼容存储），需在 load_dotenv 之后导入
+from result_storage import result_storage
+from result_writer import result_writer, PENDING_WRITE_KEY
+
 # 从环境变量读取配置
 GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.5-flash-image')
 DOUBAO_MODEL = os.getenv('DOUBAO_MODEL', 'doubao-seedream-4-0-250828')
 DOUBAO_WATERMARK = os.getenv('DOUBAO_WATERMARK', 'false').lower() == 'true'
-RESULT_FOLDER = os.getenv('RESULT_FOLDER', 'results')
+# 豆包图片返回方式：b64_json 直接在响应中返回图片（省去一次下载），url 返回图片链接后再下载
+DOUBAO_RESPONSE_FORMAT = os.getenv('DOUBAO_RESPONSE_FORMAT', 'b64_json')
+# b64_json 请求返回这些状态码、且错误信息指向 response_format 时改用 url 模式重试（部分中转服务不支持 b64_json）
+DOUBAO_REJECTED_FORMAT_STATUS = (400, 422)
+# 已确认不支持 b64_json 的豆包接口地址（进程内记录）
+_DOUBAO_URL_ONLY_ENDPOINTS = set()
+
+# Mock API 配置（用于压测和容量验证，不调用任何外部服务）
+MOCK_LATENCY = os.getenv('MOCK_LATENCY', 'lognormal:800:0.5')  # 分布:均值ms:离散度[:上限ms]
+MOCK_IMAGE_SIZE = os.getenv('MOCK_IMAGE_SIZE', '1024x1024')
+MOCK_IMAGE_FORMAT = os.getenv('MOCK_IMAGE_FORMAT', 'PNG')
+MOCK_FAILURE_RATE = float(os.getenv('MOCK_FAILURE_RATE', '0'))
+MOCK_FAILURE_ERROR = os.getenv('MOCK_FAILURE_ERROR', '429 - RESOURCE_EXHAUSTED (mock injected failure)')
+
+# API类型注册表：api_type -> (初始化方法, 生成方法)
+# google-genai、PIL 等 SDK 在对应方法中第一次用到时才导入，
+# 只使用豆包或第三方 Gemini 接口的部署不会加载 google-genai，web/Celery 进程启动更快、常驻内存更小
+PROVIDERS = {
+    "gemini": ("_init_gemini", "_generate_with_gemini"),
+    "doubao": ("_init_doubao", "_generate_with_doubao"),
+    "mock": ("_init_mock", "_generate_with_mock"),
+}
+
+# 支持一次请求生成多张图片的API：api_type -> (生成方法, 每次请求的最大张数)
+# 同一 prompt 的批量生图按此合并请求，减少调用次数和限流额度消耗
+MULTI_IMAGE_PROVIDERS = {
+    "doubao": ("_generate_many_with_doubao", int(os.getenv('DOUBAO_MAX_IMAGES_PER_CALL', 4))),
+    "mock": ("_generate_many_with_mock", int(os.getenv('MOCK_MAX_IMAGES_PER_CALL', 4))),
+}
+
+def images_per_call(api_type):
+    """指定API每次请求最多生成的图片数，不支持多图生成时为 1"""
+    _, limit = MULTI_IMAGE_PROVIDERS.get(api_type, (None, 1))
+    return max(1, limit)
 
 class AIImageGenerator:
     """统一的AI图片生成器"""
     
-    def __init__(self, api_type="gemini", api_key=None, model_name=None, base_url=None):
+    def __init__(self, api_type="gemini", api_key=None, model_name=None, base_url=None, write_behind=False):
+        """
+        Args:
+            write_behind: 生成的图片交给 result_writer 在后台写入，返回的结果带有待完成的写入，
+                          调用方需用 result_writer.wait_persisted / when_persisted 等待写入完成后再使用结果
+        """
         self.api_type = api_type
-        self.result_folder = RESULT_FOLDER
+        self.result_storage = result_storage
+        self.write_behind = write_behind
+        self._pending_writes = {}  # 结果 URL -> 待完成的写入
         self.base_url = base_url  # 保存 base_url，用于第三方 API
         
-        # 确保结果目录存在
-        os.makedirs(self.result_folder, exist_ok=True)
-        
-        if api_type == "gemini":
-            self._init_gemini(api_key, model_name, base_url)
-        elif api_type == "doubao":
-            self._init_doubao(api_key, model_name, base_url)
-        else:
+        if api_type not in PROVIDERS:
             raise ValueError(f"不支持的API类型: {api_type}")
+        init_method, _ = PROVIDERS[api_type]
+        getattr(self, init_method)(api_key, model_name, base_url)
     
     def _init_gemini(self, api_key=None, model_name=None, base_url=None):
         """初始化Gemini客户端"""
@@ -71,6 +111,7 @@ class AIImageGenerator:
             # 不使用 genai.Client，改用 HTTP 请求
             self.client = None
         else:
+            from google import genai
             self.use_custom_base_url = False
             self.custom_base_url = None
             self.client = genai.Client(api_key=final_api_key)
@@ -121,6 +162,16 @@ class AIImageGenerator:
             "Content-Type": "application/json"
         }
     
+    def _init_mock(self, api_key=None, model_name=None, base_url=None):
+        """初始化Mock客户端（进程内模拟，不需要API Key）"""
+        from mock_provider import LatencyModel, parse_image_size
+        self.api_key = (api_key or "").strip()
+        self.model = model_name or "mock-image"
+        self.latency_model = LatencyModel.parse(MOCK_LATENCY)
+        self.image_width, self.image_height = parse_image_size(MOCK_IMAGE_SIZE)
+        self.image_format = MOCK_IMAGE_FORMAT.upper()
+        self.failure_rate = MOCK_FAILURE_RATE
+    
     def generate_image(self, image_data, prompt):
         """
         生成图片的统一接口
@@ -132,16 +183,93 @@ class AIImageGenerator:
         Returns:
             dict: 包含生成结果的字典
         """
-        if self.api_type == "gemini":
-            return self._generate_with_gemini(image_data, prompt)
-        elif self.api_type == "doubao":
-            return self._generate_with_doubao(image_data, prompt)
+        # 调用标识用于在流量记录中关联生成请求和图片下载
+        self._call_id = new_call_id()
+        if self.api_type in PROVIDERS:
+            _, generate_method = PROVIDERS[self.api_type]
+            image_data = self.prepare_input(image_data)
+            return self._attach_pending_write(getattr(self, generate_method)(image_data, prompt))
         else:
             return {
                 "success": False,
                 "error": f"不支持的API类型: {self.api_type}"
             }
     
+    def generate_images(self, image_data, prompt, count):
+        """
+        使用同一 prompt 生成多张图片，API 支持时只发送一次请求
+        
+        API 可能返回少于 count 张图片（例如部分图片生成失败或模型认为不需要更多），
+        调用方应对缺少的图片改用 generate_image 逐张生成。
+        
+        Args:
+            image_data: 原始图片的二进制数据（可选）
+            prompt: 生成提示词
+            count: 期望生成的图片数，超过 images_per_call 的部分会被忽略
+            
+        Returns:
+            list: 结果字典列表，格式与 generate_image 相同；请求整体失败时为只包含一个失败结果的列表
+        """
+        count = min(count, images_per_call(self.api_type))
+        if count <= 1:
+            return [self.generate_image(image_data, prompt)]
+        self._call_id = new_call_id()
+        generate_method, _ = MULTI_IMAGE_PROVIDERS[self.api_type]
+        image_data = self.prepare_input(image_data)
+        return [self._attach_pending_write(result) for result in getattr(self, generate_method)(image_data, prompt, count)]
+    
+    def _save_result(self, generated_filename, data):
+        """
+        保存生成的图片
+        
+        Returns:
+            str: 结果 URL；write_behind 时图片可能尚未写入，写入由 _attach_pending_write 附加到对应的结果上
+        """
+        if not self.write_behind:
+            return self.result_storage.put(generated_filename, data)
+        generated_url = self.result_storage.url(generated_filename)
+        self._pending_writes[generated_url] = result_writer.submit(generated_filename, data)
+        return generated_url
+    
+    def _save_result_file(self, generated_filename, path):
+        """
+        保存暂存在本地文件中的图片（见 InlineImageExtractor 的 spool 模式），写入后删除暂存文件
+
+        Returns:
+            str: 同 _save_result
+        """
+        if not self.write_behind:
+            return self.result_storage.put_file(generated_filename, path)
+        generated_url = self.result_storage.url(generated_filename)
+        self._pending_writes[generated_url] = result_writer.submit_file(generated_filename, path)
+        return generated_url
+    
+    def _attach_pending_write(self, result):
+        pending_write = self._pending_writes.pop(result.get("generated_image_url"), None)
+        if pending_write is not None:
+            result[PENDING_WRITE_KEY] = pending_write
+        return result
+    
+    def prepare_input(self, image_data):
+        """缩放并重新编码参考图，详见 image_preprocess"""
+        if not image_data:
+            return image_data
+        from image_preprocess import image_preprocessor
+        return image_preprocessor.prepare(image_data, self.api_type)
+    
+    def _gemini_sdk_contents(self, image_data, prompt):
+        """构建官方 Gemini SDK 的 contents（同步和异步客户端共用）"""
+        from PIL import Image
+        # 根据是否有参考图选择不同的prompt
+        if image_data:
+            # 有参考图：图像编辑模式
+            image = Image.open(io.BytesIO(image_data))
+            full_prompt = f"Create a picture of my image with the following changes: {prompt}"
+            return [full_prompt, image]
+        # 无参考图：纯文本生成模式
+        full_prompt = f"Create an image based on this description: {prompt}"
+        return [full_prompt]
+    
     def _generate_with_gemini(self, image_data, prompt):
         """使用Gemini API生成图片"""
         try:
@@ -150,22 +278,15 @@ class AIImageGenerator:
                 return self._generate_with_gemini_http(image_data, prompt)
             
             # 否则使用官方 API（genai.Client）
-            # 根据是否有参考图选择不同的prompt
-            if image_data:
-                # 有参考图：图像编辑模式
-                image = Image.open(io.BytesIO(image_data))
-                full_prompt = f"Create a picture of my image with the following changes: {prompt}"
-                contents = [full_prompt, image]
-            else:
-                # 无参考图：纯文本生成模式
-                full_prompt = f"Create an image based on this description: {prompt}"
-                contents = [full_prompt]
+            contents = self._gemini_sdk_contents(image_data, prompt)
             
             # 调用Gemini API生成图片
-            response = self.client.models.generate_content(
-                model=self.model,
-                contents=contents
-            )
+            with trace_call("gemini", self.model, "generate", self._call_id) as span:
+                response = self.client.models.generate_content(
+                    model=self.model,
+                    contents=contents
+                )
+                span.sdk_response(len(image_data) if image_data else 0, _inline_data_size(response))
             
             # 处理响应
             if response and hasattr(response, 'candidates') and response.candidates:
@@ -175,15 +296,12 @@ class AIImageGenerator:
                         if hasattr(part, 'inline_data') and part.inline_data:
                             # 保存生成的图片
                             generated_filename = f"gemini_generated_{uuid.uuid4()}.png"
-                            generated_path = os.path.join(self.result_folder, generated_filename)
-                            
-                            with open(generated_path, 'wb') as f:
-                                f.write(part.inline_data.data)
+                            generated_url = self._save_result(generated_filename, part.inline_data.data)
                             
                             return {
                                 "success": True,
                                 "description": f"成功使用Gemini API生成图片: {prompt}",
-                                "generated_image_url": f"/static/results/{generated_filename}",
+                                "generated_image_url": generated_url,
                                 "api_type": "gemini",
                                 "note": "图片已使用Gemini API生成"
                             }
@@ -204,76 +322,84 @@ class AIImageGenerator:
                 "api_type": "gemini"
             }
     
-    def _generate_with_gemini_http(self, image_data, prompt):
-        """使用 HTTP 请求调用第三方 Gemini API（Google 原生 REST API 格式）"""
-        try:
-            # 构建请求 URL
-            # 格式：{base_url}/v1beta/models/{model}:generateContent
-            # 如果 base_url 已经包含 /v1beta，直接使用；否则添加
-            if '/v1beta' in self.custom_base_url:
-                endpoint = f"{self.custom_base_url}/models/{self.model}:generateContent"
-            else:
-                endpoint = f"{self.custom_base_url}/v1beta/models/{self.model}:generateContent"
+    def _gemini_http_request(self, image_data, prompt):
+        """构建第三方 Gemini API 的请求 URL、请求头和请求体（同步和异步客户端共用）"""
+        # 构建请求 URL
+        # 格式：{base_url}/v1beta/models/{model}:generateContent
+        # 如果 base_url 已经包含 /v1beta，直接使用；否则添加
+        if '/v1beta' in self.custom_base_url:
+            endpoint = f"{self.custom_base_url}/models/{self.model}:generateContent"
+        else:
+            endpoint = f"{self.custom_base_url}/v1beta/models/{self.model}:generateContent"
+        
+        # 构建请求体
+        if image_data:
+            from image_preprocess import image_mime_type
+            # 有参考图：图像编辑模式
+            image_base64 = base64.b64encode(image_data).decode('utf-8')
+            # 根据文件头检测图片格式
+            mime_type = image_mime_type(image_data)
             
-            # 构建请求体
-            if image_data:
-                # 有参考图：图像编辑模式
-                image_base64 = base64.b64encode(image_data).decode('utf-8')
-                # 检测图片格式
-                image = Image.open(io.BytesIO(image_data))
-                mime_type = f"image/{image.format.lower()}" if image.format else "image/png"
-                
-                payload = {
-                    "contents": [
-                        {
-                            "parts": [
-                                {
-                                    "text": f"Create a picture of my image with the following changes: {prompt}"
-                                },
-                                {
-                                    "inlineData": {
-                                        "mimeType": mime_type,
-                                        "data": image_base64
-                                    }
+            payload = {
+                "contents": [
+                    {
+                        "parts": [
+                            {
+                                "text": f"Create a picture of my image with the following changes: {prompt}"
+                            },
+                            {
+                                "inlineData": {
+                                    "mimeType": mime_type,
+                                    "data": image_base64
                                 }
-                            ]
-                        }
-                    ],
-                    "generationConfig": {
-                        "temperature": 0.7,
-                        "maxOutputTokens": 4000,
+                            }
+                        ]
                     }
+                ],
+                "generationConfig": {
+                    "temperature": 0.7,
+                    "maxOutputTokens": 4000,
                 }
-            else:
-                # 无参考图：纯文本生成模式
-                payload = {
-                    "contents": [
-                        {
-                            "parts": [
-                                {
-                                    "text": f"Create an image based on this description: {prompt}"
-                                }
-                            ]
-                        }
-                    ],
-                    "generationConfig": {
-                        "temperature": 0.7,
-                        "maxOutputTokens": 4000,
+            }
+        else:
+            # 无参考图：纯文本生成模式
+            payload = {
+                "contents": [
+                    {
+                        "parts": [
+                            {
+                                "text": f"Create an image based on this description: {prompt}"
+                            }
+                        ]
                     }
+                ],
+                "generationConfig": {
+                    "temperature": 0.7,
+                    "maxOutputTokens": 4000,
                 }
-            
-            # 发送 HTTP 请求
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.api_key}",
             }
+        
+        # 请求头
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}",
+        }
+        
+        return endpoint, headers, payload
+    
+    def _generate_with_gemini_http(self, image_data, prompt):
+        """使用 HTTP 请求调用第三方 Gemini API（Google 原生 REST API 格式）"""
+        try:
+            endpoint, headers, payload = self._gemini_http_request(image_data, prompt)
             
-            response = requests.post(
-                endpoint,
-                headers=headers,
-                json=payload,
-                timeout=600.0  # 10分钟超时
-            )
+            with trace_call("gemini", self.model, "generate", self._call_id) as span:
+                response = requests.post(
+                    endpoint,
+                    headers=headers,
+                    json=payload,
+                    timeout=600.0  # 10分钟超时
+                )
+                span.response(response)
             
             if response.status_code == 200:
                 response_data = response.json()
@@ -292,15 +418,12 @@ class AIImageGenerator:
                                 # 解码并保存图片
                                 image_bytes = base64.b64decode(data)
                                 generated_filename = f"gemini_generated_{uuid.uuid4()}.png"
-                                generated_path = os.path.join(self.result_folder, generated_filename)
-                                
-                                with open(generated_path, 'wb') as f:
-                                    f.write(image_bytes)
+                                generated_url = self._save_result(generated_filename, image_bytes)
                                 
                                 return {
                                     "success": True,
                                     "description": f"成功使用第三方 Gemini API 生成图片: {prompt}",
-                                    "generated_image_url": f"/static/results/{generated_filename}",
+                                    "generated_image_url": generated_url,
                                     "api_type": "gemini",
                                     "note": "图片已使用第三方 Gemini API 生成"
                                 }
@@ -325,112 +448,182 @@ class AIImageGenerator:
                 "api_type": "gemini"
             }
     
+    def _doubao_request(self, image_data, prompt, max_images=1):
+        """构建豆包 API 的请求 URL 和请求体（同步和异步客户端共用）"""
+        # 构造请求数据
+        request_data = {
+            "model": self.model,
+            "size": "2K",
+            "sequential_image_generation": "disabled",
+            "stream": False,
+            "response_format": DOUBAO_RESPONSE_FORMAT,
+            "watermark": self.watermark  # 使用配置的水印设置
+        }
+        
+        # 组图模式：一次请求最多生成 max_images 张图片
+        if max_images > 1:
+            request_data["sequential_image_generation"] = "auto"
+            request_data["sequential_image_generation_options"] = {"max_images": max_images}
+            prompt = f"{prompt}\n生成{max_images}张不同的图片"
+        
+        # 根据是否有参考图选择不同的prompt
+        if image_data:
+            from image_preprocess import image_mime_type
+            # 有参考图：图像编辑模式，data URL 使用图片的实际格式
+            image_base64 = base64.b64encode(image_data).decode('utf-8')
+            request_data["prompt"] = f"基于我的图片进行以下修改: {prompt}"
+            request_data["image"] = f"data:{image_mime_type(image_data)};base64,{image_base64}"
+        else:
+            # 无参考图：纯文本生成模式
+            request_data["prompt"] = prompt
+        
+        # 检查 base_url 是否已经包含 /images/generations 路径
+        if '/images/generations' in self.base_url:
+            # 如果已经包含完整路径，直接使用
+            endpoint = self.base_url
+        else:
+            # 否则添加 /images/generations 路径
+            endpoint = f"{self.base_url}/images/generations"
+        
+        if endpoint in _DOUBAO_URL_ONLY_ENDPOINTS:
+            request_data["response_format"] = "url"
+        
+        return endpoint, request_data
+    
     def _generate_with_doubao(self, image_data, prompt):
         """使用豆包API生成图片"""
+        return self._doubao_generate(image_data, prompt)[0]
+    
+    def _generate_many_with_doubao(self, image_data, prompt, count):
+        """使用豆包组图模式一次生成多张图片"""
+        return self._doubao_generate(image_data, prompt, max_images=count)
+    
+    def _doubao_generate(self, image_data, prompt, max_images=1):
+        """发送豆包生成请求，b64_json 模式被中转服务拒绝时自动改用 url 模式重试"""
         try:
-            # 构造请求数据
-            request_data = {
-                "model": self.model,
-                "size": "2K",
-                "sequential_image_generation": "disabled",
-                "stream": False,
-                "response_format": "url",
-                "watermark": self.watermark  # 使用配置的水印设置
-            }
-            
-            # 根据是否有参考图选择不同的prompt
-            if image_data:
-                # 有参考图：图像编辑模式
-                image_base64 = base64.b64encode(image_data).decode('utf-8')
-                request_data["prompt"] = f"基于我的图片进行以下修改: {prompt}"
-                request_data["image"] = f"data:image/png;base64,{image_base64}"
-            else:
-                # 无参考图：纯文本生成模式
-                request_data["prompt"] = prompt
-            
-            # 发送请求
-            # 检查 base_url 是否已经包含 /images/generations 路径
-            if '/images/generations' in self.base_url:
-                # 如果已经包含完整路径，直接使用
-                endpoint = self.base_url
-            else:
-                # 否则添加 /images/generations 路径
-                endpoint = f"{self.base_url}/images/generations"
-            
+            endpoint, request_data = self._doubao_request(image_data, prompt, max_images)
+            results, rejected = self._post_doubao(endpoint, request_data, prompt, max_images)
+            if rejected:
+                request_data["response_format"] = "url"
+                results, _ = self._post_doubao(endpoint, request_data, prompt, max_images)
+                if results[0].get("success"):
+                    # url 模式成功，说明该服务不支持 b64_json，之后直接使用 url 模式
+                    _DOUBAO_URL_ONLY_ENDPOINTS.add(endpoint)
+            return results
+                
+        except Exception as e:
+            return [{
+                "success": False,
+                "error": f"豆包API调用失败: {str(e)}",
+                "api_type": "doubao"
+            }]
+    
+    def _post_doubao(self, endpoint, request_data, prompt, limit):
+        """
+        发送豆包生成请求并处理响应
+        
+        b64_json 模式下流式读取响应，图片边接收边解码写入结果目录；
+        write_behind 时解码后的图片先写入暂存文件，响应解析成功后交给 result_writer 在后台移入存储
+        
+        Returns:
+            tuple: (结果列表, b64_json 模式是否被拒绝)
+        """
+        inline = request_data["response_format"] == "b64_json"
+        with trace_call("doubao", self.model, "generate", self._call_id) as span:
             response = requests.post(
                 endpoint,
                 headers=self.headers,
                 json=request_data,
-                timeout=60
+                timeout=60 * limit,
+                stream=inline
             )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return self._process_doubao_response(result, prompt)
+            if inline and response.status_code == 200:
+                from inline_image_decoder import InlineImageExtractor
+                # 只使用前 limit 张图片（见 _process_doubao_images），多返回的图片不写入
+                extractor = InlineImageExtractor(self.result_storage, "doubao", spool=self.write_behind,
+                                                 max_images=limit)
+                try:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        extractor.feed(chunk)
+                    response_data = json.loads(extractor.close())
+                except Exception:
+                    extractor.abort()
+                    raise
+                finally:
+                    response.close()
+                for generated_filename, path in extractor.images:
+                    self._save_result_file(generated_filename, path)
+                span.response(response, response_bytes=extractor.bytes_received)
             else:
-                return {
-                    "success": False,
-                    "error": f"豆包API请求失败: {response.status_code} - {response.text}",
-                    "api_type": "doubao"
-                }
-                
-        except Exception as e:
-            return {
+                span.response(response)
+        
+        if response.status_code != 200:
+            if inline and _doubao_format_rejected(response.status_code, response.text):
+                return None, True
+            return [{
                 "success": False,
-                "error": f"豆包API调用失败: {str(e)}",
+                "error": f"豆包API请求失败: {response.status_code} - {response.text}",
                 "api_type": "doubao"
-            }
+            }], False
+        if not inline:
+            response_data = response.json()
+        return self._process_doubao_images(response_data, prompt, limit=limit), False
     
     def _process_doubao_response(self, response_data, prompt):
         """处理豆包API响应"""
+        return self._process_doubao_images(response_data, prompt, limit=1)[0]
+    
+    def _process_doubao_images(self, response_data, prompt, limit=None):
+        """处理豆包API响应中的每张图片，组图模式下部分图片可能单独失败"""
         try:
-            if "data" in response_data and len(response_data["data"]) > 0:
-                image_data = response_data["data"][0]
-                
-                if "url" in image_data:
+            entries = response_data.get("data") or []
+            if not entries:
+                return [{
+                    "success": False,
+                    "error": "豆包API响应格式异常",
+                    "api_type": "doubao"
+                }]
+            
+            results = []
+            for entry in entries[:limit]:
+                if entry.get("b64_json"):
+                    # b64_json 模式下图片已在接收响应时写入结果目录，字段值为文件名
+                    results.append(self._doubao_image_result(entry["b64_json"], prompt))
+                elif "url" in entry:
                     # 下载并保存图片
-                    return self._save_doubao_image(image_data["url"], prompt)
+                    results.append(self._save_doubao_image(entry["url"], prompt))
                 else:
-                    return {
+                    error = entry.get("error")
+                    message = error.get("message") if isinstance(error, dict) else error
+                    results.append({
                         "success": False,
-                        "error": "豆包API响应中未找到图片URL",
+                        "error": message or "豆包API响应中未找到图片URL",
                         "api_type": "doubao"
-                    }
-            else:
-                return {
-                    "success": False,
-                    "error": "豆包API响应格式异常",
-                    "api_type": "doubao"
-                }
+                    })
+            return results
                 
         except Exception as e:
-            return {
+            return [{
                 "success": False,
                 "error": f"处理豆包API响应失败: {str(e)}",
                 "api_type": "doubao"
-            }
+            }]
     
     def _save_doubao_image(self, image_url, prompt):
         """保存豆包生成的图片"""
         try:
             # 下载图片
-            img_response = requests.get(image_url, timeout=30)
+            with trace_call("doubao", self.model, "download", self._call_id) as span:
+                img_response = requests.get(image_url, timeout=30)
+                span.response(img_response)
             if img_response.status_code == 200:
                 # 生成文件名
                 generated_filename = f"doubao_generated_{uuid.uuid4()}.png"
-                generated_path = os.path.join(self.result_folder, generated_filename)
                 
                 # 保存图片
-                with open(generated_path, 'wb') as f:
-                    f.write(img_response.content)
+                self._save_result(generated_filename, img_response.content)
                 
-                return {
-                    "success": True,
-                    "description": f"成功使用豆包API生成图片: {prompt}",
-                    "generated_image_url": f"/static/results/{generated_filename}",
-                    "api_type": "doubao",
-                    "note": "图片已使用豆包API生成"
-                }
+                return self._doubao_image_result(generated_filename, prompt)
             else:
                 return {
                     "success": False,
@@ -445,21 +638,100 @@ class AIImageGenerator:
                 "api_type": "doubao"
             }
 
+    def _doubao_image_result(self, generated_filename, prompt):
+        """豆包生成图片已保存到结果存储后的返回结果"""
+        return {
+            "success": True,
+            "description": f"成功使用豆包API生成图片: {prompt}",
+            "generated_image_url": self.result_storage.url(generated_filename),
+            "api_type": "doubao",
+            "note": "图片已使用豆包API生成"
+        }
+
+    def _generate_with_mock(self, image_data, prompt):
+        """使用进程内Mock生成图片：模拟延迟后写入合成图片"""
+        return self._generate_many_with_mock(image_data, prompt, 1)[0]
+    
+    def _generate_many_with_mock(self, image_data, prompt, count):
+        """Mock 组图：一次模拟延迟后写入 count 张合成图片"""
+        try:
+            time.sleep(self.latency_model.sample())
+            
+            if self.failure_rate > 0 and random.random() < self.failure_rate:
+                return [{
+                    "success": False,
+                    "error": f"Mock API请求失败: {MOCK_FAILURE_ERROR}",
+                    "api_type": "mock"
+                }]
+            
+            return [self._save_mock_image(prompt) for _ in range(count)]
+            
+        except Exception as e:
+            return [{
+                "success": False,
+                "error": f"Mock API调用失败: {str(e)}",
+                "api_type": "mock"
+            }]
+    
+    def _save_mock_image(self, prompt):
+        """写入一张合成图片"""
+        from mock_provider import pooled_image_bytes
+        try:
+            image_bytes = pooled_image_bytes(self.image_width, self.image_height, self.image_format)
+            extension = "jpg" if self.image_format == "JPEG" else self.image_format.lower()
+            generated_filename = f"mock_generated_{uuid.uuid4()}.{extension}"
+            generated_url = self._save_result(generated_filename, image_bytes)
+            
+            return {
+                "success": True,
+                "description": f"成功使用Mock API生成图片: {prompt}",
+                "generated_image_url": generated_url,
+                "api_type": "mock",
+                "note": "图片由Mock API合成，仅用于压测"
+            }
+            
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"Mock API调用失败: {str(e)}",
+                "api_type": "mock"
+            }
+
+def _doubao_format_rejected(status_code, body):
+    """
+    b64_json 请求的失败是否因为接口不支持 response_format
+
+    内容审核等其他 400 / 422 错误换成 url 模式也会失败，不重试（重试会再计费一次）
+    """
+    return status_code in DOUBAO_REJECTED_FORMAT_STATUS and 'response_format' in (body or '').lower()
+
+def _inline_data_size(response):
+    """统计 Gemini SDK 响应中内联图片数据的字节数"""
+    total = 0
+    for candidate in getattr(response, 'candidates', None) or []:
+        content = getattr(candidate, 'content', None)
+        for part in getattr(content, 'parts', None) or []:
+            inline_data = getattr(part, 'inline_data', None)
+            if inline_data and inline_data.data:
+                total += len(inline_data.data)
+    return total
+
 # 工厂函数
-def create_image_generator(api_type="gemini", api_key=None, model_name=None, base_url=None):
+def create_image_generator(api_type="gemini", api_key=None, model_name=None, base_url=None, write_behind=False):
     """
     创建图片生成器实例
     
     Args:
-        api_type: API类型 ("gemini" 或 "doubao")
+        api_type: API类型 ("gemini"、"doubao" 或 "mock")
         api_key: API密钥（可选，如果不提供则使用配置文件中的）
         model_name: 模型名称（可选，如果不提供则使用配置文件中的）
         base_url: 自定义 base URL（可选，如果提供则使用第三方 API）
+        write_behind: 生成的图片在后台写入（见 result_writer）
         
     Returns:
         AIImageGenerator: 图片生成器实例
     """
-    return AIImageGenerator(api_type, api_key, model_name, base_url)
+    return AIImageGenerator(api_type, api_key, model_name, base_url, write_behind)
 
 # 测试函数
 def test_apis():
@@ -1,42 +1,62 @@
-from flask import Flask, request, jsonify, send_from_directory, abort
+from flask import Flask, request, jsonify, send_from_directory, abort, redirect
 from flask_cors import CORS
+from werkzeug.exceptions import NotFound
 from werkzeug.utils import secure_filename
+import logging
 import os
 import uuid
 import sys
+import zlib
 import redis
-from google import genai
-from PIL import Image
-import io
 from dotenv import load_dotenv
 
 # 加载环境变量
 load_dotenv()
 
+# 日志通过队列由后台线程写出，详见 logging_config
+from logging_config import setup_logging
+setup_logging()
+logger = logging.getLogger(__name__)
+
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from ai_image_generator import create_image_generator
+from result_storage import result_storage
+from result_writer import result_writer, wait_persisted
+import file_layout
 
 # 从环境变量读取配置
 GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.5-flash-image')
 UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'uploads')
-RESULT_FOLDER = os.getenv('RESULT_FOLDER', 'results')
 MAX_FILE_SIZE = int(os.getenv('MAX_FILE_SIZE', 10 * 1024 * 1024))  # 默认10MB
 ALLOWED_EXTENSIONS = set(os.getenv('ALLOWED_EXTENSIONS', 'png,jpg,jpeg,gif,webp').split(','))
 SUPPORTED_APIS = os.getenv('SUPPORTED_APIS', 'gemini,doubao').split(',')
+MAX_BATCH_ITEMS = int(os.getenv('MAX_BATCH_ITEMS', 5000))  # 单个批量任务的最大图片数
 
 # V2阶段：导入批量任务相关模块
-from task_manager import task_manager, TaskStatus
-from tasks import process_batch_task
+from task_manager import task_manager, TaskStatus, SUMMARY_FIELDS
+
+# 生成任务公平调度器
+from scheduler import generation_scheduler, JobPriority, SchedulerShutdown
+
+# 可续传的分块上传
+from upload_store import upload_store, UploadError
+
+# 批量请求的流式接收
+from ingest import ingest_multipart, discard_files, IngestError
+
+# 离线批量作业
+from bulk_jobs import bulk_supported
 
-# 导入每日限额管理器
-from daily_limit_manager import daily_limit_manager
+# JSON 响应压缩
+from response_compression import response_compressor
 
 # 注意：已移除认证和积分体系，用户只需提供自己的 API Key 即可使用
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 CORS(app)  # 启用CORS支持
+response_compressor.init_app(app)
 
 # 配置Gemini API - 使用新的google-genai包
 # 注意：现在只使用用户提供的API key，不再使用配置文件中的
@@ -44,11 +64,33 @@ CORS(app)  # 启用CORS支持
 
 # 确保目录存在
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(RESULT_FOLDER, exist_ok=True)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def save_reference_image(session_id):
+    """
+    获取批量生图的参考图路径（可选）
+
+    优先使用表单中的 upload_id（已完成的分块上传），否则保存请求中的 file 文件。
+
+    Returns:
+        str: 参考图路径，未提供时返回 None
+    """
+    upload_id = request.form.get('upload_id')
+    if upload_id:
+        return upload_store.resolve(session_id, [upload_id])[0]['file_path']
+    if 'file' in request.files:
+        file = request.files['file']
+        if file and file.filename and allowed_file(file.filename):
+            filename = secure_filename(file.filename)
+            file_id = str(uuid.uuid4())
+            new_filename = f"{file_id}_{filename}"
+            file_path = file_layout.sharded_path(UPLOAD_FOLDER, new_filename)
+            file.save(file_path)
+            return file_path
+    return None
+
 def generate_image_with_gemini(image_path, prompt, api_key=None):
     """使用Gemini API生成图片（已废弃，现在使用AIImageGenerator）"""
     # 这个函数已经不再使用，保留只是为了兼容性
@@ -86,7 +128,7 @@ def generate_image():
         # 保存上传的文件
         filename = secure_filename(file.filename)
         unique_filename = f"{uuid.uuid4()}_{filename}"
-        file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
+        file_path = file_layout.sharded_path(UPLOAD_FOLDER, unique_filename)
         file.save(file_path)
         
         # 调用Gemini API（使用统一的AIImageGenerator）
@@ -94,13 +136,22 @@ def generate_image():
         api_key, api_type = get_api_key_from_request()
         
         from ai_image_generator import create_image_generator
+        # 单图接口默认使用Gemini，Mock API 通过 X-API-Type 选择
+        if api_type != 'mock':
+            api_type = 'gemini'
         # 获取 base_url（可选）
-        base_url = get_base_url_from_request('gemini')
+        base_url = get_base_url_from_request(api_type)
         # 必须提供API key
-        generator = create_image_generator('gemini', api_key, model_name, base_url)
+        # 图片在后台写入，生成线程不等待写盘
+        generator = create_image_generator(api_type, api_key, model_name, base_url, write_behind=True)
         with open(file_path, 'rb') as f:
             file_data = f.read()
-        result = generator.generate_image(file_data, prompt)
+        # 单图请求以交互优先级调度，不会排在其他用户的批量任务之后
+        scheduler_key = request.headers.get('X-Session-ID') or request.remote_addr
+        result = generation_scheduler.submit(
+            scheduler_key, generator.generate_image, file_data, prompt, priority=JobPriority.INTERACTIVE
+        ).result()
+        result = wait_persisted(result)
         
         if result['success']:
             response_data = {
@@ -116,10 +167,9 @@ def generate_image():
             else:
                 # 保存结果描述到文件（如果没有生成图像）
                 result_filename = f"result_{uuid.uuid4()}.txt"
-                result_path = os.path.join(RESULT_FOLDER, result_filename)
-                with open(result_path, 'w', encoding='utf-8') as f:
-                    f.write(result['description'])
-                response_data['result_url'] = f'/static/results/{result_filename}'
+                response_data['result_url'] = result_storage.put(
+                    result_filename, result['description'].encode('utf-8'), 'text/plain; charset=utf-8'
+                )
             
             return jsonify(response_data)
         else:
@@ -128,26 +178,57 @@ def generate_image():
                 'error': result['error']
             }), 500
             
+    except SchedulerShutdown as e:
+        # 进程正在优雅退出，由 nginx / 前端重试到其他 worker
+        return jsonify({'success': False, 'error': str(e)}), 503
     except Exception as e:
         error_msg = str(e)
         app.logger.error(f"Generate image error: {error_msg}")
         return jsonify({'success': False, 'error': f'生成失败: {error_msg}'}), 500
 
+def send_layout_file(folder, filename):
+    """从分层目录返回文件，兼容迁移前的平铺目录"""
+    if filename.startswith('.'):
+        abort(404)
+    relative_path = file_layout.relative_path(folder, filename)
+    try:
+        return send_from_directory(folder, relative_path)
+    except (NotFound, FileNotFoundError):
+        if relative_path != filename:
+            abort(404)
+        # 在平铺目录找到，发送前被迁移命令移入了子目录
+        return send_from_directory(folder, os.path.join(file_layout.shard_dir(filename), filename))
+
 @app.route('/static/uploads/<filename>')
 def uploaded_file(filename):
     """提供上传文件的访问"""
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    return send_layout_file(UPLOAD_FOLDER, filename)
 
 @app.route('/static/results/<filename>')
 def result_file(filename):
-    """提供结果文件的访问"""
-    return send_from_directory(RESULT_FOLDER, filename)
+    """提供结果文件的访问：对象存储重定向到预签名 URL，本地存储直接返回文件"""
+    try:
+        presigned_url = result_storage.presign(filename)
+    except ValueError:
+        abort(404)
+    if presigned_url:
+        return redirect(presigned_url)
+    return send_layout_file(result_storage.folder, filename)
 
 @app.route('/api/health')
 def health_check():
     """健康检查接口"""
     return jsonify({'status': 'healthy', 'message': 'BatchGen Pro MVP is running'})
 
+@app.route('/api/metrics')
+def get_metrics():
+    """当前 worker 进程的运行统计（响应压缩、结果写入）"""
+    return jsonify({
+        'success': True,
+        'compression': response_compressor.stats(),
+        'result_writes': result_writer.stats(),
+    })
+
 # 注意：已移除认证和积分相关API，用户只需提供自己的 API Key 即可使用
 
 def get_session_id_or_abort():
@@ -159,15 +240,25 @@ def get_session_id_or_abort():
 def get_api_key_from_request():
     """从请求header中获取API key和类型"""
     api_key = request.headers.get('X-API-Key')
+    api_type = request.headers.get('X-API-Type', 'gemini')
+    if api_type == 'mock':
+        # Mock API 只在 SUPPORTED_APIS 中显式开启时可用，且不需要 API key
+        if 'mock' not in SUPPORTED_APIS:
+            raise ValueError("Mock API 未启用")
+        return (api_key or '').strip(), api_type
     # 必须提供API key，不再使用服务器配置的key
     if not api_key or not api_key.strip():
         raise ValueError("API Key 未提供，请先在设置中配置 API Key")
     api_key = api_key.strip()
-    api_type = request.headers.get('X-API-Type', 'gemini')
     return api_key, api_type
 
-def get_base_url_from_request(api_type="gemini"):
-    """从请求中获取 base_url 配置"""
+def get_base_url_from_request(api_type="gemini", form=None):
+    """
+    从请求中获取 base_url 配置
+
+    Args:
+        form: 表单字段，默认 request.form；流式接收的接口传入 ingest_multipart 返回的 form
+    """
     # 根据 API 类型选择对应的 header
     if api_type == "gemini":
         header_name = 'X-Gemini-Base-URL'
@@ -182,7 +273,7 @@ def get_base_url_from_request(api_type="gemini"):
     base_url = request.headers.get(header_name)
     if not base_url:
         # 从form data获取
-        base_url = request.form.get(form_key)
+        base_url = (request.form if form is None else form).get(form_key)
     
     # 如果base_url是空字符串，转换为None
     if base_url and base_url.strip():
@@ -192,8 +283,145 @@ def get_base_url_from_request(api_type="gemini"):
     
     return base_url
 
+def use_bulk_mode(form):
+    """
+    读取批量任务的提交模式：online（默认）逐张实时生成，bulk 打包为 API 的离线批量作业（见 bulk_jobs）
+
+    Returns:
+        bool: 是否使用 bulk 模式
+    """
+    mode = form.get('mode', 'online')
+    if mode not in ('online', 'bulk'):
+        raise ValueError(f'Unsupported mode: {mode}')
+    if mode == 'online':
+        return False
+    _, api_type = get_api_key_from_request()
+    if not bulk_supported(api_type, get_base_url_from_request(api_type, form)):
+        raise ValueError(f'{api_type} API 不支持 bulk 模式')
+    return True
+
+def get_task_fields(args):
+    """
+    读取任务查询接口的字段选择：view=summary 只返回摘要字段（与图片数无关），fields=a,b 只返回指定的顶层字段
+
+    Returns:
+        tuple | None: 返回的字段，None 表示返回完整任务
+    """
+    view = args.get('view', 'full')
+    if view not in ('full', 'summary'):
+        raise ValueError(f'Unsupported view: {view}')
+    fields = tuple(field.strip() for field in args.get('fields', '').split(',') if field.strip())
+    if fields:
+        return fields
+    return SUMMARY_FIELDS if view == 'summary' else None
+
+def task_etag(version, variant):
+    """
+    任务数据版本号对应的 ETag，同一版本的不同响应形式（完整、摘要、字段选择、状态）使用不同的 ETag
+
+    Args:
+        version: task_manager 的任务或 session 版本号，None 表示没有版本记录（不使用 ETag）
+        variant: 响应形式，字段元组或字符串
+    """
+    if version is None:
+        return None
+    if isinstance(variant, tuple):
+        variant = format(zlib.crc32(','.join(variant).encode('utf-8')), 'x')
+    return f"{version}-{variant}"
+
+def not_modified(etag):
+    """If-None-Match 与 etag 一致时返回 304 响应，否则返回 None"""
+    if etag is not None and request.if_none_match.contains_weak(etag):
+        return with_etag(app.response_class(status=304), etag)
+    return None
+
+def with_etag(response, etag):
+    """附加弱 ETag，并要求浏览器每次使用缓存前重新验证"""
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 # ==================== V2阶段：批量生成API ====================
 
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    """创建分块上传会话，请求体为 JSON: {"filename": "...", "size": 字节数}"""
+    session_id = get_session_id_or_abort()
+    if not session_id:
+        return jsonify({'success': False, 'error': '缺少 Session-ID'}), 400
+    data = request.get_json(silent=True) or {}
+    try:
+        upload = upload_store.create(session_id, data.get('filename'), data.get('size'))
+        return jsonify({'success': True, 'upload': upload}), 201
+    except UploadError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status_code
+    except Exception as e:
+        app.logger.error(f"Create upload error: {str(e)}")
+        return jsonify({'success': False, 'error': f'创建上传失败: {str(e)}'}), 500
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """上传一块数据，offset 为本块在文件中的起始位置，请求体为原始字节"""
+    session_id = get_session_id_or_abort()
+    if not session_id:
+        return jsonify({'success': False, 'error': '缺少 Session-ID'}), 400
+    try:
+        offset = int(request.args.get('offset', ''))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'offset 必须是整数'}), 400
+    try:
+        upload = upload_store.write_chunk(session_id, upload_id, offset, request.stream, request.content_length)
+        return jsonify({'success': True, 'upload': upload})
+    except UploadError as e:
+        return jsonify({'success': False, 'error': str(e), **e.details}), e.status_code
+    except Exception as e:
+        app.logger.error(f"Upload chunk error: {str(e)}")
+        return jsonify({'success': False, 'error': f'上传失败: {str(e)}'}), 500
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """查询上传状态，中断后从返回的 offset 继续上传"""
+    session_id = get_session_id_or_abort()
+    if not session_id:
+        return jsonify({'success': False, 'error': '缺少 Session-ID'}), 400
+    try:
+        return jsonify({'success': True, 'upload': upload_store.get(session_id, upload_id)})
+    except UploadError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status_code
+    except Exception as e:
+        app.logger.error(f"Get upload error: {str(e)}")
+        return jsonify({'success': False, 'error': f'获取上传状态失败: {str(e)}'}), 500
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """完成上传，之后可在批量接口中通过 upload_ids / upload_id 引用"""
+    session_id = get_session_id_or_abort()
+    if not session_id:
+        return jsonify({'success': False, 'error': '缺少 Session-ID'}), 400
+    try:
+        return jsonify({'success': True, 'upload': upload_store.complete(session_id, upload_id)})
+    except UploadError as e:
+        return jsonify({'success': False, 'error': str(e), **e.details}), e.status_code
+    except Exception as e:
+        app.logger.error(f"Complete upload error: {str(e)}")
+        return jsonify({'success': False, 'error': f'完成上传失败: {str(e)}'}), 500
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def delete_upload(upload_id):
+    """放弃未完成的上传"""
+    session_id = get_session_id_or_abort()
+    if not session_id:
+        return jsonify({'success': False, 'error': '缺少 Session-ID'}), 400
+    try:
+        upload_store.delete(session_id, upload_id)
+        return jsonify({'success': True})
+    except UploadError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status_code
+    except Exception as e:
+        app.logger.error(f"Delete upload error: {str(e)}")
+        return jsonify({'success': False, 'error': f'删除上传失败: {str(e)}'}), 500
+
 @app.route('/api/batch/generate', methods=['POST'])
 def create_batch_task():
     """创建批量生成任务（需要登录）"""
@@ -208,73 +436,58 @@ def create_batch_task():
         return jsonify({'success': False, 'error': str(e)}), 400
     
     try:
-        # 检查是否有文件
-        if 'files' not in request.files:
-            return jsonify({'error': 'No files provided'}), 400
+        import json
         
-        files = request.files.getlist('files')
-        prompt = request.form.get('prompt', '')
-        api_type = request.form.get('api_type', 'gemini')
+        # 流式接收请求：图片边接收边写入 UPLOAD_FOLDER，不经过 request.files
+        form, files = ingest_multipart(request.environ, file_fields=('files',), max_files=MAX_BATCH_ITEMS)
         
-        if not files or all(file.filename == '' for file in files):
-            return jsonify({'error': 'No files selected'}), 400
+        def reject(message):
+            discard_files(files)
+            return jsonify({'error': message}), 400
         
-        if not prompt.strip():
-            return jsonify({'error': 'Prompt is required'}), 400
+        # 图片可以直接随请求上传（files），也可以引用已完成的分块上传（upload_ids，JSON 数组）
+        upload_ids = None
+        if form.get('upload_ids'):
+            try:
+                upload_ids = json.loads(form['upload_ids'])
+            except ValueError:
+                return reject('Invalid upload_ids format')
+            if not isinstance(upload_ids, list) or not upload_ids:
+                return reject('upload_ids must be a non-empty list')
         
-        if api_type not in SUPPORTED_APIS:
-            return jsonify({'error': f'Unsupported API type: {api_type}'}), 400
+        prompt = form.get('prompt', '')
+        api_type = form.get('api_type', 'gemini')
         
-        # 验证文件
-        valid_files = []
-        for file in files:
-            if file and file.filename and allowed_file(file.filename):
-                valid_files.append(file)
+        if upload_ids is None and not files:
+            return reject('No valid files provided')
         
-        if not valid_files:
-            return jsonify({'error': 'No valid files provided'}), 400
+        if not prompt.strip():
+            return reject('Prompt is required')
         
-        # 获取模型名称
-        model_name = request.form.get('model_name')
-        if not model_name:
-            model_name = 'gemini-2.5-flash-image'  # 默认模型
+        if api_type not in SUPPORTED_APIS:
+            return reject(f'Unsupported API type: {api_type}')
         
-        # 准备图片数据
-        image_count = len(valid_files)
-        images_data = []
-        for file in valid_files:
-            filename = secure_filename(file.filename)
-            file_id = str(uuid.uuid4())
-            new_filename = f"{file_id}_{filename}"
-            
-            # 保存文件
-            file_path = os.path.join(UPLOAD_FOLDER, new_filename)
-            file.save(file_path)
-            
-            # 读取文件数据
-            with open(file_path, 'rb') as f:
-                file_data = f.read()
-            
-            images_data.append({
-                'filename': filename,
-                'file_data': file_data,
-                'file_path': file_path
-            })
+        if upload_ids is not None and len(upload_ids) > MAX_BATCH_ITEMS:
+            return reject(f'Maximum {MAX_BATCH_ITEMS} images allowed')
         
-        # 创建批量任务
-        task_id, task_data = task_manager.create_task(session_id, images_data, prompt, api_type)
+        try:
+            bulk = use_bulk_mode(form)
+        except ValueError as e:
+            return reject(str(e))
+        
+        # 准备图片数据：图片已在磁盘上，生成时再逐张读取
+        if upload_ids is not None:
+            discard_files(files)
+            images_data = upload_store.resolve(session_id, upload_ids)
+        else:
+            images_data = [ingested.to_image_data() for ingested in files]
         
-        # 添加items字段，让前端能够显示所有任务项
-        task_data['items'] = []
-        for i, image in enumerate(images_data):
-            task_data['items'].append({
-                'index': i,
-                'prompt': prompt,
-                'status': 'pending'
-            })
+        # 创建批量任务（包含每张图片的条目，前端据此显示所有任务项）
+        task_id, task_data = task_manager.create_task(session_id, images_data, prompt, api_type)
         
-        # 更新任务状态为处理中，并保存items
-        task_manager.update_task_status(session_id, task_id, TaskStatus.PROCESSING, items=task_data['items'])
+        # 更新任务状态为处理中
+        task_manager.update_task_status(session_id, task_id, TaskStatus.PROCESSING)
+        task_data['status'] = TaskStatus.PROCESSING.value
         
         # 获取API key和模型名称
         api_key, request_api_type = get_api_key_from_request()
@@ -283,24 +496,21 @@ def create_batch_task():
             api_type = request_api_type
         
         # 获取模型名称
-        model_name = request.form.get('model_name')
-        
-        # 获取 base_url 配置（可选，用于第三方 API）
-        base_url = get_base_url_from_request(api_type)
-        
-        # 暂时使用同步处理，避免Celery复杂性
-        try:
-            # 直接调用处理函数
-            from tasks import process_batch_task_sync
-            result = process_batch_task_sync(session_id, task_id, images_data, prompt, api_type, api_key, model_name, base_url)
-            
-            if result['success']:
-                task_manager.update_task_status(session_id, task_id, TaskStatus.COMPLETED)
-            else:
-                task_manager.update_task_status(session_id, task_id, TaskStatus.FAILED)
-        except Exception as e:
-            app.logger.error(f"Batch processing error: {str(e)}")
-            task_manager.update_task_status(session_id, task_id, TaskStatus.FAILED)
+        model_name = form.get('model_name')
+        
+        # 获取 base_url 配置（可选，用于第三方 API），请求体已由 ingest_multipart 读取，不能再访问 request.form
+        base_url = get_base_url_from_request(api_type, form)
+        
+        # 在后台处理，接口立即返回，前端轮询任务状态
+        from tasks import process_batch_task_sync, process_bulk_job_sync, start_batch_in_background
+        if bulk:
+            start_batch_in_background(session_id, task_id, process_bulk_job_sync,
+                                      [(i, image_data['filename'], image_data['file_path'], prompt, False)
+                                       for i, image_data in enumerate(images_data)],
+                                      api_type, api_key, model_name, base_url)
+        else:
+            start_batch_in_background(session_id, task_id, process_batch_task_sync,
+                                      images_data, prompt, api_type, api_key, model_name, base_url)
         
         return jsonify({
             'success': True,
@@ -309,6 +519,8 @@ def create_batch_task():
             'task_data': task_data
         })
         
+    except (UploadError, IngestError) as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status_code
     except Exception as e:
         app.logger.error(f"Create batch task error: {str(e)}")
         return jsonify({'success': False, 'error': f'创建任务失败: {str(e)}'}), 500
@@ -316,10 +528,6 @@ def create_batch_task():
 @app.route('/api/batch/generate-from-image', methods=['POST'])
 def create_batch_generate_task():
     """创建批量生图任务（同一参考图重复生成N次，需要登录）"""
-    import time
-    request_time = time.strftime('%Y-%m-%d %H:%M:%S')
-    print(f"\n[{request_time}] ========== 收到批量生图请求 ==========")
-    
     session_id = get_session_id_or_abort()
     if not session_id:
         return jsonify({'error': '缺少 Session-ID'}), 400
@@ -335,59 +543,37 @@ def create_batch_generate_task():
         image_count = int(request.form.get('image_count', 1))
         api_type = request.form.get('api_type', 'gemini')
         
-        print(f"  请求参数:")
-        print(f"    session_id: {session_id}")
-        print(f"    api_type: {api_type}")
-        print(f"    prompt: {prompt[:50]}...")
-        print(f"    image_count: {image_count}")
-        
         if not prompt.strip():
             return jsonify({'error': 'Prompt is required'}), 400
         
-        if image_count < 1 or image_count > 10:
-            return jsonify({'error': 'Image count must be between 1 and 10'}), 400
+        if image_count < 1 or image_count > MAX_BATCH_ITEMS:
+            return jsonify({'error': f'Image count must be between 1 and {MAX_BATCH_ITEMS}'}), 400
         
         if api_type not in SUPPORTED_APIS:
             return jsonify({'error': f'Unsupported API type: {api_type}'}), 400
         
+        try:
+            bulk = use_bulk_mode(request.form)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         # 获取模型名称
         model_name = request.form.get('model_name')
         if not model_name:
             model_name = 'gemini-2.5-flash-image'  # 默认模型
         
-        # 参考图是可选的
-        reference_image_data = None
-        if 'file' in request.files:
-            file = request.files['file']
-            if file and file.filename and allowed_file(file.filename):
-                # 保存参考图片
-                filename = secure_filename(file.filename)
-                file_id = str(uuid.uuid4())
-                new_filename = f"{file_id}_{filename}"
-                file_path = os.path.join(UPLOAD_FOLDER, new_filename)
-                file.save(file_path)
-                
-                # 读取参考图数据
-                with open(file_path, 'rb') as f:
-                    reference_image_data = f.read()
+        # 参考图是可选的，只保存到磁盘，生成每张图片时再读取
+        reference_image_path = save_reference_image(session_id)
         
         # 创建虚拟的images_data用于任务管理
         images_data = [{'filename': f'generated_{i+1}.png'} for i in range(image_count)]
         
-        # 创建批量任务
+        # 创建批量任务（包含每张图片的条目，前端据此显示所有任务项）
         task_id, task_data = task_manager.create_task(session_id, images_data, prompt, api_type)
         
-        # 添加items字段，让前端能够显示所有任务项
-        task_data['items'] = []
-        for i in range(image_count):
-            task_data['items'].append({
-                'index': i,
-                'prompt': prompt,
-                'status': 'pending'
-            })
-        
-        # 更新任务状态为处理中，并保存items
-        task_manager.update_task_status(session_id, task_id, TaskStatus.PROCESSING, items=task_data['items'])
+        # 更新任务状态为处理中
+        task_manager.update_task_status(session_id, task_id, TaskStatus.PROCESSING)
+        task_data['status'] = TaskStatus.PROCESSING.value
         
         # 获取API key和模型名称
         api_key, request_api_type = get_api_key_from_request()
@@ -397,27 +583,25 @@ def create_batch_generate_task():
         
         # 获取模型名称
         model_name = request.form.get('model_name')
-        print(f"    model_name: {model_name}")
         
         # 获取 base_url 配置（可选，用于第三方 API）
         base_url = get_base_url_from_request(api_type)
-        print(f"    base_url: {base_url}")
-        print(f"    api_key: {api_key[:30] + '...' if api_key else 'None'}")
         
-        # 同步处理批量生图
-        try:
-            print(f"  开始处理任务...")
-            from tasks import process_batch_generate_sync
-            result = process_batch_generate_sync(session_id, task_id, reference_image_data, prompt, image_count, api_type, api_key, model_name, base_url)
-            print(f"  处理结果: success={result.get('success')}")
-            
-            if result['success']:
-                task_manager.update_task_status(session_id, task_id, TaskStatus.COMPLETED)
-            else:
-                task_manager.update_task_status(session_id, task_id, TaskStatus.FAILED)
-        except Exception as e:
-            app.logger.error(f"Batch generate processing error: {str(e)}")
-            task_manager.update_task_status(session_id, task_id, TaskStatus.FAILED)
+        logger.info("批量生图任务已创建", extra={
+            'session_id': session_id, 'task_id': task_id, 'api_type': api_type, 'model_name': model_name,
+            'base_url': base_url, 'image_count': image_count, 'bulk': bulk
+        })
+        
+        # 在后台处理批量生图，接口立即返回，前端轮询任务状态
+        from tasks import process_batch_generate_sync, process_bulk_job_sync, start_batch_in_background
+        if bulk:
+            start_batch_in_background(session_id, task_id, process_bulk_job_sync,
+                                      [(i, f'generated_{i+1}.png', reference_image_path, prompt, False)
+                                       for i in range(image_count)],
+                                      api_type, api_key, model_name, base_url)
+        else:
+            start_batch_in_background(session_id, task_id, process_batch_generate_sync,
+                                      reference_image_path, prompt, image_count, api_type, api_key, model_name, base_url)
         
         return jsonify({
             'success': True,
@@ -426,6 +610,8 @@ def create_batch_generate_task():
             'task_data': task_data
         })
         
+    except UploadError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status_code
     except Exception as e:
         app.logger.error(f"Create batch generate task error: {str(e)}")
         return jsonify({'success': False, 'error': f'创建任务失败: {str(e)}'}), 500
@@ -461,12 +647,17 @@ def create_batch_generate_multi_prompt_task():
         if not isinstance(prompts, list) or len(prompts) == 0:
             return jsonify({'error': 'Prompts must be a non-empty list'}), 400
         
-        if len(prompts) > 10:
-            return jsonify({'error': 'Maximum 10 prompts allowed'}), 400
+        if len(prompts) > MAX_BATCH_ITEMS:
+            return jsonify({'error': f'Maximum {MAX_BATCH_ITEMS} prompts allowed'}), 400
         
         if api_type not in SUPPORTED_APIS:
             return jsonify({'error': f'Unsupported API type: {api_type}'}), 400
         
+        try:
+            bulk = use_bulk_mode(request.form)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         # 获取模型名称
         model_name = request.form.get('model_name')
         if not model_name:
@@ -474,39 +665,18 @@ def create_batch_generate_multi_prompt_task():
         
         image_count = len(prompts)
         
-        # 参考图是可选的
-        reference_image_data = None
-        if 'file' in request.files:
-            file = request.files['file']
-            if file and file.filename and allowed_file(file.filename):
-                # 保存参考图片
-                filename = secure_filename(file.filename)
-                file_id = str(uuid.uuid4())
-                new_filename = f"{file_id}_{filename}"
-                file_path = os.path.join(UPLOAD_FOLDER, new_filename)
-                file.save(file_path)
-                
-                # 读取参考图数据
-                with open(file_path, 'rb') as f:
-                    reference_image_data = f.read()
+        # 参考图是可选的，只保存到磁盘，生成每张图片时再读取
+        reference_image_path = save_reference_image(session_id)
         
-        # 创建虚拟的images_data用于任务管理
-        images_data = [{'filename': f'generated_{i+1}.png'} for i in range(len(prompts))]
+        # 创建虚拟的images_data用于任务管理，每个item保存自己的prompt，让前端能够显示
+        images_data = [{'filename': f'generated_{i+1}.png', 'prompt': prompt} for i, prompt in enumerate(prompts)]
         
         # 创建批量任务（使用第一个prompt作为任务prompt）
         task_id, task_data = task_manager.create_task(session_id, images_data, prompts[0], api_type)
         
-        # 立即添加每个item的prompt信息，让前端能够显示
-        task_data['items'] = []
-        for i, prompt in enumerate(prompts):
-            task_data['items'].append({
-                'index': i,
-                'prompt': prompt,
-                'status': 'pending'
-            })
-        
-        # 保存items到Redis
-        task_manager.update_task_status(session_id, task_id, TaskStatus.PROCESSING, items=task_data['items'])
+        # 更新任务状态为处理中
+        task_manager.update_task_status(session_id, task_id, TaskStatus.PROCESSING)
+        task_data['status'] = TaskStatus.PROCESSING.value
         
         # 获取API key和模型名称
         api_key, request_api_type = get_api_key_from_request()
@@ -520,18 +690,16 @@ def create_batch_generate_multi_prompt_task():
         # 获取 base_url 配置（可选，用于第三方 API）
         base_url = get_base_url_from_request(api_type)
         
-        # 同步处理批量生图（使用多个prompt）
-        try:
-            from tasks import process_batch_generate_multi_prompt_sync
-            result = process_batch_generate_multi_prompt_sync(session_id, task_id, reference_image_data, prompts, api_type, api_key, model_name, base_url)
-            
-            if result['success']:
-                task_manager.update_task_status(session_id, task_id, TaskStatus.COMPLETED)
-            else:
-                task_manager.update_task_status(session_id, task_id, TaskStatus.FAILED)
-        except Exception as e:
-            app.logger.error(f"Batch generate multi-prompt processing error: {str(e)}")
-            task_manager.update_task_status(session_id, task_id, TaskStatus.FAILED)
+        # 在后台处理批量生图（使用多个prompt），接口立即返回，前端轮询任务状态
+        from tasks import process_batch_generate_multi_prompt_sync, process_bulk_job_sync, start_batch_in_background
+        if bulk:
+            start_batch_in_background(session_id, task_id, process_bulk_job_sync,
+                                      [(i, f'generated_{i+1}.png', reference_image_path, prompt, True)
+                                       for i, prompt in enumerate(prompts)],
+                                      api_type, api_key, model_name, base_url)
+        else:
+            start_batch_in_background(session_id, task_id, process_batch_generate_multi_prompt_sync,
+                                      reference_image_path, prompts, api_type, api_key, model_name, base_url)
         
         return jsonify({
             'success': True,
@@ -540,22 +708,35 @@ def create_batch_generate_multi_prompt_task():
             'task_data': task_data
         })
         
+    except UploadError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status_code
     except Exception as e:
         app.logger.error(f"Create batch generate multi-prompt task error: {str(e)}")
         return jsonify({'success': False, 'error': f'创建任务失败: {str(e)}'}), 500
 
 @app.route('/api/batch/tasks', methods=['GET'])
 def get_batch_tasks():
-    """获取所有批量任务列表"""
+    """获取所有批量任务列表（支持 view=summary / fields=）"""
     session_id = get_session_id_or_abort()
     if not session_id:
         return jsonify({'success': False, 'error': '缺少 Session-ID'}), 400
     try:
-        tasks = task_manager.get_all_tasks(session_id)
-        return jsonify({
+        fields = get_task_fields(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    try:
+        # 先读版本号再读数据：读取期间有写入时返回的 ETag 偏旧，下次轮询会取回新数据
+        # 任务过期（TTL）时版本号不变，ETag 同时包含现有任务的 ID，过期的任务不会一直通过 304 留在列表中
+        task_ids = task_manager.get_task_ids(session_id)
+        etag = task_etag(task_manager.get_session_version(session_id), (*(fields or ('full',)), *task_ids))
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        tasks = task_manager.get_all_tasks(session_id, fields)
+        return with_etag(jsonify({
             'success': True,
             'tasks': tasks
-        })
+        }), etag)
     except redis.ConnectionError as e:
         app.logger.error(f"Redis connection error: {str(e)}")
         return jsonify({'success': False, 'error': 'Redis连接失败，请检查Redis服务是否运行'}), 500
@@ -565,25 +746,98 @@ def get_batch_tasks():
         app.logger.error(traceback.format_exc())
         return jsonify({'success': False, 'error': f'获取任务列表失败: {str(e)}'}), 500
 
+@app.route('/api/batch/queue', methods=['GET'])
+def get_batch_queue():
+    """获取当前用户在生成调度器中的排队情况"""
+    session_id = get_session_id_or_abort()
+    if not session_id:
+        return jsonify({'success': False, 'error': '缺少 Session-ID'}), 400
+    return jsonify({
+        'success': True,
+        'queue': generation_scheduler.queue_depths(session_id),
+        'scheduler': generation_scheduler.stats()
+    })
+
 @app.route('/api/batch/tasks/<task_id>', methods=['GET'])
 def get_batch_task(task_id):
-    """获取特定任务详情"""
+    """获取特定任务详情（支持 view=summary / fields=）"""
     session_id = get_session_id_or_abort()
     if not session_id:
         return jsonify({'success': False, 'error': '缺少 Session-ID'}), 400
     try:
-        task_data = task_manager.get_task(session_id, task_id)
+        fields = get_task_fields(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    try:
+        version = task_manager.get_task_version(session_id, task_id)
+        etag = task_etag(version, fields or 'full')
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        task_data = task_manager.get_task(session_id, task_id, fields=fields)
         if task_data:
-            return jsonify({
+            return with_etag(jsonify({
                 'success': True,
-                'task': task_data
-            })
+                'task': task_data,
+                'version': version
+            }), etag)
         else:
             return jsonify({'success': False, 'error': '任务不存在'}), 404
     except Exception as e:
         app.logger.error(f"Get batch task error: {str(e)}")
         return jsonify({'success': False, 'error': f'获取任务详情失败: {str(e)}'}), 500
 
+@app.route('/api/batch/tasks/<task_id>/items', methods=['GET'])
+def get_batch_task_items(task_id):
+    """分页获取任务的图片条目（大任务的详情中不附带条目）"""
+    session_id = get_session_id_or_abort()
+    if not session_id:
+        return jsonify({'success': False, 'error': '缺少 Session-ID'}), 400
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = min(max(1, int(request.args.get('limit', 100))), 500)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'offset 和 limit 必须是整数'}), 400
+    try:
+        task_data = task_manager.get_task(session_id, task_id, include_items=False)
+        if not task_data:
+            return jsonify({'success': False, 'error': '任务不存在'}), 404
+        return jsonify({
+            'success': True,
+            'items': task_manager.get_items(session_id, task_id, offset, limit),
+            'offset': offset,
+            'limit': limit,
+            'total': task_data['total_images']
+        })
+    except Exception as e:
+        app.logger.error(f"Get batch task items error: {str(e)}")
+        return jsonify({'success': False, 'error': f'获取任务条目失败: {str(e)}'}), 500
+
+@app.route('/api/batch/tasks/<task_id>/changes', methods=['GET'])
+def get_batch_task_changes(task_id):
+    """
+    增量获取任务的变化：since 为上次获取时的 version（任务详情返回的 version），
+    只返回之后变化的图片条目和任务摘要；resync 为 True 时需重新获取详情 / 全部条目
+    """
+    session_id = get_session_id_or_abort()
+    if not session_id:
+        return jsonify({'success': False, 'error': '缺少 Session-ID'}), 400
+    try:
+        since = int(request.args.get('since', ''))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'since 必须是整数'}), 400
+    try:
+        changes = task_manager.get_changes(session_id, task_id, since)
+        if changes is None:
+            return jsonify({'success': False, 'error': '任务不存在'}), 404
+        task_data = task_manager.get_task(session_id, task_id, fields=SUMMARY_FIELDS)
+        if not task_data:
+            return jsonify({'success': False, 'error': '任务不存在'}), 404
+        return jsonify({'success': True, 'task': task_data, **changes})
+    except Exception as e:
+        app.logger.error(f"Get batch task changes error: {str(e)}")
+        return jsonify({'success': False, 'error': f'获取任务变化失败: {str(e)}'}), 500
+
 @app.route('/api/batch/tasks/<task_id>/status', methods=['GET'])
 def get_batch_task_status(task_id):
     """获取任务状态"""
@@ -591,15 +845,21 @@ def get_batch_task_status(task_id):
     if not session_id:
         return jsonify({'success': False, 'error': '缺少 Session-ID'}), 400
     try:
-        task_data = task_manager.get_task(session_id, task_id)
+        etag = task_etag(task_manager.get_task_version(session_id, task_id), 'status')
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        # 状态轮询只读取任务摘要，不读取图片条目
+        task_data = task_manager.get_task(session_id, task_id, include_items=False)
         if task_data:
-            return jsonify({
+            return with_etag(jsonify({
                 'success': True,
                 'status': task_data['status'],
                 'progress': task_data['progress'],
                 'processed_images': task_data['processed_images'],
+                'failed_images': task_data.get('failed_images', 0),
                 'total_images': task_data['total_images']
-            })
+            }), etag)
         else:
             return jsonify({'success': False, 'error': '任务不存在'}), 404
     except Exception as e:
@@ -633,7 +893,7 @@ def get_batch_task_results(task_id):
     if not session_id:
         return jsonify({'success': False, 'error': '缺少 Session-ID'}), 400
     try:
-        task_data = task_manager.get_task(session_id, task_id)
+        task_data = task_manager.get_task(session_id, task_id, include_items=True)
         if task_data:
             return jsonify({
                 'success': True,
@@ -647,6 +907,7 @@ def get_batch_task_results(task_id):
         return jsonify({'success': False, 'error': f'获取任务结果失败: {str(e)}'}), 500
 
 if __name__ == '__main__':
+    # Flask 开发服务器，仅用于本地开发；生产环境使用 gunicorn -c gunicorn.conf.py app:app
     # 检查是否为Docker环境
     is_docker = os.path.exists('/.dockerenv')
     debug_mode = os.getenv('FLASK_ENV') != 'production'
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+异步AI图片生成客户端
+
+AIImageGenerator 的 asyncio 版本，返回值与同步版本完全一致。
+模型调用几乎全部时间在等待网络（Gemini 第三方接口最长600秒，豆包60秒），
+同步版本每个进行中的调用都要占用一个线程；异步版本在单个事件循环中即可同时保持数百个调用，
+所有调用共享同一个 httpx 连接池，连接数上限由 ASYNC_MAX_CONNECTIONS 控制。
+
+用法:
+    generator = create_async_image_generator("doubao", api_key)
+    result = await generator.generate_image(image_data, prompt)
+    results = await generate_many(generator, [(image_data, prompt), ...], concurrency=100)
+"""
+import asyncio
+import base64
+import json
+import os
+import random
+import uuid
+import weakref
+
+import httpx
+
+from ai_image_generator import (
+    AIImageGenerator,
+    MOCK_FAILURE_ERROR,
+    _DOUBAO_URL_ONLY_ENDPOINTS,
+    _doubao_format_rejected,
+    _inline_data_size,
+)
+from inline_image_decoder import InlineImageExtractor
+from provider_trace import new_call_id, trace_call
+
+# 每个事件循环共享的连接池上限
+ASYNC_MAX_CONNECTIONS = int(os.getenv('ASYNC_MAX_CONNECTIONS', 200))
+ASYNC_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('ASYNC_MAX_KEEPALIVE_CONNECTIONS', 50))
+# 连接池已满时等待空闲连接的最长时间（秒），超过后调用失败而不是无限排队
+ASYNC_POOL_TIMEOUT = float(os.getenv('ASYNC_POOL_TIMEOUT', 600))
+
+# 与同步版本一致的超时
+GEMINI_HTTP_TIMEOUT = 600.0
+DOUBAO_TIMEOUT = 60.0
+DOUBAO_DOWNLOAD_TIMEOUT = 30.0
+
+# API类型 -> 异步生成方法，初始化沿用 ai_image_generator.PROVIDERS
+ASYNC_PROVIDERS = {
+    "gemini": "_agenerate_with_gemini",
+    "doubao": "_agenerate_with_doubao",
+    "mock": "_agenerate_with_mock",
+}
+
+# httpx.AsyncClient 绑定在创建它的事件循环上，因此按事件循环各保留一个
+_http_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_http_client():
+    """返回当前事件循环共享的 httpx.AsyncClient"""
+    loop = asyncio.get_running_loop()
+    client = _http_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=ASYNC_MAX_KEEPALIVE_CONNECTIONS,
+            ),
+            timeout=httpx.Timeout(GEMINI_HTTP_TIMEOUT, pool=ASYNC_POOL_TIMEOUT),
+        )
+        _http_clients[loop] = client
+    return client
+
+
+async def close_async_http_client():
+    """关闭当前事件循环的共享连接池（事件循环结束前调用）"""
+    loop = asyncio.get_running_loop()
+    client = _http_clients.pop(loop, None)
+    if client is not None:
+        await client.aclose()
+
+
+class AsyncAIImageGenerator(AIImageGenerator):
+    """
+    异步AI图片生成器
+
+    初始化、参数校验和请求构建沿用 AIImageGenerator，只有网络调用和写文件改为异步。
+    同一个实例可以被多个协程并发使用。
+    """
+
+    async def generate_image(self, image_data, prompt):
+        """
+        生成图片的统一接口
+
+        Args:
+            image_data: 原始图片的二进制数据（可选，None表示纯文本生成）
+            prompt: 生成提示词
+
+        Returns:
+            dict: 包含生成结果的字典，与 AIImageGenerator.generate_image 相同
+        """
+        # 并发调用共享实例，调用标识通过参数传递而不是保存在实例上
+        call_id = new_call_id()
+        if self.api_type in ASYNC_PROVIDERS:
+            if image_data:
+                image_data = await asyncio.to_thread(self.prepare_input, image_data)
+            return await getattr(self, ASYNC_PROVIDERS[self.api_type])(image_data, prompt, call_id)
+        else:
+            return {
+                "success": False,
+                "error": f"不支持的API类型: {self.api_type}"
+            }
+
+    async def _save_generated_image(self, prefix, data, extension="png"):
+        """在线程中写入生成的图片，避免大文件写入或上传阻塞事件循环"""
+        generated_filename = f"{prefix}_generated_{uuid.uuid4()}.{extension}"
+        await asyncio.to_thread(self.result_storage.put, generated_filename, data)
+        return generated_filename
+
+    async def _agenerate_with_gemini(self, image_data, prompt, call_id):
+        """使用Gemini API生成图片（官方 API 使用 genai 的 aio 接口）"""
+        try:
+            if self.use_custom_base_url:
+                return await self._agenerate_with_gemini_http(image_data, prompt, call_id)
+
+            contents = await asyncio.to_thread(self._gemini_sdk_contents, image_data, prompt)
+
+            with trace_call("gemini", self.model, "generate", call_id) as span:
+                response = await self.client.aio.models.generate_content(
+                    model=self.model,
+                    contents=contents
+                )
+                span.sdk_response(len(image_data) if image_data else 0, _inline_data_size(response))
+
+            if response and hasattr(response, 'candidates') and response.candidates:
+                candidate = response.candidates[0]
+                if hasattr(candidate, 'content') and candidate.content:
+                    for part in candidate.content.parts:
+                        if hasattr(part, 'inline_data') and part.inline_data:
+                            generated_filename = await self._save_generated_image("gemini", part.inline_data.data)
+                            return {
+                                "success": True,
+                                "description": f"成功使用Gemini API生成图片: {prompt}",
+                                "generated_image_url": self.result_storage.url(generated_filename),
+                                "api_type": "gemini",
+                                "note": "图片已使用Gemini API生成"
+                            }
+
+            return {
+                "success": True,
+                "description": f"Gemini处理了图片: {prompt}，但未生成新图片",
+                "generated_image_url": None,
+                "api_type": "gemini",
+                "note": "Gemini API返回文本描述，未生成图片"
+            }
+
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"Gemini API调用失败: {str(e)}",
+                "api_type": "gemini"
+            }
+
+    async def _agenerate_with_gemini_http(self, image_data, prompt, call_id):
+        """使用 HTTP 请求调用第三方 Gemini API（Google 原生 REST API 格式）"""
+        try:
+            # 请求体包含 base64 图片，构建放到线程中执行
+            endpoint, headers, payload = await asyncio.to_thread(self._gemini_http_request, image_data, prompt)
+
+            client = get_async_http_client()
+            with trace_call("gemini", self.model, "generate", call_id) as span:
+                response = await client.post(
+                    endpoint,
+                    headers=headers,
+                    json=payload,
+                    timeout=httpx.Timeout(GEMINI_HTTP_TIMEOUT, pool=ASYNC_POOL_TIMEOUT)
+                )
+                span.response(response)
+
+            if response.status_code == 200:
+                # 响应中包含 base64 编码的整张图片（几 MB），在线程中解析，避免阻塞事件循环
+                response_data = await asyncio.to_thread(response.json)
+
+                if "candidates" in response_data and len(response_data["candidates"]) > 0:
+                    candidate = response_data["candidates"][0]
+                    if "content" in candidate and "parts" in candidate["content"]:
+                        for part in candidate["content"]["parts"]:
+                            if "inlineData" in part:
+                                data = part["inlineData"].get("data", "")
+                                image_bytes = await asyncio.to_thread(base64.b64decode, data)
+                                generated_filename = await self._save_generated_image("gemini", image_bytes)
+                                return {
+                                    "success": True,
+                                    "description": f"成功使用第三方 Gemini API 生成图片: {prompt}",
+                                    "generated_image_url": self.result_storage.url(generated_filename),
+                                    "api_type": "gemini",
+                                    "note": "图片已使用第三方 Gemini API 生成"
+                                }
+
+                return {
+                    "success": False,
+                    "error": "第三方 Gemini API 响应中未找到图片数据",
+                    "api_type": "gemini"
+                }
+            else:
+                return {
+                    "success": False,
+                    "error": f"第三方 Gemini API 请求失败: {response.status_code} - {response.text}",
+                    "api_type": "gemini"
+                }
+
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"第三方 Gemini API 调用失败: {str(e)}",
+                "api_type": "gemini"
+            }
+
+    async def _agenerate_with_doubao(self, image_data, prompt, call_id):
+        """使用豆包API生成图片，b64_json 模式被中转服务拒绝时自动改用 url 模式重试"""
+        try:
+            endpoint, request_data = await asyncio.to_thread(self._doubao_request, image_data, prompt)
+            result, rejected = await self._apost_doubao(endpoint, request_data, prompt, call_id)
+            if rejected:
+                request_data["response_format"] = "url"
+                result, _ = await self._apost_doubao(endpoint, request_data, prompt, call_id)
+                if result.get("success"):
+                    _DOUBAO_URL_ONLY_ENDPOINTS.add(endpoint)
+            return result
+
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"豆包API调用失败: {str(e)}",
+                "api_type": "doubao"
+            }
+
+    async def _apost_doubao(self, endpoint, request_data, prompt, call_id):
+        """
+        发送豆包生成请求并处理响应
+
+        b64_json 模式下流式读取响应，图片边接收边解码写入结果存储。写入在线程中执行：
+        S3 存储的 writer 缓存满一个分段后同步上传，不能阻塞事件循环
+
+        Returns:
+            tuple: (结果, b64_json 模式是否被拒绝)
+        """
+        inline = request_data["response_format"] == "b64_json"
+        client = get_async_http_client()
+        with trace_call("doubao", self.model, "generate", call_id) as span:
+            async with client.stream(
+                "POST",
+                endpoint,
+                headers=self.headers,
+                json=request_data,
+                timeout=httpx.Timeout(DOUBAO_TIMEOUT, pool=ASYNC_POOL_TIMEOUT)
+            ) as response:
+                if inline and response.status_code == 200:
+                    # 只使用第一张图片，多返回的图片不写入
+                    extractor = InlineImageExtractor(self.result_storage, "doubao", max_images=1)
+                    writing = None
+                    try:
+                        async for chunk in response.aiter_bytes(64 * 1024):
+                            writing = asyncio.ensure_future(asyncio.to_thread(extractor.feed, chunk))
+                            await asyncio.shield(writing)
+                        writing = asyncio.ensure_future(asyncio.to_thread(extractor.close))
+                        response_data = json.loads(await asyncio.shield(writing))
+                    except BaseException:
+                        # 被取消时线程中的 feed / close 可能仍在执行，等它结束后再删除已写入的文件
+                        if writing is not None:
+                            await asyncio.wait([writing])
+                        await asyncio.to_thread(extractor.abort)
+                        raise
+                    span.response(response, response_bytes=extractor.bytes_received)
+                else:
+                    await response.aread()
+                    span.response(response)
+
+        if response.status_code != 200:
+            if inline and _doubao_format_rejected(response.status_code, response.text):
+                return None, True
+            return {
+                "success": False,
+                "error": f"豆包API请求失败: {response.status_code} - {response.text}",
+                "api_type": "doubao"
+            }, False
+        if not inline:
+            response_data = response.json()
+
+        entries = response_data.get("data") or []
+        if not entries:
+            return {
+                "success": False,
+                "error": "豆包API响应格式异常",
+                "api_type": "doubao"
+            }, False
+        if entries[0].get("b64_json"):
+            return self._doubao_image_result(entries[0]["b64_json"], prompt), False
+        if "url" not in entries[0]:
+            return {
+                "success": False,
+                "error": "豆包API响应中未找到图片URL",
+                "api_type": "doubao"
+            }, False
+        return await self._asave_doubao_image(entries[0]["url"], prompt, call_id), False
+
+    async def _asave_doubao_image(self, image_url, prompt, call_id):
+        """下载并保存豆包生成的图片"""
+        try:
+            client = get_async_http_client()
+            with trace_call("doubao", self.model, "download", call_id) as span:
+                img_response = await client.get(
+                    image_url,
+                    timeout=httpx.Timeout(DOUBAO_DOWNLOAD_TIMEOUT, pool=ASYNC_POOL_TIMEOUT)
+                )
+                span.response(img_response)
+            if img_response.status_code == 200:
+                generated_filename = await self._save_generated_image("doubao", img_response.content)
+                return self._doubao_image_result(generated_filename, prompt)
+            else:
+                return {
+                    "success": False,
+                    "error": f"下载豆包生成的图片失败: {img_response.status_code}",
+                    "api_type": "doubao"
+                }
+
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"保存豆包生成的图片失败: {str(e)}",
+                "api_type": "doubao"
+            }
+
+    async def _agenerate_with_mock(self, image_data, prompt, call_id):
+        """使用进程内Mock生成图片：异步等待模拟延迟后写入合成图片"""
+        from mock_provider import pooled_image_bytes
+        try:
+            await asyncio.sleep(self.latency_model.sample())
+
+            if self.failure_rate > 0 and random.random() < self.failure_rate:
+                return {
+                    "success": False,
+                    "error": f"Mock API请求失败: {MOCK_FAILURE_ERROR}",
+                    "api_type": "mock"
+                }
+
+            image_bytes = pooled_image_bytes(self.image_width, self.image_height, self.image_format)
+            extension = "jpg" if self.image_format == "JPEG" else self.image_format.lower()
+            generated_filename = await self._save_generated_image("mock", image_bytes, extension)
+            return {
+                "success": True,
+                "description": f"成功使用Mock API生成图片: {prompt}",
+                "generated_image_url": self.result_storage.url(generated_filename),
+                "api_type": "mock",
+                "note": "图片由Mock API合成，仅用于压测"
+            }
+
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"Mock API调用失败: {str(e)}",
+                "api_type": "mock"
+            }
+
+
+async def generate_many(generator, jobs, concurrency=None):
+    """
+    并发执行多次生成
+
+    Args:
+        generator: AsyncAIImageGenerator 实例
+        jobs: (image_data, prompt) 列表
+        concurrency: 同时进行的调用数上限（可选，默认只受连接池上限约束）
+
+    Returns:
+        list: 与 jobs 顺序一致的结果字典
+    """
+    semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+
+    async def run(image_data, prompt):
+        if semaphore is None:
+            return await generator.generate_image(image_data, prompt)
+        async with semaphore:
+            return await generator.generate_image(image_data, prompt)
+
+    return await asyncio.gather(*(run(image_data, prompt) for image_data, prompt in jobs))
+
+
+# 工厂函数
+def create_async_image_generator(api_type="gemini", api_key=None, model_name=None, base_url=None):
+    """
+    创建异步图片生成器实例，参数与 create_image_generator 相同
+
+    Returns:
+        AsyncAIImageGenerator: 异步图片生成器实例
+    """
+    return AsyncAIImageGenerator(api_type, api_key, model_name, base_url)
@@ -0,0 +1,10 @@
+"""
+离线压测工具包
+
+- mock_provider_server: 本地模拟 Gemini / 豆包 API 的 HTTP 服务，延迟分布、图片大小、错误率可配置
+- load_runner: 以不同并发度驱动真实的批量生成接口，统计吞吐、延迟分位数、峰值内存和 Redis 操作数
+- serializer_bench: 比较任务数据各序列化配置的编解码耗时和存储大小
+
+使用方式（在 backend 目录下执行，需要本地 Redis）:
+    python -m benchmark --concurrency 1,4,16 --requests 5 --items 4
+"""
@@ -0,0 +1,98 @@
+"""
+压测命令行入口
+
+示例:
+    python -m benchmark --scenario generate-from-image --concurrency 1,4,16 --requests 3 --items 4
+    python -m benchmark --api-type doubao --latency lognormal:1500:0.6 --error-rate 0.05
+    python -m benchmark --target http://localhost:5001 --json-out bench.json
+    python -m benchmark --api-type mock --latency fixed:200:0   # 进程内 Mock API，不启动模拟服务
+"""
+import argparse
+import json
+import os
+import sys
+
+from mock_provider import LatencyModel, parse_image_size
+
+from .load_runner import SCENARIOS, BatchScenario, HttpTransport, InProcessTransport, format_report, run_level
+from .mock_provider_server import MockProviderConfig, MockProviderServer
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="BatchGen Pro 离线压测")
+    parser.add_argument('--scenario', choices=SCENARIOS, default='generate-from-image')
+    parser.add_argument('--api-type', choices=('gemini', 'doubao', 'mock'), default='gemini')
+    parser.add_argument('--concurrency', default='1,4,16', help='逗号分隔的并发级别')
+    parser.add_argument('--requests', type=int, default=3, help='每个并发线程发送的请求数')
+    parser.add_argument('--items', type=int, default=4, help='每个批量请求的图片数')
+    parser.add_argument('--no-reference', action='store_true', help='不上传参考图')
+    parser.add_argument('--latency', default='lognormal:800:0.5', help='生成延迟分布，格式 分布:均值ms:离散度[:上限ms]')
+    parser.add_argument('--download-latency', default='lognormal:150:0.3', help='图片 URL 下载延迟分布')
+    parser.add_argument('--image-size', default='512x512', help='模拟服务返回的图片尺寸')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='注入错误的概率')
+    parser.add_argument('--error-status', type=int, default=429, help='注入错误的 HTTP 状态码')
+    parser.add_argument('--target', default=None, help='已部署后端地址；不指定则在进程内加载 app')
+    parser.add_argument('--mock-host', default='127.0.0.1', help='模拟服务监听地址（--target 模式下需要后端可访问）')
+    parser.add_argument('--mock-port', type=int, default=0)
+    parser.add_argument('--json-out', default=None, help='将结果写入 JSON 文件')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    width, height = parse_image_size(args.image_size)
+    config = MockProviderConfig(
+        latency=LatencyModel.parse(args.latency),
+        download_latency=LatencyModel.parse(args.download_latency),
+        image_width=width,
+        image_height=height,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+    )
+
+    redis_client = None
+    if args.target:
+        transport = HttpTransport(args.target)
+    else:
+        if args.api_type == 'mock':
+            # 进程内 Mock API 的配置在模块导入时读取
+            supported = os.getenv('SUPPORTED_APIS', 'gemini,doubao').split(',')
+            if 'mock' not in supported:
+                os.environ['SUPPORTED_APIS'] = ','.join(supported + ['mock'])
+            os.environ['MOCK_LATENCY'] = args.latency
+            os.environ['MOCK_IMAGE_SIZE'] = args.image_size
+            os.environ['MOCK_FAILURE_RATE'] = str(args.error_rate)
+        from app import app
+        from task_manager import redis_client
+        transport = InProcessTransport(app)
+
+    rows = []
+    with MockProviderServer(config, host=args.mock_host, port=args.mock_port) as server:
+        if args.api_type == 'gemini':
+            provider_base_url = server.gemini_base_url
+        elif args.api_type == 'doubao':
+            provider_base_url = server.doubao_base_url
+        else:
+            provider_base_url = None
+        scenario = BatchScenario(
+            name=args.scenario,
+            items=args.items,
+            api_type=args.api_type,
+            provider_base_url=provider_base_url,
+            with_reference=not args.no_reference,
+        )
+        for concurrency in (int(v) for v in args.concurrency.split(',') if v.strip()):
+            rows.append(run_level(transport, scenario, concurrency, args.requests, redis_client))
+        provider_stats = server.stats()
+
+    print(format_report(rows))
+    print(f"\nmock provider: {json.dumps(provider_stats, sort_keys=True)}")
+
+    if args.json_out:
+        with open(args.json_out, 'w', encoding='utf-8') as f:
+            json.dump({'levels': rows, 'provider': provider_stats}, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+导入耗时检查
+
+用 python -X importtime 在子进程中导入 web 和 Celery 的入口模块，输出总耗时和最慢的依赖，
+并检查模型 SDK 没有在启动时被导入（google-genai、PIL 只应在第一次生成时加载）。
+gunicorn worker 和 Celery 子进程（worker_max_tasks_per_child）重启时都要付出这部分时间。
+
+示例（在 backend 目录下执行）:
+    python -m benchmark.import_budget
+    python -m benchmark.import_budget --budget-ms 800 --repeat 5
+
+存在违规时以非零状态退出，可直接用于 CI。
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 检查的入口模块：web 进程和 Celery worker
+DEFAULT_TARGETS = ("app", "tasks")
+# 启动时不应导入的模块（及其子模块）
+DEFAULT_LAZY_MODULES = ("google.genai", "PIL")
+
+
+def measure_imports(module):
+    """
+    在新的解释器中导入模块并解析 -X importtime 输出
+
+    Returns:
+        list: (模块名, 自身耗时us, 累计耗时us, 层级) 列表，顺序与输出一致
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{completed.stderr[-2000:]}")
+    entries = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # 表头
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), int(parts[0]), int(parts[1]), depth))
+    return entries
+
+
+def check_module(module, lazy_modules=DEFAULT_LAZY_MODULES, repeat=3, top=10):
+    """
+    检查一个入口模块的导入耗时和不应加载的模块
+
+    Returns:
+        dict: total_ms（多次测量的最小值）、最慢的直接依赖以及提前导入的模块
+    """
+    runs = [measure_imports(module) for _ in range(max(1, repeat))]
+    totals = [next((cum for name, _, cum, _ in entries if name == module), 0) for entries in runs]
+    best = runs[totals.index(min(totals))]
+
+    target_depth = next(depth for name, _, _, depth in best if name == module)
+    heaviest = sorted(
+        ((name, cum) for name, _, cum, depth in best if depth == target_depth + 1),
+        key=lambda item: item[1],
+        reverse=True,
+    )[:top]
+    loaded = {name for name, _, _, _ in best}
+    eager = sorted(
+        lazy for lazy in lazy_modules
+        if any(name == lazy or name.startswith(lazy + ".") for name in loaded)
+    )
+    return {
+        "module": module,
+        "total_ms": round(min(totals) / 1000, 1),
+        "heaviest": [{"module": name, "ms": round(cum / 1000, 1)} for name, cum in heaviest],
+        "eager_imports": eager,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="检查入口模块的导入耗时和模型 SDK 是否被提前导入")
+    parser.add_argument('--modules', default=",".join(DEFAULT_TARGETS), help='逗号分隔的入口模块')
+    parser.add_argument('--lazy', default=",".join(DEFAULT_LAZY_MODULES), help='启动时不应导入的模块，逗号分隔')
+    parser.add_argument('--budget-ms', type=float, default=0, help='每个入口模块的导入耗时上限（毫秒），0 表示只报告不检查')
+    parser.add_argument('--repeat', type=int, default=3, help='测量次数，取最小值以减少抖动')
+    parser.add_argument('--top', type=int, default=10, help='列出最慢的直接依赖数量')
+    parser.add_argument('--json-out', default=None)
+    args = parser.parse_args(argv)
+
+    lazy_modules = [m.strip() for m in args.lazy.split(",") if m.strip()]
+    reports = []
+    failures = []
+    for module in (m.strip() for m in args.modules.split(",") if m.strip()):
+        report = check_module(module, lazy_modules, args.repeat, args.top)
+        reports.append(report)
+
+        print(f"{module}: {report['total_ms']:.1f} ms")
+        for dep in report["heaviest"]:
+            print(f"    {dep['ms']:>9.1f} ms  {dep['module']}")
+        if report["eager_imports"]:
+            failures.append(f"{module} 启动时导入了 {', '.join(report['eager_imports'])}")
+        if args.budget_ms and report["total_ms"] > args.budget_ms:
+            failures.append(f"{module} 导入耗时 {report['total_ms']:.1f} ms 超过上限 {args.budget_ms:.0f} ms")
+
+    if args.json_out:
+        with open(args.json_out, 'w', encoding='utf-8') as f:
+            json.dump({"reports": reports, "failures": failures}, f, indent=2, ensure_ascii=False)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
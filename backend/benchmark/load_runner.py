@@ -0,0 +1,307 @@
+"""
+批量接口压测驱动
+
+在进程内通过 Flask test client（或通过 --target 指定的 HTTP 地址）以不同并发度调用
+真实的批量生成接口，后端的模型调用指向本地模拟服务。
+"""
+import io
+import json
+import math
+import os
+import resource
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from mock_provider import make_image_bytes
+
+SCENARIOS = ("generate-from-image", "generate-with-prompts", "generate")
+
+
+def percentile(values, pct):
+    """最近秩法计算分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def _current_rss_bytes():
+    """读取当前进程 RSS，非 Linux 平台返回 None"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _max_rss_bytes():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 单位为字节，Linux 单位为 KB
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+class RssSampler:
+    """后台线程周期采样 RSS，记录每个并发级别内的峰值"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = _current_rss_bytes()
+            if rss is not None:
+                self.peak = max(self.peak, rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = _current_rss_bytes() or 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        if not self.peak:
+            # 无法读取 /proc 时退化为进程生命周期内的峰值
+            self.peak = _max_rss_bytes()
+
+
+def redis_command_calls(redis_client):
+    """读取 Redis INFO commandstats，返回 {命令: 调用次数}；不支持 INFO 时返回 None"""
+    try:
+        stats = redis_client.info('commandstats')
+    except Exception:
+        return None
+    calls = {}
+    for key, value in stats.items():
+        name = key[len('cmdstat_'):] if key.startswith('cmdstat_') else key
+        calls[name] = value.get('calls', 0) if isinstance(value, dict) else 0
+    return calls
+
+
+def diff_calls(before, after):
+    if before is None or after is None:
+        return {}
+    delta = {}
+    for name, count in after.items():
+        changed = count - before.get(name, 0)
+        if changed > 0:
+            delta[name] = changed
+    # INFO 命令本身不计入
+    delta.pop('info', None)
+    return delta
+
+
+class InProcessTransport:
+    """使用 Flask test client 直接调用应用，每个线程独立的 client"""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def post(self, path, data, headers):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.post(path, data=data, headers=headers, content_type='multipart/form-data')
+        return response.status_code, response.get_json(silent=True) or {}
+
+    def get(self, path, headers):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.get(path, headers=headers)
+        return response.status_code, response.get_json(silent=True) or {}
+
+
+class HttpTransport:
+    """通过 HTTP 调用已部署的后端"""
+
+    def __init__(self, target):
+        import requests
+        self.target = target.rstrip('/')
+        self._requests = requests
+        self._local = threading.local()
+
+    def post(self, path, data, headers):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        fields = {}
+        files = {}
+        for key, value in data.items():
+            if isinstance(value, tuple):
+                stream, filename = value
+                files.setdefault(key, []).append((key, (filename, stream.getvalue(), 'image/png')))
+            elif isinstance(value, list):
+                for stream, filename in value:
+                    files.setdefault(key, []).append((key, (filename, stream.getvalue(), 'image/png')))
+            else:
+                fields[key] = value
+        flat_files = [entry for entries in files.values() for entry in entries]
+        response = session.post(f"{self.target}{path}", data=fields, files=flat_files, headers=headers, timeout=900)
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        return response.status_code, body
+
+    def get(self, path, headers):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        response = session.get(f"{self.target}{path}", headers=headers, timeout=60)
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        return response.status_code, body
+
+
+class BatchScenario:
+    """描述一次批量请求的形状"""
+
+    def __init__(self, name="generate-from-image", items=4, api_type="gemini",
+                 provider_base_url=None, with_reference=True, image_width=512, image_height=512):
+        if name not in SCENARIOS:
+            raise ValueError(f"不支持的压测场景: {name}")
+        self.name = name
+        self.items = items
+        self.api_type = api_type
+        self.provider_base_url = provider_base_url
+        self.with_reference = with_reference
+        self.reference_image = make_image_bytes(image_width, image_height) if with_reference or name == "generate" else None
+
+    def headers(self, session_id):
+        headers = {
+            'X-Session-ID': session_id,
+            'X-API-Key': 'benchmark-key',
+            'X-API-Type': self.api_type,
+        }
+        if self.provider_base_url:
+            header_name = 'X-Gemini-Base-URL' if self.api_type == 'gemini' else 'X-Doubao-Base-URL'
+            headers[header_name] = self.provider_base_url
+        return headers
+
+    def build_request(self):
+        """返回 (path, form_data)，每次调用生成新的文件流"""
+        data = {'api_type': self.api_type, 'model_name': 'benchmark-model'}
+        if self.name == "generate":
+            data['prompt'] = 'benchmark edit'
+            data['files'] = [(io.BytesIO(self.reference_image), f'input_{i}.png') for i in range(self.items)]
+            return '/api/batch/generate', data
+        if self.with_reference:
+            data['file'] = (io.BytesIO(self.reference_image), 'reference.png')
+        if self.name == "generate-from-image":
+            data['prompt'] = 'benchmark image'
+            data['image_count'] = str(self.items)
+            return '/api/batch/generate-from-image', data
+        data['prompts'] = json.dumps([f'benchmark image {i}' for i in range(self.items)])
+        return '/api/batch/generate-with-prompts', data
+
+
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+
+def wait_for_task(transport, task_id, headers, poll_interval=0.2, timeout=1800):
+    """
+    批量接口在后台处理，轮询任务状态直到结束
+
+    Returns:
+        dict: 最后一次状态接口的响应
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        status, body = transport.get(f'/api/batch/tasks/{task_id}/status', headers)
+        if status != 200 or body.get('status') in FINISHED_STATUSES:
+            return body
+        if time.monotonic() > deadline:
+            return {'success': False, 'error': f'任务 {task_id} 等待超时'}
+        time.sleep(poll_interval)
+
+
+def run_level(transport, scenario, concurrency, requests_per_worker, redis_client=None):
+    """
+    以指定并发度运行一轮压测，延迟为提交到任务结束的端到端时间
+
+    Returns:
+        dict: 本轮统计结果
+    """
+    latencies = []
+    errors = []
+    images_ok = [0]
+    lock = threading.Lock()
+
+    def worker(worker_index):
+        # 每个并发线程使用独立 session，模拟不同用户
+        session_id = f"bench-{worker_index}-{uuid.uuid4().hex[:8]}"
+        for _ in range(requests_per_worker):
+            path, data = scenario.build_request()
+            headers = scenario.headers(session_id)
+            started = time.perf_counter()
+            try:
+                status, body = transport.post(path, data, headers)
+                if status == 200 and body.get('success'):
+                    body = wait_for_task(transport, body['task_id'], headers)
+                    status = 200 if body.get('success') else status
+            except Exception as e:
+                status, body = 0, {'error': str(e)}
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if status == 200 and body.get('status') == 'completed':
+                    images_ok[0] += body.get('processed_images', 0)
+                    if body.get('failed_images'):
+                        errors.append(f"{body['failed_images']} 张图片生成失败")
+                else:
+                    errors.append(body.get('error') or f"HTTP {status} {body.get('status', '')}".strip())
+
+    redis_before = redis_command_calls(redis_client) if redis_client is not None else None
+    with RssSampler() as rss:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(worker, range(concurrency)))
+        duration = time.perf_counter() - started
+    redis_ops = diff_calls(redis_before, redis_command_calls(redis_client)) if redis_client is not None else {}
+
+    total_requests = concurrency * requests_per_worker
+    return {
+        'scenario': scenario.name,
+        'api_type': scenario.api_type,
+        'concurrency': concurrency,
+        'requests': total_requests,
+        'errors': len(errors),
+        'error_samples': errors[:3],
+        'images': images_ok[0],
+        'duration_s': duration,
+        'requests_per_s': total_requests / duration if duration else 0.0,
+        'images_per_s': images_ok[0] / duration if duration else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'peak_rss_mb': rss.peak / (1024 * 1024),
+        'redis_ops': sum(redis_ops.values()),
+        'redis_ops_by_command': redis_ops,
+    }
+
+
+def format_report(rows):
+    """将结果格式化为文本表格"""
+    header = (f"{'scenario':<22}{'api':<8}{'conc':>5}{'reqs':>6}{'err':>5}{'img/s':>9}"
+              f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rss MB':>9}{'redis ops':>11}")
+    lines = [header, '-' * len(header)]
+    for row in rows:
+        lines.append(
+            f"{row['scenario']:<22}{row['api_type']:<8}{row['concurrency']:>5}{row['requests']:>6}"
+            f"{row['errors']:>5}{row['images_per_s']:>9.2f}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+            f"{row['p99_ms']:>10.1f}{row['peak_rss_mb']:>9.1f}{row['redis_ops']:>11}"
+        )
+    return '\n'.join(lines)
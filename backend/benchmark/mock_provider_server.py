@@ -0,0 +1,307 @@
+"""
+本地模拟图片生成服务
+
+支持以下接口（与 AIImageGenerator 的 HTTP 调用格式一致）:
+- POST .../models/<model>:generateContent   Gemini 原生 REST 格式
+- POST .../images/generations               豆包格式（response_format 支持 url / b64_json，支持组图 sequential_image_generation）
+- GET  /mock-images/<name>                  豆包返回的图片 URL
+
+路径前缀 /replay/<cid> 表示按录制的流量（见 benchmark.replay）回放该次调用的延迟、状态码和响应大小，
+不带前缀的请求按 MockProviderConfig 的随机模型响应。
+"""
+import base64
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from mock_provider import LatencyModel, make_image_bytes
+
+
+class MockProviderConfig:
+    """模拟服务配置"""
+
+    def __init__(self, latency=None, download_latency=None, image_width=512, image_height=512,
+                 image_format="PNG", error_rate=0.0, error_status=429, image_pool_size=4,
+                 reject_b64_json=False):
+        """
+        Args:
+            latency: 生成接口的 LatencyModel
+            download_latency: 图片 URL 下载的 LatencyModel
+            image_width / image_height: 返回图片的像素尺寸，决定响应体大小
+            image_format: 返回图片格式
+            error_rate: 注入错误的概率 (0~1)
+            error_status: 注入错误时返回的 HTTP 状态码
+            image_pool_size: 预生成的图片数量，避免请求时消耗 CPU
+            reject_b64_json: 豆包接口对 response_format=b64_json 返回 400（模拟不支持 b64_json 的中转服务）
+        """
+        self.latency = latency or LatencyModel()
+        self.download_latency = download_latency or LatencyModel("lognormal", 150, 0.3)
+        self.image_width = image_width
+        self.image_height = image_height
+        self.image_format = image_format
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.image_pool_size = image_pool_size
+        self.reject_b64_json = reject_b64_json
+
+
+class _MockProviderHandler(BaseHTTPRequestHandler):
+    """请求处理器，配置和统计信息挂在 server 上"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # 压测时不输出访问日志
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length) if length else b""
+        self.server.record("request_bytes", len(raw))
+        try:
+            return json.loads(raw or b"{}")
+        except ValueError:
+            return None
+
+    def _inject_error(self, kind):
+        config = self.server.config
+        if config.error_rate > 0 and random.random() < config.error_rate:
+            self.server.record(f"{kind}_errors")
+            self._send_json(config.error_status, {
+                "error": {"code": config.error_status, "message": "mock provider injected error"}
+            })
+            return True
+        return False
+
+    def _route(self):
+        """解析路径，剥离回放前缀并找到对应的录制脚本"""
+        path = self.path.split('?', 1)[0]
+        self.script = None
+        self.replay_prefix = ""
+        if path.startswith("/replay/"):
+            parts = path.split('/', 3)
+            call_id = parts[2]
+            self.script = self.server.scripts.get(call_id)
+            self.replay_prefix = f"/replay/{call_id}"
+            path = '/' + (parts[3] if len(parts) > 3 else '')
+        return path
+
+    def _play_script(self, op):
+        """
+        按录制的事件响应，返回 True 表示已处理（错误或断开），False 表示需要继续返回图片
+
+        录制的超时和连接错误通过在等待后直接断开连接来重现。
+        """
+        event = self.script.get(op) if self.script else None
+        if event is None:
+            return False
+        time.sleep((event.get("ms") or 0) / 1000.0 / self.server.speedup)
+        if event.get("err") in ("timeout", "connection", "exception"):
+            self.server.record(f"replay_{event['err']}")
+            self.close_connection = True
+            return True
+        status = event.get("status") or 200
+        if status != 200:
+            self.server.record(f"replay_http_{status}")
+            self._send_json(status, {"error": {"code": status, "message": "replayed provider error"}})
+            return True
+        return False
+
+    def _scripted_image(self, op, encoded=True):
+        """
+        按录制的响应大小生成图片数据
+
+        encoded 为 True 时录制的是 JSON 响应体大小，其中图片经过 base64 编码，原始数据约为 3/4。
+        """
+        event = self.script.get(op) if self.script else None
+        if not event or not event.get("resp"):
+            return self.server.next_image()
+        size = int(event["resp"] * 3 / 4) if encoded else event["resp"]
+        signature = b"\x89PNG\r\n\x1a\n"
+        return signature + os.urandom(max(0, size - len(signature)))
+
+    def do_POST(self):
+        path = self._route()
+        if path.endswith(":generateContent"):
+            self._handle_gemini()
+        elif path.endswith("/images/generations"):
+            self._handle_doubao()
+        else:
+            self._send_json(404, {"error": {"message": f"unknown path {path}"}})
+
+    def do_GET(self):
+        path = self._route()
+        if path.startswith("/mock-images/"):
+            self._handle_image_download()
+        else:
+            self._send_json(404, {"error": {"message": f"unknown path {path}"}})
+
+    def _handle_gemini(self):
+        self.server.record("gemini_requests")
+        payload = self._read_json()
+        if self.script is None:
+            time.sleep(self.server.config.latency.sample())
+        if payload is None:
+            self._send_json(400, {"error": {"message": "invalid json"}})
+            return
+        if self.script is not None:
+            if self._play_script("generate"):
+                return
+            image_bytes = self._scripted_image("generate")
+        elif self._inject_error("gemini"):
+            return
+        else:
+            image_bytes = self.server.next_image()
+        self._send_json(200, {
+            "candidates": [{
+                "content": {
+                    "parts": [{
+                        "inlineData": {
+                            "mimeType": f"image/{self.server.config.image_format.lower()}",
+                            "data": base64.b64encode(image_bytes).decode('ascii')
+                        }
+                    }]
+                }
+            }]
+        })
+
+    def _handle_doubao(self):
+        self.server.record("doubao_requests")
+        payload = self._read_json()
+        if self.script is None:
+            time.sleep(self.server.config.latency.sample())
+        if payload is None:
+            self._send_json(400, {"error": {"message": "invalid json"}})
+            return
+        if self.script is not None:
+            if self._play_script("generate"):
+                return
+        elif self._inject_error("doubao"):
+            return
+        if self.server.config.reject_b64_json and payload.get("response_format") == "b64_json":
+            self._send_json(400, {"error": {"message": "response_format b64_json is not supported"}})
+            return
+        # 组图模式返回 max_images 张图片
+        count = 1
+        if payload.get("sequential_image_generation") == "auto":
+            count = max(1, int((payload.get("sequential_image_generation_options") or {}).get("max_images", 1)))
+        entries = []
+        for _ in range(count):
+            if payload.get("response_format") == "b64_json":
+                image_bytes = self._scripted_image("generate") if self.script is not None else self.server.next_image()
+                entries.append({"b64_json": base64.b64encode(image_bytes).decode('ascii')})
+            else:
+                entries.append({"url": f"{self.server.base_url}{self.replay_prefix}/mock-images/{uuid.uuid4()}.png"})
+        self._send_json(200, {"model": payload.get("model"), "created": int(time.time()), "data": entries})
+
+    def _handle_image_download(self):
+        self.server.record("image_downloads")
+        if self.script is not None:
+            if self._play_script("download"):
+                return
+            body = self._scripted_image("download", encoded=False)
+        else:
+            time.sleep(self.server.config.download_latency.sample())
+            body = self.server.next_image()
+        self.send_response(200)
+        self.send_header("Content-Type", f"image/{self.server.config.image_format.lower()}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 异步客户端会同时建立数百个连接，默认的 listen backlog(5) 会导致连接被重置
+    request_queue_size = 1024
+
+    def __init__(self, address, config):
+        super().__init__(address, _MockProviderHandler)
+        self.config = config
+        self.images = [
+            make_image_bytes(config.image_width, config.image_height, config.image_format)
+            for _ in range(max(1, config.image_pool_size))
+        ]
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+        # 回放脚本: {cid: {"generate": 事件, "download": 事件}}
+        self.scripts = {}
+        self.speedup = 1.0
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def next_image(self):
+        return random.choice(self.images)
+
+    def record(self, name, value=1):
+        with self._stats_lock:
+            self.stats[name] = self.stats.get(name, 0) + value
+
+
+class MockProviderServer:
+    """在后台线程中运行的模拟服务"""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or MockProviderConfig()
+        self._server = _MockHTTPServer((host, port), self.config)
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return self._server.base_url
+
+    @property
+    def gemini_base_url(self):
+        """作为 X-Gemini-Base-URL 使用"""
+        return f"{self.base_url}/v1beta"
+
+    @property
+    def doubao_base_url(self):
+        """作为 X-Doubao-Base-URL 使用"""
+        return f"{self.base_url}/api/v3"
+
+    def load_scripts(self, scripts, speedup=1.0):
+        """加载回放脚本，录制的延迟按 speedup 倍数缩短"""
+        self._server.scripts.update(scripts)
+        self._server.speedup = max(float(speedup), 1e-6)
+
+    def replay_base_url(self, call_id, api_type):
+        """回放某次调用时传给 AIImageGenerator 的 base_url"""
+        suffix = "/v1beta" if api_type == "gemini" else "/api/v3"
+        return f"{self.base_url}/replay/{call_id}{suffix}"
+
+    def stats(self):
+        with self._server._stats_lock:
+            return dict(self._server.stats)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
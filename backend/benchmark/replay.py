@@ -0,0 +1,173 @@
+"""
+回放录制的模型调用流量
+
+读取 PROVIDER_TRACE_FILE 录制的 JSON Lines，按原始时间间隔（除以 speedup）通过 AIImageGenerator
+向本地模拟服务发起调用，模拟服务按录制的延迟、状态码和响应大小返回。
+可用于复现线上的长尾、429 突发和慢图片下载，并离线调整并发度。
+
+示例（在 backend 目录下执行）:
+    python -m benchmark.replay trace.jsonl --speedup 10 --concurrency 8
+"""
+import argparse
+import json
+import math
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from mock_provider import make_image_bytes
+
+from .load_runner import percentile
+from .mock_provider_server import MockProviderServer
+
+
+def load_trace(path):
+    """
+    读取流量记录，按调用标识合并生成请求和图片下载
+
+    Returns:
+        list: 按开始时间排序的调用列表，每项包含 cid、api、model、t 以及 generate / download 事件
+    """
+    calls = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get("api") not in ("gemini", "doubao"):
+                continue
+            call = calls.setdefault(entry["cid"], {
+                "cid": entry["cid"],
+                "api": entry["api"],
+                "model": entry.get("model"),
+                "t": entry["t"],
+            })
+            call["t"] = min(call["t"], entry["t"])
+            call[entry.get("op", "generate")] = entry
+    return sorted((c for c in calls.values() if "generate" in c), key=lambda c: c["t"])
+
+
+_reference_cache = {}
+_reference_lock = threading.Lock()
+
+
+def reference_image_for(request_bytes):
+    """按录制的请求体大小生成近似大小的参考图，请求体很小时视为纯文本生成"""
+    raw = int(request_bytes * 3 / 4)
+    if raw < 8 * 1024:
+        return None
+    # 噪点 PNG 大小约为 宽*高*3，按 64 像素取整以复用缓存
+    side = min(4096, max(64, int(math.sqrt(raw / 3) // 64 * 64)))
+    with _reference_lock:
+        if side not in _reference_cache:
+            _reference_cache[side] = make_image_bytes(side, side)
+        return _reference_cache[side]
+
+
+def replay(calls, server, speedup=1.0, concurrency=16):
+    """
+    回放调用列表
+
+    Returns:
+        dict: 回放统计
+    """
+    from ai_image_generator import create_image_generator
+
+    server.load_scripts({c["cid"]: c for c in calls}, speedup)
+    results = []
+    lock = threading.Lock()
+    in_flight = [0, 0]  # 当前并发数, 峰值并发数
+
+    def run_call(call, due):
+        started = time.perf_counter()
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+        try:
+            generator = create_image_generator(
+                call["api"], "replay-key", call.get("model"),
+                server.replay_base_url(call["cid"], call["api"])
+            )
+            result = generator.generate_image(reference_image_for(call["generate"].get("req", 0)), "replay")
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+        finished = time.perf_counter()
+        with lock:
+            in_flight[0] -= 1
+            results.append({
+                "success": result.get("success", False),
+                "queue_ms": (started - due) * 1000,
+                "latency_ms": (finished - started) * 1000,
+                "recorded_ms": sum((call.get(op) or {}).get("ms") or 0 for op in ("generate", "download")),
+            })
+
+    t0 = calls[0]["t"] if calls else 0
+    replay_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for call in calls:
+            due = replay_started + (call["t"] - t0) / speedup
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(run_call, call, due)
+    duration = time.perf_counter() - replay_started
+
+    latencies = [r["latency_ms"] for r in results]
+    queue_waits = [r["queue_ms"] for r in results]
+    recorded = [r["recorded_ms"] / speedup for r in results]
+    error_classes = {}
+    for call in calls:
+        for op in ("generate", "download"):
+            err = (call.get(op) or {}).get("err")
+            if err:
+                error_classes[f"{op}:{err}"] = error_classes.get(f"{op}:{err}", 0) + 1
+    return {
+        "calls": len(results),
+        "speedup": speedup,
+        "concurrency": concurrency,
+        "duration_s": duration,
+        "failed": sum(1 for r in results if not r["success"]),
+        "recorded_errors": error_classes,
+        "peak_in_flight": in_flight[1],
+        "recorded_p50_ms": percentile(recorded, 50),
+        "recorded_p99_ms": percentile(recorded, 99),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "queue_p99_ms": percentile(queue_waits, 99),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="回放录制的模型调用流量")
+    parser.add_argument('trace', help='PROVIDER_TRACE_FILE 录制的文件')
+    parser.add_argument('--speedup', type=float, default=1.0, help='时间压缩倍数，同时缩短调用间隔和录制的延迟')
+    parser.add_argument('--concurrency', type=int, default=16, help='同时进行的调用数上限，模拟生成线程数')
+    parser.add_argument('--limit', type=int, default=None, help='只回放前 N 次调用')
+    parser.add_argument('--json-out', default=None)
+    args = parser.parse_args(argv)
+
+    calls = load_trace(args.trace)
+    if args.limit:
+        calls = calls[:args.limit]
+    if not calls:
+        print("流量记录中没有可回放的调用")
+        return 1
+
+    with MockProviderServer() as server:
+        report = replay(calls, server, args.speedup, args.concurrency)
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.json_out:
+        with open(args.json_out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
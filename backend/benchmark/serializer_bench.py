@@ -0,0 +1,166 @@
+"""
+任务序列化微基准
+
+按任务存储方式（概要 + 每张图片一个 Hash 字段）构造已完成的任务，比较各种序列化配置下
+编码 / 解码整个任务的耗时和数据大小；指定 --redis 时把任务写入 Redis，用 MEMORY USAGE 统计实际占用。
+
+示例（在 backend 目录下执行）:
+    python -m benchmark.serializer_bench
+    python -m benchmark.serializer_bench --items 10,100,1000 --repeat 20 --redis
+"""
+import argparse
+import json
+import sys
+import time
+import uuid
+
+from task_serializer import TaskSerializer, msgpack, zstandard
+
+# (名称, codec, compression)；未安装的依赖对应的配置会被跳过
+CONFIGS = (
+    ("plain", "plain", "none"),
+    ("json", "json", "none"),
+    ("json+zlib", "json", "zlib"),
+    ("msgpack", "msgpack", "none"),
+    ("msgpack+zlib", "msgpack", "zlib"),
+    ("msgpack+zstd", "msgpack", "zstd"),
+)
+
+
+def available_configs():
+    for name, codec, compression in CONFIGS:
+        if codec == "msgpack" and msgpack is None:
+            continue
+        if compression == "zstd" and zstandard is None:
+            continue
+        yield name, codec, compression
+
+
+def build_task(total):
+    """构造一个已完成的任务：(概要, 图片条目列表)，条目内容与实际写入的一致"""
+    task_id = str(uuid.uuid4())
+    summary = {
+        "task_id": task_id,
+        "session_id": str(uuid.uuid4()),
+        "status": "completed",
+        "created_at": "2025-01-01T12:00:00.000000",
+        "updated_at": "2025-01-01T12:05:00.000000",
+        "total_images": total,
+        "processed_images": total,
+        "failed_images": 0,
+        "progress": 100.0,
+        "prompt": "a watercolor painting of a cat sitting on a windowsill, soft light",
+        "api_type": "gemini",
+        "current_image": total,
+        "results": {"success_count": total, "failed_count": 0},
+    }
+    items = []
+    for index in range(total):
+        generated = f"gemini_generated_{uuid.uuid4()}.png"
+        items.append({
+            "index": index,
+            "filename": f"generated_{index + 1}.png",
+            "status": "completed",
+            "prompt": f"a watercolor painting of a cat, variant {index}",
+            "result_url": f"/static/results/{generated}",
+            "generated_filename": generated,
+            "error": None,
+            "thumbnail_url": f"/static/results/thumbs/{generated}",
+        })
+    return summary, items
+
+
+def measure(serializer, summary, items, repeat):
+    """
+    Returns:
+        dict: 编码 / 解码整个任务的耗时（毫秒，多次测量的最小值）和编码后的字节数
+    """
+    encode_times = []
+    decode_times = []
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        encoded_summary = serializer.dumps(summary)
+        encoded_items = [serializer.dumps(item) for item in items]
+        encode_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        serializer.loads(encoded_summary)
+        for value in encoded_items:
+            serializer.loads(value)
+        decode_times.append(time.perf_counter() - start)
+    return {
+        "encode_ms": round(min(encode_times) * 1000, 3),
+        "decode_ms": round(min(decode_times) * 1000, 3),
+        "summary_bytes": len(encoded_summary),
+        "item_bytes": sum(len(value) for value in encoded_items),
+    }, encoded_summary, encoded_items
+
+
+def redis_memory(client, encoded_summary, encoded_items):
+    """写入临时 key，返回 MEMORY USAGE 统计的字节数（概要 + 图片条目 Hash）"""
+    prefix = f"serializer_bench:{uuid.uuid4().hex}"
+    summary_key, items_key = f"{prefix}:summary", f"{prefix}:items"
+    try:
+        client.set(summary_key, encoded_summary)
+        if encoded_items:
+            client.hset(items_key, mapping=dict(enumerate(encoded_items)))
+        usage = client.memory_usage(summary_key, samples=0) or 0
+        if encoded_items:
+            usage += client.memory_usage(items_key, samples=0) or 0
+        return usage
+    finally:
+        client.delete(summary_key, items_key)
+
+
+def format_report(rows):
+    header = f"{'items':>6}  {'config':<14}{'encode ms':>11}{'decode ms':>11}{'bytes':>11}{'redis bytes':>13}"
+    lines = [header, "-" * len(header)]
+    for row in rows:
+        redis_bytes = row.get("redis_bytes")
+        lines.append(
+            f"{row['items']:>6}  {row['config']:<14}{row['encode_ms']:>11.3f}{row['decode_ms']:>11.3f}"
+            f"{row['summary_bytes'] + row['item_bytes']:>11}{redis_bytes if redis_bytes is not None else '-':>13}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="比较任务数据各序列化配置的编解码耗时和存储大小")
+    parser.add_argument('--items', default='10,100,1000', help='逗号分隔的每个任务图片数')
+    parser.add_argument('--repeat', type=int, default=10, help='测量次数，取最小值以减少抖动')
+    parser.add_argument('--compress-min-bytes', type=int, default=None, help='覆盖 TASK_COMPRESS_MIN_BYTES')
+    parser.add_argument('--redis', action='store_true', help='写入 REDIS_HOST 指定的 Redis 并统计 MEMORY USAGE')
+    parser.add_argument('--json-out', default=None)
+    args = parser.parse_args(argv)
+
+    client = None
+    if args.redis:
+        from task_manager import task_redis_client as client
+
+    rows = []
+    for total in (int(v) for v in args.items.split(',') if v.strip()):
+        summary, items = build_task(total)
+        for name, codec, compression in available_configs():
+            options = {}
+            if args.compress_min_bytes is not None:
+                options["compress_min_bytes"] = args.compress_min_bytes
+            serializer = TaskSerializer(codec, compression, **options)
+            row, encoded_summary, encoded_items = measure(serializer, summary, items, args.repeat)
+            row.update({"items": total, "config": name})
+            if client is not None:
+                row["redis_bytes"] = redis_memory(client, encoded_summary, encoded_items)
+            rows.append(row)
+
+    print(format_report(rows))
+    skipped = [name for name, _, _ in CONFIGS if name not in {row["config"] for row in rows}]
+    if skipped:
+        print(f"\n未安装依赖，跳过: {', '.join(skipped)}")
+
+    if args.json_out:
+        with open(args.json_out, 'w', encoding='utf-8') as f:
+            json.dump({"rows": rows}, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,336 @@
+"""
+离线批量作业（bulk 模式）
+
+夜间重新生成商品图这类大批量、不着急的任务，逐张实时调用既是最贵的方式，也最容易触发限流。
+模型 API 的批量作业接口（如 Gemini Batch API）按作业提交，价格更低、不占用实时配额，通常在 24 小时内完成。
+bulk 模式把任务的所有条目写成一个 JSONL 作业文件提交给 API，按退避间隔轮询作业状态，
+完成后把每条结果写入 BatchTaskManager（见 tasks.process_bulk_job_sync）。
+
+与 API 的交互通过 BulkJobProvider 接口隔离：
+    GeminiBulkProvider   Gemini Batch API（官方 API，作业文件通过 Files API 上传）
+    LocalBulkProvider    本地文件作业：在后台线程中用普通生成接口逐条处理，用于 Mock API 和测试
+"""
+import base64
+import hashlib
+import io
+import json
+import logging
+import os
+import random
+import shutil
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'uploads')
+# 作业文件（提交前的 JSONL、下载的结果、本地作业）所在目录
+BULK_JOB_FOLDER = os.getenv('BULK_JOB_FOLDER', os.path.join(UPLOAD_FOLDER, '.bulk'))
+# 轮询作业状态的初始间隔和最大间隔（秒），每次乘以 BULK_POLL_BACKOFF
+# 轮询时会续期任务数据，最大间隔需小于任务过期时间 TASK_TTL
+BULK_POLL_INITIAL = float(os.getenv('BULK_POLL_INITIAL', 30))
+BULK_POLL_MAX = float(os.getenv('BULK_POLL_MAX', 600))
+BULK_POLL_BACKOFF = 1.5
+# 作业的最长等待时间（秒），超时后取消作业，未返回的图片记为失败
+BULK_JOB_TIMEOUT = int(os.getenv('BULK_JOB_TIMEOUT', 48 * 3600))
+
+
+class BulkJobState:
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    # 作业结束，可以读取结果（失败的作业也可能有部分结果）
+    FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+
+def poll_intervals(initial=None, maximum=None, backoff=BULK_POLL_BACKOFF):
+    """轮询间隔：从 initial 开始按 backoff 倍数增长到 maximum，加入 ±10% 抖动避免多个作业同时轮询"""
+    delay = BULK_POLL_INITIAL if initial is None else initial
+    maximum = BULK_POLL_MAX if maximum is None else maximum
+    while True:
+        yield delay * random.uniform(0.9, 1.1)
+        delay = min(delay * backoff, maximum)
+
+
+class BulkJobProvider:
+    """
+    模型 API 批量作业接口
+
+    一个作业的生命周期：write_request 逐条写入作业文件 -> submit -> poll 直到结束 -> iter_results -> cleanup
+    """
+
+    def write_request(self, f, key, image_data, prompt):
+        """向作业文件（文本模式打开）写入一条请求，key 用于对应结果"""
+        raise NotImplementedError
+
+    def submit(self, job_path, display_name):
+        """
+        提交作业文件，提交后作业文件可以删除
+
+        Returns:
+            str: 作业ID
+        """
+        raise NotImplementedError
+
+    def poll(self, job_id):
+        """
+        查询作业状态
+
+        Returns:
+            dict: state（BulkJobState）、completed（已完成的条目数，未知时为 None）、error
+        """
+        raise NotImplementedError
+
+    def iter_results(self, job_id):
+        """逐条返回 (key, 结果)，结果与 AIImageGenerator.generate_image 的返回值格式相同，图片已写入结果目录"""
+        raise NotImplementedError
+
+    def cancel(self, job_id):
+        raise NotImplementedError
+
+    def cleanup(self, job_id):
+        """删除作业的本地文件"""
+
+
+class LocalBulkProvider(BulkJobProvider):
+    """
+    本地文件作业
+
+    作业目录 BULK_JOB_FOLDER/local-<id> 中保存 input.jsonl、output.jsonl 和 state.json，
+    提交后在后台线程中用 AIImageGenerator 逐条生成。作业线程随进程退出，服务重启后未完成的本地作业不会恢复。
+    """
+
+    def __init__(self, api_type="mock", api_key=None, model_name=None, base_url=None, job_folder=None):
+        self.api_type = api_type
+        self.api_key = api_key
+        self.model_name = model_name
+        self.base_url = base_url
+        self.job_folder = job_folder or BULK_JOB_FOLDER
+
+    def _job_dir(self, job_id):
+        return os.path.join(self.job_folder, job_id)
+
+    def _write_state(self, job_id, state):
+        path = os.path.join(self._job_dir(job_id), 'state.json')
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(f"{path}.tmp", path)
+
+    def write_request(self, f, key, image_data, prompt):
+        image = base64.b64encode(image_data).decode('ascii') if image_data else None
+        f.write(json.dumps({"key": key, "prompt": prompt, "image": image}, ensure_ascii=False) + "\n")
+
+    def submit(self, job_path, display_name):
+        job_id = f"local-{uuid.uuid4().hex}"
+        os.makedirs(self._job_dir(job_id))
+        os.replace(job_path, os.path.join(self._job_dir(job_id), 'input.jsonl'))
+        self._write_state(job_id, {"state": BulkJobState.RUNNING, "completed": 0, "error": None,
+                                   "display_name": display_name})
+        threading.Thread(target=self._run, args=(job_id,), name=f"bulk-{job_id[6:14]}", daemon=True).start()
+        return job_id
+
+    def _run(self, job_id):
+        from ai_image_generator import create_image_generator
+        job_dir = self._job_dir(job_id)
+        completed = 0
+        try:
+            generator = create_image_generator(self.api_type, self.api_key, self.model_name, self.base_url)
+            with open(os.path.join(job_dir, 'input.jsonl'), encoding='utf-8') as requests_file, \
+                    open(os.path.join(job_dir, 'output.jsonl'), 'w', encoding='utf-8') as output:
+                for line in requests_file:
+                    if os.path.exists(os.path.join(job_dir, 'cancel')):
+                        self._write_state(job_id, {"state": BulkJobState.CANCELLED, "completed": completed, "error": None})
+                        return
+                    request = json.loads(line)
+                    image_data = base64.b64decode(request["image"]) if request["image"] else None
+                    result = generator.generate_image(image_data, request["prompt"])
+                    output.write(json.dumps({"key": request["key"], "result": result}, ensure_ascii=False) + "\n")
+                    output.flush()
+                    completed += 1
+                    self._write_state(job_id, {"state": BulkJobState.RUNNING, "completed": completed, "error": None})
+            self._write_state(job_id, {"state": BulkJobState.SUCCEEDED, "completed": completed, "error": None})
+        except Exception as e:
+            self._write_state(job_id, {"state": BulkJobState.FAILED, "completed": completed, "error": str(e)})
+        finally:
+            # 作业结束前已被 cleanup 的作业由作业线程删除
+            if os.path.exists(os.path.join(job_dir, 'cleanup')):
+                shutil.rmtree(job_dir, ignore_errors=True)
+
+    def poll(self, job_id):
+        with open(os.path.join(self._job_dir(job_id), 'state.json'), encoding='utf-8') as f:
+            state = json.load(f)
+        return {"state": state["state"], "completed": state["completed"], "error": state["error"]}
+
+    def iter_results(self, job_id):
+        try:
+            with open(os.path.join(self._job_dir(job_id), 'output.jsonl'), encoding='utf-8') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    yield entry["key"], entry["result"]
+        except FileNotFoundError:
+            return
+
+    def cancel(self, job_id):
+        open(os.path.join(self._job_dir(job_id), 'cancel'), 'w').close()
+
+    def cleanup(self, job_id):
+        # 作业线程仍在运行（例如取消后正在处理当前条目）时由作业线程结束后删除
+        open(os.path.join(self._job_dir(job_id), 'cleanup'), 'w').close()
+        if self.poll(job_id)["state"] in BulkJobState.FINISHED:
+            shutil.rmtree(self._job_dir(job_id), ignore_errors=True)
+
+
+class GeminiBulkProvider(BulkJobProvider):
+    """
+    Gemini Batch API
+
+    作业文件每行为 {"key", "request": GenerateContentRequest}，通过 Files API 上传后创建作业；
+    参考图按内容只通过 Files API 上传一次，请求中以 file_data 引用，不在每行重复写入 base64（作业文件大小与参考图无关）。
+    结果文件每行为 {"key", "response"} 或 {"key", "error"}，下载到磁盘后逐行解析，不整体读入内存。
+    只支持官方 API（第三方 Gemini 接口没有批量作业）。
+    """
+
+    STATES = {
+        "JOB_STATE_SUCCEEDED": BulkJobState.SUCCEEDED,
+        "JOB_STATE_PARTIALLY_SUCCEEDED": BulkJobState.SUCCEEDED,
+        "JOB_STATE_FAILED": BulkJobState.FAILED,
+        "JOB_STATE_EXPIRED": BulkJobState.FAILED,
+        "JOB_STATE_CANCELLED": BulkJobState.CANCELLED,
+    }
+
+    def __init__(self, api_key, model_name=None, result_storage=None, job_folder=None):
+        from ai_image_generator import create_image_generator
+        # 沿用 AIImageGenerator 的 API key 校验、模型名处理和 genai.Client
+        generator = create_image_generator("gemini", api_key, model_name)
+        self.client = generator.client
+        self.model = generator.model
+        if result_storage is None:
+            from result_storage import result_storage
+        self.result_storage = result_storage
+        self.job_folder = job_folder or BULK_JOB_FOLDER
+        self._references = {}  # 参考图内容的 sha256 -> 已上传文件（name, uri, mime_type）
+
+    def _upload_reference(self, image_data):
+        """上传参考图（相同内容只上传一次）"""
+        digest = hashlib.sha256(image_data).hexdigest()
+        if digest not in self._references:
+            from google.genai import types
+            from image_preprocess import image_mime_type
+            mime_type = image_mime_type(image_data)
+            uploaded = self.client.files.upload(
+                file=io.BytesIO(image_data),
+                config=types.UploadFileConfig(display_name=f"batchgen-ref-{digest[:16]}", mime_type=mime_type)
+            )
+            self._references[digest] = (uploaded.name, uploaded.uri, mime_type)
+        return self._references[digest]
+
+    def write_request(self, f, key, image_data, prompt):
+        if image_data:
+            _, file_uri, mime_type = self._upload_reference(image_data)
+            parts = [
+                {"text": f"Create a picture of my image with the following changes: {prompt}"},
+                {"file_data": {"mime_type": mime_type, "file_uri": file_uri}},
+            ]
+        else:
+            parts = [{"text": f"Create an image based on this description: {prompt}"}]
+        request = {
+            "contents": [{"role": "user", "parts": parts}],
+            "generation_config": {"response_modalities": ["TEXT", "IMAGE"]},
+        }
+        f.write(json.dumps({"key": key, "request": request}, ensure_ascii=False) + "\n")
+
+    def submit(self, job_path, display_name):
+        from google.genai import types
+        uploaded = self.client.files.upload(
+            file=job_path,
+            config=types.UploadFileConfig(display_name=display_name, mime_type='jsonl')
+        )
+        job = self.client.batches.create(model=self.model, src=uploaded.name, config={'display_name': display_name})
+        return job.name
+
+    def poll(self, job_id):
+        job = self.client.batches.get(name=job_id)
+        state = self.STATES.get(job.state.name, BulkJobState.RUNNING)
+        stats = job.completion_stats
+        completed = None
+        if stats is not None:
+            completed = (stats.successful_count or 0) + (stats.failed_count or 0)
+        error = job.error.message if job.error else None
+        return {"state": state, "completed": completed, "error": error}
+
+    def iter_results(self, job_id):
+        job = self.client.batches.get(name=job_id)
+        if not job.dest or not job.dest.file_name:
+            return
+        os.makedirs(self.job_folder, exist_ok=True)
+        output_path = os.path.join(self.job_folder, f"{job_id.replace('/', '_')}.output.jsonl")
+        self.client.files.download(file=job.dest.file_name, destination=output_path)
+        with open(output_path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    yield entry.get("key"), self._process_entry(entry)
+
+    def _process_entry(self, entry):
+        if entry.get("error"):
+            error = entry["error"]
+            return {
+                "success": False,
+                "error": f"Gemini 批量作业请求失败: {error.get('message') if isinstance(error, dict) else error}",
+                "api_type": "gemini"
+            }
+        for candidate in (entry.get("response") or {}).get("candidates") or []:
+            for part in (candidate.get("content") or {}).get("parts") or []:
+                inline_data = part.get("inlineData") or part.get("inline_data")
+                if inline_data and inline_data.get("data"):
+                    generated_filename = f"gemini_generated_{uuid.uuid4()}.png"
+                    generated_url = self.result_storage.put(generated_filename, base64.b64decode(inline_data["data"]))
+                    return {
+                        "success": True,
+                        "description": "成功使用Gemini批量作业生成图片",
+                        "generated_image_url": generated_url,
+                        "api_type": "gemini",
+                        "note": "图片已使用Gemini Batch API生成"
+                    }
+        return {
+            "success": False,
+            "error": "Gemini 批量作业结果中未找到图片数据",
+            "api_type": "gemini"
+        }
+
+    def cancel(self, job_id):
+        self.client.batches.cancel(name=job_id)
+
+    def cleanup(self, job_id):
+        try:
+            os.remove(os.path.join(self.job_folder, f"{job_id.replace('/', '_')}.output.jsonl"))
+        except FileNotFoundError:
+            pass
+        # 上传的参考图只用于本作业（每个任务一个 provider 实例），Files API 中的文件 48 小时后也会自动删除
+        for name, _, _ in self._references.values():
+            try:
+                self.client.files.delete(name=name)
+            except Exception as e:
+                logger.warning("删除批量作业的参考图 %s 失败: %s", name, e)
+        self._references = {}
+
+
+def bulk_supported(api_type, base_url=None):
+    """该 API 是否支持 bulk 模式（豆包和第三方 Gemini 接口没有批量作业）"""
+    return api_type == "mock" or (api_type == "gemini" and not base_url)
+
+
+def create_bulk_provider(api_type, api_key=None, model_name=None, base_url=None):
+    """
+    创建批量作业接口实例
+
+    Returns:
+        BulkJobProvider: Gemini 官方 API 使用 GeminiBulkProvider，Mock API 使用 LocalBulkProvider
+    """
+    if not bulk_supported(api_type, base_url):
+        raise ValueError(f"{api_type} API 不支持 bulk 模式")
+    if api_type == "gemini":
+        return GeminiBulkProvider(api_key, model_name)
+    return LocalBulkProvider(api_type, api_key, model_name, base_url)
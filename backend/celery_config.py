@@ -1,11 +1,29 @@
 from celery import Celery
+from celery.signals import setup_logging as celery_setup_logging
+from kombu import Queue
 import os
 
 # Redis配置
 REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
 
 # 创建Celery应用
-celery_app = Celery('batchgen_pro')
+celery_app = Celery('batchgen_pro', include=['tasks'])
+
+# 队列划分
+# - provider_io:  调用模型API，几乎全部时间在等待网络，使用线程/gevent池，高并发
+# - image_cpu:    图片后处理（缩略图等），CPU密集，使用prefork池，并发数不超过CPU核数
+# - bookkeeping:  写任务结果、通知等快速操作，独立队列保证不被慢调用阻塞
+PROVIDER_QUEUE = 'provider_io'
+IMAGE_QUEUE = 'image_cpu'
+BOOKKEEPING_QUEUE = 'bookkeeping'
+
+# 超时与模型调用超时对齐：Gemini 第三方接口600秒，豆包生成60秒+下载30秒，额外留出写文件的余量
+PROVIDER_TASK_TIME_LIMIT = int(os.getenv('PROVIDER_TASK_TIME_LIMIT', 660))
+PROVIDER_TASK_SOFT_TIME_LIMIT = int(os.getenv('PROVIDER_TASK_SOFT_TIME_LIMIT', 630))
+IMAGE_TASK_TIME_LIMIT = int(os.getenv('IMAGE_TASK_TIME_LIMIT', 120))
+IMAGE_TASK_SOFT_TIME_LIMIT = int(os.getenv('IMAGE_TASK_SOFT_TIME_LIMIT', 100))
+BOOKKEEPING_TASK_TIME_LIMIT = int(os.getenv('BOOKKEEPING_TASK_TIME_LIMIT', 30))
+BOOKKEEPING_TASK_SOFT_TIME_LIMIT = int(os.getenv('BOOKKEEPING_TASK_SOFT_TIME_LIMIT', 20))
 
 # Celery配置
 celery_app.conf.update(
@@ -17,14 +35,98 @@ celery_app.conf.update(
     timezone='UTC',
     enable_utc=True,
     task_track_started=True,
-    task_time_limit=300,  # 5分钟超时
+    task_time_limit=300,  # 5分钟超时（未单独配置的任务）
     task_soft_time_limit=240,  # 4分钟软超时
     worker_prefetch_multiplier=1,
     worker_max_tasks_per_child=1000,
+    # 慢任务执行完才确认，worker 异常退出时任务重新投递
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    # Redis broker 的可见性超时必须大于最长任务时间，否则未确认的长任务会被重复投递
+    broker_transport_options={'visibility_timeout': PROVIDER_TASK_TIME_LIMIT + 60},
 )
 
-# 任务路由 - 暂时使用默认队列
-# celery_app.conf.task_routes = {
-#     'batchgen_pro.tasks.generate_single_image': {'queue': 'image_generation'},
-#     'batchgen_pro.tasks.process_batch_task': {'queue': 'batch_processing'},
-# }
+celery_app.conf.task_queues = (
+    Queue(PROVIDER_QUEUE),
+    Queue(IMAGE_QUEUE),
+    Queue(BOOKKEEPING_QUEUE),
+)
+celery_app.conf.task_default_queue = BOOKKEEPING_QUEUE
+
+# 任务路由（任务名为 模块名.函数名）
+celery_app.conf.task_routes = {
+    'tasks.generate_single_image': {'queue': PROVIDER_QUEUE},
+    'tasks.generate_batch_item': {'queue': PROVIDER_QUEUE},
+    'tasks.process_batch_task': {'queue': PROVIDER_QUEUE},
+    'tasks.create_result_thumbnail': {'queue': IMAGE_QUEUE},
+    'tasks.record_batch_item_result': {'queue': BOOKKEEPING_QUEUE},
+    'tasks.update_task_results': {'queue': BOOKKEEPING_QUEUE},
+}
+
+# 各队列任务的超时
+_QUEUE_TIME_LIMITS = {
+    PROVIDER_QUEUE: (PROVIDER_TASK_TIME_LIMIT, PROVIDER_TASK_SOFT_TIME_LIMIT),
+    IMAGE_QUEUE: (IMAGE_TASK_TIME_LIMIT, IMAGE_TASK_SOFT_TIME_LIMIT),
+    BOOKKEEPING_QUEUE: (BOOKKEEPING_TASK_TIME_LIMIT, BOOKKEEPING_TASK_SOFT_TIME_LIMIT),
+}
+celery_app.conf.task_annotations = {
+    task_name: {
+        'time_limit': _QUEUE_TIME_LIMITS[route['queue']][0],
+        'soft_time_limit': _QUEUE_TIME_LIMITS[route['queue']][1],
+    }
+    for task_name, route in celery_app.conf.task_routes.items()
+}
+
+# 每个队列独立的 worker 配置（由 celery_worker.py 使用）
+#
+# 扩缩容策略：
+# - provider_io: 线程/gevent 池的并发数直接决定同时进行的模型调用数，内存开销小，固定为较大的值；
+#   Celery 的 --autoscale 只支持 prefork 池，因此按队列长度（LLEN provider_io）水平增加 worker 容器，
+#   队列积压持续超过 并发数*2 时扩容，持续为 0 时缩容
+# - image_cpu: prefork 池使用 --autoscale=CPU核数,1，空闲时只保留 1 个子进程
+# - bookkeeping: 任务很快，固定少量线程即可，预取更多任务以减少与 broker 的往返
+WORKER_PROFILES = {
+    PROVIDER_QUEUE: {
+        'pool': os.getenv('PROVIDER_WORKER_POOL', 'threads'),  # threads 或 gevent（需安装 gevent）
+        'concurrency': int(os.getenv('PROVIDER_WORKER_CONCURRENCY', 32)),
+        'autoscale': None,
+        'prefetch_multiplier': 1,
+    },
+    IMAGE_QUEUE: {
+        'pool': 'prefork',
+        'concurrency': None,
+        'autoscale': os.getenv('IMAGE_WORKER_AUTOSCALE', f"{os.cpu_count() or 1},1"),
+        'prefetch_multiplier': 1,
+    },
+    BOOKKEEPING_QUEUE: {
+        'pool': 'threads',
+        'concurrency': int(os.getenv('BOOKKEEPING_WORKER_CONCURRENCY', 8)),
+        'autoscale': None,
+        'prefetch_multiplier': 16,
+    },
+}
+
+
+def worker_argv(queue):
+    """生成启动指定队列 worker 的命令行参数"""
+    profile = WORKER_PROFILES[queue]
+    argv = [
+        'worker',
+        '--queues', queue,
+        '--hostname', f"{queue}@%h",
+        '--pool', profile['pool'],
+        '--prefetch-multiplier', str(profile['prefetch_multiplier']),
+        '--loglevel', os.getenv('LOG_LEVEL', 'INFO'),
+    ]
+    if profile['autoscale']:
+        argv += ['--autoscale', profile['autoscale']]
+    elif profile['concurrency']:
+        argv += ['--concurrency', str(profile['concurrency'])]
+    return argv
+
+
+@celery_setup_logging.connect
+def configure_worker_logging(**kwargs):
+    """连接该信号后 Celery 不再配置自己的日志，worker 与 web 进程一样通过队列写出（见 logging_config）"""
+    from logging_config import setup_logging
+    setup_logging()
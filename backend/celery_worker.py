@@ -0,0 +1,28 @@
+"""
+按队列启动 Celery worker，池类型、并发数和扩缩容参数见 celery_config.WORKER_PROFILES
+
+用法:
+    python celery_worker.py provider_io
+    python celery_worker.py image_cpu
+    python celery_worker.py bookkeeping
+"""
+import sys
+
+from celery import maybe_patch_concurrency
+from celery_config import celery_app, WORKER_PROFILES, worker_argv
+
+
+def main(argv=None):
+    argv = argv if argv is not None else sys.argv[1:]
+    if len(argv) != 1 or argv[0] not in WORKER_PROFILES:
+        print(f"用法: python celery_worker.py <{'|'.join(WORKER_PROFILES)}>")
+        return 1
+    worker_args = worker_argv(argv[0])
+    # gevent 池需要在加载任务模块（requests、redis 等）之前打补丁
+    maybe_patch_concurrency(worker_args)
+    celery_app.worker_main(worker_args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,7 +2,8 @@
 每日图片生成限额管理器
 使用Redis存储每个用户每天的生成数量，防止被攻击和薅羊毛
 
-每日限额：100张图片
+每日限额默认100张图片，可通过 DAILY_IMAGE_LIMIT 配置（0 表示不限制）
+批量任务按单张图片在生成前检查并扣减
 """
 from datetime import datetime, timedelta
 import redis
@@ -14,8 +15,8 @@ redis_port = int(os.getenv('REDIS_PORT', 6379))
 redis_password = os.getenv('REDIS_PASSWORD', None)
 redis_client = redis.Redis(host=redis_host, port=redis_port, password=redis_password, db=0, decode_responses=True)
 
-# 每日限额配置：100张图片/天
-DAILY_IMAGE_LIMIT = 100
+# 每日限额配置：默认100张图片/天
+DAILY_IMAGE_LIMIT = int(os.getenv('DAILY_IMAGE_LIMIT', 100))
 
 
 class DailyLimitManager:
@@ -26,7 +27,7 @@ class DailyLimitManager:
         初始化限额管理器
         
         Args:
-            daily_limit: 每日限额，默认100张图片
+            daily_limit: 每日限额，默认100张图片，0 表示不限制
         """
         self.redis_client = redis_client
         self.daily_limit = daily_limit
@@ -64,22 +65,26 @@ class DailyLimitManager:
         Returns:
             tuple: (是否允许, 当前已使用数量, 剩余可用数量)
         """
-        counter_key = self._make_counter_key(user_id)
-        current_count = self.get_user_daily_count(user_id)
+        if self.daily_limit <= 0:
+            return True, 0, None
         
-        # 检查是否超过限额
-        if current_count + image_count > self.daily_limit:
-            remaining = max(0, self.daily_limit - current_count)
-            return False, current_count, remaining
+        counter_key = self._make_counter_key(user_id)
         
-        # 增加计数，并设置过期时间为今天结束
+        # 设置过期时间为今天结束
         now = datetime.now()
         tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
         expire_seconds = int((tomorrow - now).total_seconds()) + 1  # 多加1秒确保过期
         
-        # 使用Redis的INCR命令原子性增加计数
-        new_count = self.redis_client.incrby(counter_key, image_count)
-        self.redis_client.expire(counter_key, expire_seconds)
+        # 先用 INCRBY 原子性增加计数，超过限额再退回，多个生成线程同时检查时不会超发
+        pipe = self.redis_client.pipeline()
+        pipe.incrby(counter_key, image_count)
+        pipe.expire(counter_key, expire_seconds)
+        new_count = pipe.execute()[0]
+        
+        if new_count > self.daily_limit:
+            current_count = self.redis_client.decrby(counter_key, image_count)
+            remaining = max(0, self.daily_limit - current_count)
+            return False, current_count, remaining
         
         remaining = self.daily_limit - new_count
         return True, new_count, remaining
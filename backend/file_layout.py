@@ -0,0 +1,164 @@
+"""
+结果和上传文件的分层目录布局
+
+RESULT_FOLDER 和 UPLOAD_FOLDER 原先是平铺目录，运行几个月后有上百万个文件，创建、查找和清理都越来越慢。
+新文件按文件名的 md5 放在两级子目录中：{folder}/{md5[0:2]}/{md5[2:4]}/{文件名}，
+共 65536 个子目录。URL 不变（/static/uploads/<文件名>、/static/results/<文件名>），由文件名算出所在目录。
+
+读取时先找分层路径，不存在再找原来的平铺路径，迁移前后和迁移过程中旧 URL 都能访问。
+已有文件用迁移命令在后台移入子目录，可在服务运行时执行（在 backend 目录下）:
+    python -m file_layout migrate uploads results --rate 500
+只迁移修改时间早于 --min-age 秒的文件：上传会话和任务中记录了上传文件的完整路径，
+这些记录过期（UPLOAD_SESSION_TTL）之前不移动文件。
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+# 迁移时跳过修改时间在该秒数内的文件，需大于 UPLOAD_SESSION_TTL 和 TASK_TTL
+LAYOUT_MIGRATE_MIN_AGE = int(os.getenv('LAYOUT_MIGRATE_MIN_AGE', 2 * 86400))
+# 迁移进度的输出间隔（文件数）
+MIGRATE_REPORT_EVERY = 10000
+
+
+def shard_dir(name):
+    """
+    Returns:
+        str: 文件所在的两级子目录（相对路径），如 "3f/a2"
+    """
+    digest = hashlib.md5(name.encode('utf-8')).hexdigest()
+    return os.path.join(digest[:2], digest[2:4])
+
+
+def sharded_path(folder, name, create=True):
+    """
+    新文件的写入路径
+
+    Args:
+        create: 是否创建所在的子目录
+    """
+    directory = os.path.join(folder, shard_dir(name))
+    if create:
+        os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+def resolve_path(folder, name):
+    """
+    已有文件的路径：分层路径，其次是迁移前的平铺路径
+
+    都不存在时返回分层路径（迁移在两次检查之间移动了文件时，文件就在分层路径）。
+    """
+    path = sharded_path(folder, name, create=False)
+    if os.path.exists(path):
+        return path
+    legacy_path = os.path.join(folder, name)
+    if os.path.isfile(legacy_path):
+        return legacy_path
+    return path
+
+
+def relative_path(folder, name):
+    """resolve_path 相对于 folder 的路径，用于 send_from_directory"""
+    return os.path.relpath(resolve_path(folder, name), folder)
+
+
+def open_file(folder, name, mode='rb'):
+    """打开已有文件；在平铺路径上找到但打开前被迁移走时，再从分层路径打开"""
+    path = resolve_path(folder, name)
+    try:
+        return open(path, mode)
+    except FileNotFoundError:
+        if path != os.path.join(folder, name):
+            raise
+        return open(sharded_path(folder, name, create=False), mode)
+
+
+def remove_file(folder, name):
+    """删除文件（两种路径都尝试），文件不存在时忽略"""
+    for path in (sharded_path(folder, name, create=False), os.path.join(folder, name)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def migrate(folder, rate=None, min_age=LAYOUT_MIGRATE_MIN_AGE, dry_run=False, report=None):
+    """
+    把 folder 顶层的平铺文件移入分层子目录
+
+    跳过目录（.partial、.bulk 等和已有的子目录）、以 "." 开头的临时文件和 min_age 秒内修改过的文件。
+    移动使用同一文件系统内的 os.replace，读取方只会看到移动前或移动后的文件。
+
+    Args:
+        rate: 每秒最多移动的文件数，None 表示不限速
+        report: 每移动 MIGRATE_REPORT_EVERY 个文件调用一次 report(stats)
+
+    Returns:
+        dict: scanned / moved / skipped 文件数
+    """
+    stats = {'scanned': 0, 'moved': 0, 'skipped': 0}
+    interval = 1.0 / rate if rate else 0
+    next_move = time.monotonic()
+    now = time.time()
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.startswith('.') or not entry.is_file(follow_symlinks=False):
+                continue
+            stats['scanned'] += 1
+            try:
+                if now - entry.stat(follow_symlinks=False).st_mtime < min_age:
+                    stats['skipped'] += 1
+                    continue
+                target = sharded_path(folder, entry.name, create=not dry_run)
+                if os.path.exists(target):
+                    # 同名文件已写入分层路径，读取时以分层路径为准，保留平铺文件由人工处理
+                    stats['skipped'] += 1
+                    continue
+                if interval:
+                    delay = next_move - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    next_move = max(next_move, time.monotonic()) + interval
+                if not dry_run:
+                    os.replace(entry.path, target)
+            except FileNotFoundError:
+                # 扫描期间被删除
+                stats['skipped'] += 1
+                continue
+            stats['moved'] += 1
+            if report is not None and stats['moved'] % MIGRATE_REPORT_EVERY == 0:
+                report(stats)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="结果 / 上传目录的分层布局工具")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subparsers.add_parser('migrate', help='把平铺目录中的已有文件移入分层子目录')
+    migrate_parser.add_argument('folders', nargs='+', help='要迁移的目录，如 uploads results')
+    migrate_parser.add_argument('--rate', type=float, default=None, help='每秒最多移动的文件数，默认不限速')
+    migrate_parser.add_argument('--min-age', type=int, default=LAYOUT_MIGRATE_MIN_AGE,
+                                help='只迁移修改时间早于该秒数的文件')
+    migrate_parser.add_argument('--dry-run', action='store_true', help='只统计，不移动文件')
+    args = parser.parse_args(argv)
+
+    def report(stats):
+        print(f"  已移动 {stats['moved']}，跳过 {stats['skipped']}", flush=True)
+
+    for folder in args.folders:
+        if not os.path.isdir(folder):
+            print(f"{folder}: 目录不存在，跳过")
+            continue
+        start = time.time()
+        print(f"{folder}: 开始迁移", flush=True)
+        stats = migrate(folder, rate=args.rate, min_age=args.min_age, dry_run=args.dry_run, report=report)
+        print(f"{folder}: 扫描 {stats['scanned']}，{'可移动' if args.dry_run else '已移动'} {stats['moved']}，"
+              f"跳过 {stats['skipped']}，耗时 {time.time() - start:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
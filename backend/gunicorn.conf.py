@@ -0,0 +1,83 @@
+"""
+生产环境 WSGI 服务配置
+
+启动:
+    gunicorn -c gunicorn.conf.py app:app
+
+python app.py 启动的是 Flask 开发服务器，仅用于本地开发。
+"""
+import multiprocessing
+import os
+import signal
+import time
+
+# 监听地址
+bind = f"0.0.0.0:{os.getenv('PORT', 5001)}"
+
+# worker 进程数与并发模型
+# - gthread（默认）：每个进程 WEB_THREADS 个线程，请求大部分时间在等待模型调用，线程足够
+# - gevent：需额外安装 gevent，适合大量长连接
+workers = int(os.getenv('WEB_WORKERS', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = os.getenv('WEB_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('WEB_THREADS', 8))
+worker_connections = int(os.getenv('WEB_WORKER_CONNECTIONS', 1000))  # 仅 gevent 生效
+
+# 请求超时与 nginx 的 proxy_read_timeout（300秒）对齐，nginx 断开后 worker 不再继续占用
+timeout = int(os.getenv('WEB_TIMEOUT', 300))
+# 收到 SIGTERM 后等待进行中的请求和生成任务完成的时间，部署时 docker 的 stop_grace_period 需大于该值
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 120))
+# nginx 到后端默认不复用连接，保持较短的 keep-alive
+keepalive = int(os.getenv('WEB_KEEPALIVE', 5))
+
+# 定期重启 worker，释放图片处理造成的内存碎片（0 表示不重启）
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.getenv('WEB_MAX_REQUESTS_JITTER', 50))
+
+# 在主进程中预先导入应用，worker fork 后共享已导入的模块
+# 生成线程由调度器在第一次提交任务时才创建，Redis 连接池在 fork 后会自动重建
+preload_app = os.getenv('WEB_PRELOAD', 'true').lower() == 'true'
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.getenv('LOG_LEVEL', 'info').lower()
+
+# worker 收到 SIGTERM 的时间（time.monotonic()），worker_exit 的等待从这里开始计算
+_term_received_at = None
+
+
+def post_worker_init(worker):
+    """收到 SIGTERM 时立即停止调度器接收新任务，排队中的生成任务以失败结束，不再占用退出等待时间"""
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handle_term(signum, frame):
+        global _term_received_at
+        from scheduler import generation_scheduler
+        if _term_received_at is None:
+            _term_received_at = time.monotonic()
+        generation_scheduler.shutdown(wait=False)
+        if callable(previous):
+            previous(signum, frame)
+
+    signal.signal(signal.SIGTERM, handle_term)
+
+
+def worker_exit(server, worker):
+    """
+    worker 退出前等待正在执行的模型调用完成
+
+    gunicorn 收到 SIGTERM 后停止接收新请求并等待进行中的请求完成（最多 graceful_timeout 秒），随后调用此钩子。
+    请求线程结束后调度器中可能仍有生成任务在执行（例如等待结果的请求已被 nginx 断开），这里等待它们完成。
+    主进程在发出 SIGTERM graceful_timeout 秒后强制结束 worker，等待请求已用掉的时间不再重复等待，
+    等待生成任务和等待结果写入共用剩下的时间。
+    """
+    from scheduler import generation_scheduler
+    deadline = (_term_received_at or time.monotonic()) + graceful_timeout
+    stats = generation_scheduler.stats()
+    if stats['running']:
+        server.log.info(f"worker {worker.pid} 正在等待 {stats['running']} 个生成任务完成")
+    if not generation_scheduler.shutdown(timeout=max(0, deadline - time.monotonic())):
+        server.log.warning(f"worker {worker.pid} 等待生成任务超时，仍有任务未完成")
+    # 生成完成的图片可能仍在后台写入
+    from result_writer import result_writer
+    if not result_writer.flush(timeout=max(0, deadline - time.monotonic())):
+        server.log.warning(f"worker {worker.pid} 等待结果写入超时，仍有图片未写入")
@@ -0,0 +1,232 @@
+"""
+参考图预处理
+
+用户上传的图片（尤其是手机照片）常常有 10MB 以上、4000px 以上，直接 base64 发给模型会放大请求体、
+上传时间和模型处理时间，而模型实际使用的分辨率有限。发送前按每个 API 的有效最大边长缩小，
+应用 EXIF 方向后去掉元数据，并重新编码（有透明通道用 PNG，否则 JPEG）。
+已经足够小且不含元数据的图片保持原样。
+
+解码和编码是 CPU 密集操作，在独立的进程池中执行，不占用 web / 生成线程的 GIL；
+结果按 输入哈希 + 处理参数 缓存到磁盘，同一参考图重复生成 N 张时只处理一次。
+"""
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'uploads')
+
+# 是否启用预处理
+INPUT_PREPROCESS = os.getenv('INPUT_PREPROCESS', 'true').lower() == 'true'
+# 各 API 的输入图片最大边长（像素），0 表示不缩放
+INPUT_MAX_DIMENSION = {
+    "gemini": int(os.getenv('GEMINI_INPUT_MAX_DIMENSION', 1536)),
+    "doubao": int(os.getenv('DOUBAO_INPUT_MAX_DIMENSION', 2048)),
+    "mock": int(os.getenv('MOCK_INPUT_MAX_DIMENSION', 1024)),
+}
+INPUT_JPEG_QUALITY = int(os.getenv('INPUT_JPEG_QUALITY', 90))
+# 预处理进程数，0 表示在调用线程中处理
+INPUT_PREPROCESS_WORKERS = int(os.getenv('INPUT_PREPROCESS_WORKERS', min(4, os.cpu_count() or 1)))
+# 预处理结果缓存目录和保留时间（秒）
+INPUT_CACHE_FOLDER = os.getenv('INPUT_CACHE_FOLDER', os.path.join(UPLOAD_FOLDER, '.preprocessed'))
+INPUT_CACHE_TTL = int(os.getenv('INPUT_CACHE_TTL', 86400))
+
+logger = logging.getLogger(__name__)
+
+# 清理过期缓存的最小间隔（秒）
+CACHE_SWEEP_INTERVAL = 600
+# 直接发送时各 API 都支持的格式
+PASSTHROUGH_FORMATS = ("JPEG", "PNG", "WEBP")
+
+
+def sniff_image_type(header):
+    """
+    根据文件头判断图片类型
+
+    Returns:
+        tuple: (扩展名集合, MIME 类型)，无法识别时返回 (None, None)
+    """
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return {'png'}, 'image/png'
+    if header.startswith(b'\xff\xd8\xff'):
+        return {'jpg', 'jpeg'}, 'image/jpeg'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return {'gif'}, 'image/gif'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return {'webp'}, 'image/webp'
+    return None, None
+
+
+def image_mime_type(image_data, default="image/png"):
+    """根据文件头返回图片的 MIME 类型"""
+    _, mime_type = sniff_image_type(image_data[:12])
+    return mime_type or default
+
+
+def process_image(image_data, max_dimension, jpeg_quality):
+    """
+    缩放并重新编码一张图片（在进程池中执行）
+
+    Returns:
+        bytes: 处理后的图片，不需要处理时返回原始数据
+    """
+    from PIL import Image, ImageOps
+
+    image = Image.open(io.BytesIO(image_data))
+    original_format = image.format
+    has_metadata = bool(image.getexif()) or any(key in image.info for key in ('exif', 'xmp', 'comment'))
+    needs_resize = bool(max_dimension) and max(image.size) > max_dimension
+
+    if original_format in PASSTHROUGH_FORMATS and not needs_resize and not has_metadata:
+        return image_data
+
+    # 动图只取第一帧；先应用 EXIF 方向，随后编码时不再写入元数据（保留 ICC 色彩配置）
+    icc_profile = image.info.get('icc_profile')
+    image.seek(0)
+    image = ImageOps.exif_transpose(image)
+    if needs_resize:
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+    output = io.BytesIO()
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    if has_alpha:
+        image.save(output, format="PNG", compress_level=6, icc_profile=icc_profile)
+    else:
+        image.convert("RGB").save(output, format="JPEG", quality=jpeg_quality, optimize=True, icc_profile=icc_profile)
+    processed = output.getvalue()
+
+    # 只是去掉元数据但重新编码后反而更大时，保留原图
+    if original_format in PASSTHROUGH_FORMATS and not needs_resize and len(processed) >= len(image_data):
+        return image_data
+    return processed
+
+
+class ImagePreprocessor:
+    """参考图预处理：进程池 + 磁盘缓存，同一输入的并发请求只处理一次"""
+
+    def __init__(self, workers=INPUT_PREPROCESS_WORKERS, cache_folder=INPUT_CACHE_FOLDER, jpeg_quality=INPUT_JPEG_QUALITY):
+        self.workers = workers
+        self.cache_folder = cache_folder
+        self.jpeg_quality = jpeg_quality
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = {}  # 缓存键 -> Future
+        self._last_sweep = 0.0
+
+    def _get_executor(self):
+        """第一次使用时创建进程池；Celery prefork 子进程是守护进程，不能再创建子进程，在当前线程处理"""
+        if self.workers <= 0 or multiprocessing.current_process().daemon:
+            return None
+        with self._lock:
+            if self._executor is None:
+                # web 进程中有多个线程，使用 spawn 避免 fork 继承锁状态
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def _cache_key(self, image_data, max_dimension):
+        digest = hashlib.sha256(image_data).hexdigest()
+        return f"{digest}_{max_dimension}_{self.jpeg_quality}"
+
+    def _cache_path(self, key):
+        return os.path.join(self.cache_folder, key)
+
+    def _read_cache(self, key):
+        try:
+            with open(self._cache_path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_cache(self, key, data):
+        os.makedirs(self.cache_folder, exist_ok=True)
+        tmp_path = f"{self._cache_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self._cache_path(key))
+        self._sweep_cache()
+
+    def _sweep_cache(self):
+        """删除超过保留时间的缓存文件"""
+        now = time.time()
+        if now - self._last_sweep < CACHE_SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        try:
+            with os.scandir(self.cache_folder) as entries:
+                for entry in entries:
+                    try:
+                        if now - entry.stat().st_mtime > INPUT_CACHE_TTL:
+                            os.remove(entry.path)
+                    except OSError:
+                        pass
+        except FileNotFoundError:
+            pass
+
+    def _process(self, image_data, max_dimension):
+        executor = self._get_executor()
+        if executor is None:
+            return process_image(image_data, max_dimension, self.jpeg_quality)
+        return executor.submit(process_image, image_data, max_dimension, self.jpeg_quality).result()
+
+    def prepare(self, image_data, api_type):
+        """
+        返回发送给指定 API 的参考图
+
+        处理失败时（例如无法识别的格式）返回原始数据，由模型 API 返回具体错误。
+
+        Args:
+            image_data: 原始图片的二进制数据（None 表示纯文本生成）
+            api_type: API类型
+
+        Returns:
+            bytes: 处理后的图片
+        """
+        if not image_data or not INPUT_PREPROCESS:
+            return image_data
+        max_dimension = INPUT_MAX_DIMENSION.get(api_type, 0)
+        key = self._cache_key(image_data, max_dimension)
+
+        cached = self._read_cache(key)
+        if cached is not None:
+            return cached
+
+        # 同一进程内相同输入的并发请求等待第一个请求的结果
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+        if not owner:
+            return future.result()
+
+        processed = image_data
+        try:
+            processed = self._process(image_data, max_dimension)
+            try:
+                self._write_cache(key, processed)
+            except OSError as e:
+                logger.warning("Failed to cache preprocessed image: %s", e)
+        except Exception as e:
+            logger.warning("Image preprocessing failed, sending original: %s", e)
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            future.set_result(processed)
+        return processed
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+# 全局实例
+image_preprocessor = ImagePreprocessor()
@@ -0,0 +1,219 @@
+"""
+批量请求的流式接收
+
+Werkzeug 解析 multipart 表单时会先把所有文件读入内存或临时文件，之后 file.save 再复制一次，
+每张图片要读写多遍。这里直接从请求体流式解析，每个文件边接收边写入 UPLOAD_FOLDER 中的最终位置，
+同时计算 SHA-256 并根据文件头判断图片类型，类型不符时立即拒绝，不再读取剩余数据。
+请求处理的内存占用与上传大小无关，下游只拿到 IngestedFile（文件名、路径、大小、哈希）。
+
+使用该模块的接口不能再访问 request.form / request.files（会触发 Werkzeug 的解析）。
+"""
+import hashlib
+import os
+import uuid
+
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+from werkzeug.utils import secure_filename
+from werkzeug.wsgi import get_input_stream
+
+import file_layout
+from image_preprocess import sniff_image_type
+
+UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'uploads')
+MAX_FILE_SIZE = int(os.getenv('MAX_FILE_SIZE', 10 * 1024 * 1024))  # 单个文件的大小上限
+ALLOWED_EXTENSIONS = set(os.getenv('ALLOWED_EXTENSIONS', 'png,jpg,jpeg,gif,webp').split(','))
+# 流式接收的整个请求的大小上限，需与 nginx 的 client_max_body_size 一致
+MAX_INGEST_REQUEST_SIZE = int(os.getenv('MAX_INGEST_REQUEST_SIZE', 100 * 1024 * 1024))
+
+# 每次从请求体读取的字节数
+READ_BLOCK_SIZE = 64 * 1024
+# 普通表单字段（prompt、upload_ids 等）的总大小上限
+MAX_FORM_MEMORY_SIZE = 1024 * 1024
+# 判断图片类型需要的文件头字节数
+SNIFF_BYTES = 12
+
+
+class IngestError(ValueError):
+    """请求内容不合法，status_code 为对应的 HTTP 状态码"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class IngestedFile:
+    """已写入磁盘的上传文件"""
+
+    __slots__ = ("field_name", "filename", "file_path", "size", "sha256", "mime_type")
+
+    def __init__(self, field_name, filename, file_path, size, sha256, mime_type):
+        self.field_name = field_name
+        self.filename = filename
+        self.file_path = file_path
+        self.size = size
+        self.sha256 = sha256
+        self.mime_type = mime_type
+
+    def to_image_data(self):
+        """批量任务使用的图片数据"""
+        return {
+            'filename': self.filename,
+            'file_path': self.file_path,
+            'sha256': self.sha256,
+            'mime_type': self.mime_type
+        }
+
+
+class _FileWriter:
+    """一个文件部分的接收状态：写入磁盘、计算哈希、检查文件头和大小"""
+
+    def __init__(self, field_name, filename, upload_folder, max_file_size):
+        self.field_name = field_name
+        self.filename = filename
+        self.max_file_size = max_file_size
+        self.file_path = file_layout.sharded_path(upload_folder, f"{uuid.uuid4()}_{filename}")
+        self.size = 0
+        self.mime_type = None
+        self._hash = hashlib.sha256()
+        self._header = b''
+        self._file = open(self.file_path, 'wb')
+
+    def write(self, data):
+        if not data:
+            return
+        self.size += len(data)
+        if self.size > self.max_file_size:
+            raise IngestError(f"文件 {self.filename} 超过大小上限 {self.max_file_size} 字节", 413)
+        if self.mime_type is None:
+            self._header += data[:SNIFF_BYTES]
+            if len(self._header) >= SNIFF_BYTES:
+                self._check_type()
+        self._hash.update(data)
+        self._file.write(data)
+
+    def _check_type(self):
+        extensions, mime_type = sniff_image_type(self._header)
+        if not extensions or not extensions & ALLOWED_EXTENSIONS:
+            raise IngestError(f"文件 {self.filename} 不是支持的图片格式", 415)
+        self.mime_type = mime_type
+
+    def finish(self):
+        self._file.close()
+        if self.mime_type is None:
+            # 文件不足 SNIFF_BYTES 字节
+            self._check_type()
+        return IngestedFile(self.field_name, self.filename, self.file_path, self.size,
+                            self._hash.hexdigest(), self.mime_type)
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self.file_path)
+        except FileNotFoundError:
+            pass
+
+
+def ingest_multipart(environ, file_fields=('files', 'file'), upload_folder=UPLOAD_FOLDER,
+                     max_file_size=MAX_FILE_SIZE, max_files=None, max_request_size=MAX_INGEST_REQUEST_SIZE):
+    """
+    流式解析 multipart/form-data 请求，文件直接写入 upload_folder
+
+    出错时删除本次请求已写入的文件。文件名为空或扩展名不支持的文件部分会被跳过（与 allowed_file 的处理一致）。
+
+    Args:
+        environ: WSGI environ（request.environ）
+        file_fields: 接收文件的字段名
+        max_files: 文件数上限，None 表示不限制
+
+    Returns:
+        tuple: (form, files)，form 为普通字段的 MultiDict，files 为 IngestedFile 列表（按上传顺序）
+    """
+    content_type, options = parse_options_header(environ.get('CONTENT_TYPE', ''))
+    boundary = options.get('boundary')
+    if content_type != 'multipart/form-data' or not boundary:
+        raise IngestError("请求必须是 multipart/form-data")
+
+    try:
+        stream = get_input_stream(environ, safe_fallback=False, max_content_length=max_request_size)
+    except RequestEntityTooLarge:
+        raise IngestError(f"请求大小超过上限 {max_request_size} 字节", 413)
+
+    decoder = MultipartDecoder(boundary.encode('latin-1'), max_form_memory_size=MAX_FORM_MEMORY_SIZE)
+    form = MultiDict()
+    files = []
+    writer = None  # 当前文件部分
+    field = None  # 当前普通字段：[name, bytearray]
+    form_size = 0
+    stream_ended = False
+
+    try:
+        finished = False
+        while not finished:
+            event = decoder.next_event()
+            if isinstance(event, NeedData):
+                if stream_ended:
+                    raise IngestError("请求数据不完整")
+                try:
+                    block = stream.read(READ_BLOCK_SIZE)
+                except RequestEntityTooLarge:
+                    raise IngestError(f"请求大小超过上限 {max_request_size} 字节", 413)
+                stream_ended = not block
+                decoder.receive_data(block or None)
+            elif isinstance(event, File):
+                filename = secure_filename(event.filename or '')
+                allowed = '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+                # 不接收的文件部分不创建 writer，其数据直接丢弃
+                if event.name in file_fields and allowed:
+                    if max_files is not None and len(files) >= max_files:
+                        raise IngestError(f"最多上传 {max_files} 个文件")
+                    writer = _FileWriter(event.name, filename, upload_folder, max_file_size)
+            elif isinstance(event, Field):
+                field = [event.name, bytearray()]
+            elif isinstance(event, Data):
+                if writer is not None:
+                    writer.write(event.data)
+                elif field is not None:
+                    form_size += len(event.data)
+                    if form_size > MAX_FORM_MEMORY_SIZE:
+                        raise IngestError("表单字段过大", 413)
+                    field[1] += event.data
+                if not event.more_data:
+                    if writer is not None:
+                        files.append(writer.finish())
+                        writer = None
+                    elif field is not None:
+                        form.add(field[0], field[1].decode('utf-8', 'replace'))
+                        field = None
+            elif isinstance(event, Epilogue):
+                finished = True
+    except RequestEntityTooLarge:
+        _discard(writer, files)
+        raise IngestError("表单字段过大", 413)
+    except ValueError as e:
+        # IngestError 以及 multipart 格式错误
+        _discard(writer, files)
+        if isinstance(e, IngestError):
+            raise
+        raise IngestError(f"请求格式错误: {str(e)}")
+    except BaseException:
+        _discard(writer, files)
+        raise
+    return form, files
+
+
+def discard_files(files):
+    """删除已接收的文件（请求校验失败时调用）"""
+    for ingested in files:
+        try:
+            os.remove(ingested.file_path)
+        except FileNotFoundError:
+            pass
+
+
+def _discard(writer, files):
+    if writer is not None:
+        writer.abort()
+    discard_files(files)
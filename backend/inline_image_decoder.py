@@ -0,0 +1,213 @@
+"""
+JSON 响应中内联 base64 图片的流式解码
+
+豆包 response_format=b64_json 时图片以 base64 字符串放在 JSON 响应的 data[].b64_json 中，一张 2K 图片约 4~6MB。
+InlineImageExtractor 逐块接收响应体，遇到 b64_json 字段时把字符串边解码边写入结果存储（result_storage），
+其余部分（很小）保留下来，字段值替换为已写入的文件名，最后作为普通 JSON 解析。
+整个响应和解码后的图片都不需要完整放在内存中。
+
+spool=True 时解码后的图片边解码边写入本地暂存文件（storage.spool_path，见 images），
+由调用方在响应解析成功后交给 result_writer.submit_file 在后台移入存储或上传，生成线程不等待落盘 / 上传，
+图片同样不需要放在内存中。
+"""
+import base64
+import binascii
+import os
+import uuid
+
+from image_preprocess import image_mime_type
+
+# 解码后的图片扩展名
+IMAGE_EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/gif": "gif",
+    "image/webp": "webp",
+}
+
+
+class InlineImageExtractor:
+    """从 JSON 响应流中提取 base64 图片并写入文件"""
+
+    _SEARCH, _BEFORE_VALUE, _VALUE = range(3)
+
+    def __init__(self, storage, prefix, field="b64_json", spool=False, max_images=None):
+        """
+        Args:
+            storage: 图片写入的 ResultStorage
+            prefix: 文件名前缀，文件名为 {prefix}_generated_{uuid}.{扩展名}
+            field: 包含 base64 图片的字段名
+            spool: 为 True 时不写入 storage，解码后的图片写入暂存文件，以 (文件名, 暂存文件路径) 存入 images，
+                   暂存文件由调用方交给 result_writer.submit_file（之后由其删除）
+            max_images: 最多保留的图片数，之后的图片不解码也不写入，字段值替换为 null（调用方只使用前几张时避免留下孤立文件）
+        """
+        self.storage = storage
+        self.prefix = prefix
+        self.key = f'"{field}"'.encode('ascii')
+        self.spool = spool
+        self.max_images = max_images
+        self.bytes_received = 0
+        self.filenames = []
+        self.images = []
+        self._state = self._SEARCH
+        self._pending = b''  # 尚未处理的响应数据
+        self._skeleton = bytearray()  # 去掉图片数据后的 JSON
+        self._b64 = b''  # 不足 4 个字符、暂不能解码的 base64
+        self._header = b''  # 图片开头的字节，用于判断格式（确定格式前暂存在这里）
+        self._writer = None
+        self._filename = None
+        self._discard = False  # 当前图片超出 max_images，丢弃
+
+    def feed(self, chunk):
+        """处理一块响应数据"""
+        self.bytes_received += len(chunk)
+        self._pending += chunk
+        while self._pending:
+            if self._state == self._SEARCH:
+                index = self._pending.find(self.key)
+                if index < 0:
+                    # 保留可能是字段名开头的尾部
+                    keep = len(self.key) - 1
+                    self._skeleton += self._pending[:-keep] if len(self._pending) > keep else b''
+                    self._pending = self._pending[-keep:] if len(self._pending) > keep else self._pending
+                    return
+                end = index + len(self.key)
+                self._skeleton += self._pending[:end]
+                self._pending = self._pending[end:]
+                self._state = self._BEFORE_VALUE
+            elif self._state == self._BEFORE_VALUE:
+                # 跳过冒号和空白，直到字符串开头的引号
+                index = self._pending.find(b'"')
+                if index < 0:
+                    self._skeleton += self._pending
+                    self._pending = b''
+                    return
+                self._skeleton += self._pending[:index]
+                self._pending = self._pending[index + 1:]
+                self._start_image()
+                self._state = self._VALUE
+            else:
+                index = self._pending.find(b'"')
+                if index < 0:
+                    data = self._pending
+                    # 转义符可能被拆到下一块
+                    if data.endswith(b'\\'):
+                        data, self._pending = data[:-1], b'\\'
+                    else:
+                        self._pending = b''
+                    self._write_base64(data)
+                    return
+                self._write_base64(self._pending[:index])
+                self._pending = self._pending[index + 1:]
+                self._finish_image()
+                self._state = self._SEARCH
+
+    def close(self):
+        """
+        响应接收完毕
+
+        Returns:
+            bytes: 图片字段替换为文件名后的 JSON
+        """
+        if self._state != self._SEARCH:
+            self.abort()
+            raise ValueError("响应在图片数据中间结束")
+        self._skeleton += self._pending
+        self._pending = b''
+        return bytes(self._skeleton)
+
+    def abort(self):
+        """删除已写入的文件（spool 模式下删除暂存文件）"""
+        if self._writer is not None:
+            self._writer.abort()
+            self._writer = None
+        if self.spool:
+            for _, path in self.images:
+                _remove_spooled(path)
+        else:
+            for name in self.filenames:
+                self.storage.delete(name)
+        self.filenames = []
+        self.images = []
+
+    def _start_image(self):
+        self._b64 = b''
+        self._header = b''
+        self._writer = None
+        self._discard = self.max_images is not None and len(self.filenames) >= self.max_images
+
+    def _open_writer(self):
+        # 根据文件头确定扩展名后才创建文件
+        extension = IMAGE_EXTENSIONS.get(image_mime_type(self._header), "png")
+        self._filename = f"{self.prefix}_generated_{uuid.uuid4()}.{extension}"
+        if self.spool:
+            self._writer = _SpoolWriter(self.storage.spool_path(self._filename))
+        else:
+            self._writer = self.storage.open_writer(self._filename)
+        self._writer.write(self._header)
+
+    def _write_base64(self, data):
+        if self._discard:
+            return
+        # base64 中不会出现反斜杠，只可能是 JSON 转义（\/ 或换行）
+        if b'\\' in data:
+            data = data.replace(b'\\/', b'/').replace(b'\\n', b'').replace(b'\\r', b'')
+        data = self._b64 + data
+        usable = len(data) - len(data) % 4
+        self._b64 = data[usable:]
+        if usable:
+            self._write_bytes(data[:usable])
+
+    def _write_bytes(self, data):
+        try:
+            decoded = base64.b64decode(data, validate=True)
+        except binascii.Error:
+            raise ValueError("图片 base64 数据格式错误")
+        if self._writer is None:
+            self._header += decoded
+            if len(self._header) >= 12:
+                self._open_writer()
+        else:
+            self._writer.write(decoded)
+
+    def _finish_image(self):
+        if self._discard:
+            self._skeleton += b'null'
+            return
+        if self._b64:
+            self._write_bytes(self._b64 + b'=' * (-len(self._b64) % 4))
+            self._b64 = b''
+        if self._writer is None:
+            self._open_writer()
+        self._writer.commit()
+        if self.spool:
+            self.images.append((self._filename, self._writer.path))
+        self._writer = None
+        self.filenames.append(self._filename)
+        # 字段值替换为文件名
+        self._skeleton += f'"{self._filename}"'.encode('utf-8')
+
+
+def _remove_spooled(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class _SpoolWriter:
+    """spool 模式下代替 storage 的 writer，写入本地暂存文件（不 fsync，落盘由 storage.put_file 完成）"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'wb')
+
+    def write(self, data):
+        self._file.write(data)
+
+    def commit(self):
+        self._file.close()
+
+    def abort(self):
+        self._file.close()
+        _remove_spooled(self.path)
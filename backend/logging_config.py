@@ -0,0 +1,204 @@
+"""
+日志配置
+
+print 是同步写 stdout 的，容器日志驱动限流或磁盘变慢时会直接卡住请求线程和生成线程。
+这里把所有日志交给有界队列（QueueHandler），由后台线程统一格式化并写出：
+- 调用方只做入队，队列已满时丢弃并计数，绝不等待
+- 输出为一行一条的 JSON（LOG_FORMAT=json，默认）或普通文本
+- 每个 logger 可单独设置级别（LOG_LEVELS）
+- 逐张图片的调试日志带 extra={"sampled": True}，只按 LOG_SAMPLE_RATE 的比例保留
+- 写出前自动隐去 API Key：字段名含 key / token / secret 的 extra 字段，以及消息中形如 API Key 的字符串
+
+web 进程和 Celery worker 启动时调用 setup_logging()，各模块使用 logging.getLogger(__name__)。
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# 按 logger 设置级别，例如 "tasks=DEBUG,urllib3=WARNING"
+LOG_LEVELS = os.getenv('LOG_LEVELS', '')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+# 带 sampled 标记的逐条调试日志的保留比例 (0~1)
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 0.05))
+# 队列中最多缓存的日志条数，写出跟不上时丢弃新日志
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+
+# LogRecord 的标准属性，其余属性视为 extra 字段
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'sampled'}
+# 字段名包含这些词时整个值隐去
+_SECRET_FIELD = re.compile(r'key|token|secret|password|authorization', re.IGNORECASE)
+# 消息中形如 API Key 的字符串：Gemini（AIza...）、sk-...、Bearer 令牌、api_key=... / X-API-Key: ... 形式的参数
+_SECRET_PATTERNS = [
+    (re.compile(r'AIza[0-9A-Za-z_\-]{20,}'), '***'),
+    (re.compile(r'\bsk-[0-9A-Za-z_\-]{16,}'), '***'),
+    (re.compile(r'(Bearer\s+)[^\s"\',]+', re.IGNORECASE), r'\1***'),
+    (re.compile(r'((?:api[_-]?key|access[_-]?token)["\']?\s*[=:]\s*["\']?)[^\s"\'&,]+', re.IGNORECASE), r'\1***'),
+]
+
+
+def redact(text):
+    """隐去文本中形如 API Key 的字符串"""
+    for pattern, replacement in _SECRET_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def _extra_fields(record):
+    return {name: value for name, value in vars(record).items() if name not in _RECORD_ATTRS}
+
+
+class RedactingFilter(logging.Filter):
+    """在写出线程中隐去消息和 extra 字段中的 API Key"""
+
+    def filter(self, record):
+        record.msg = redact(str(record.msg))
+        if record.exc_text:
+            record.exc_text = redact(record.exc_text)
+        for name, value in _extra_fields(record).items():
+            if _SECRET_FIELD.search(name):
+                setattr(record, name, '***' if value else value)
+            elif isinstance(value, str):
+                setattr(record, name, redact(value))
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """按比例保留带 sampled 标记的日志，WARNING 及以上总是保留"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if getattr(record, 'sampled', False) and record.levelno < logging.WARNING:
+            return random.random() < self.rate
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """一行一条的紧凑 JSON：t、level、logger、msg、thread，以及 extra 字段和异常堆栈"""
+
+    def format(self, record):
+        entry = {
+            "t": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for name, value in _extra_fields(record).items():
+            entry[name] = value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, separators=(',', ':'))
+
+
+class TextFormatter(logging.Formatter):
+    """普通文本格式，extra 字段以 key=value 附在消息后"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s [%(name)s] %(message)s')
+
+    def formatMessage(self, record):
+        line = super().formatMessage(record)
+        fields = ' '.join(f"{name}={value}" for name, value in _extra_fields(record).items())
+        return f"{line} {fields}" if fields else line
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """只入队不等待：队列已满时丢弃日志并计数，下次入队成功时补一条丢弃提示"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        # 在调用线程中只合并消息参数和保存异常堆栈，JSON 格式化和隐去 API Key 在写出线程中进行
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return
+        if self.dropped:
+            with self._lock:
+                dropped, self.dropped = self.dropped, 0
+            notice = logging.makeLogRecord({
+                'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': f"日志队列已满，丢弃了 {dropped} 条日志", 'dropped': dropped,
+            })
+            try:
+                self.queue.put_nowait(notice)
+            except queue.Full:
+                with self._lock:
+                    self.dropped += dropped + 1
+
+
+_listener = None
+_handler = None
+
+
+def _start_listener():
+    global _listener
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(TextFormatter() if LOG_FORMAT == 'text' else JsonFormatter())
+    output.addFilter(RedactingFilter())
+    _handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+    _listener = QueueListener(_handler.queue, output, respect_handler_level=True)
+    _listener.start()
+
+
+def _after_fork():
+    # fork 出的子进程（gunicorn worker、Celery prefork 子进程）中没有父进程的写出线程，重新创建队列和线程
+    if _handler is not None:
+        _handler._lock = threading.Lock()
+        _start_listener()
+
+
+def stop_logging():
+    """写出队列中剩余的日志并停止写出线程（进程退出时自动调用）"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def setup_logging():
+    """配置根 logger（重复调用只生效一次）"""
+    global _handler
+    if _handler is not None:
+        return
+    _handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+    _start_listener()
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(_handler)
+    root.setLevel(LOG_LEVEL)
+    for item in LOG_LEVELS.split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+    atexit.register(stop_logging)
+    os.register_at_fork(after_in_child=_after_fork)
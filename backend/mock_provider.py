@@ -0,0 +1,87 @@
+"""
+模拟图片生成 provider 的公共组件
+供 AIImageGenerator 的 mock 类型和 benchmark 中的模拟 HTTP 服务共用
+"""
+import io
+import os
+import random
+import threading
+
+from PIL import Image
+
+
+class LatencyModel:
+    """延迟分布模型，sample() 返回秒数"""
+
+    DISTRIBUTIONS = ("fixed", "uniform", "lognormal", "exponential")
+
+    def __init__(self, distribution="lognormal", mean_ms=800.0, spread=0.5, max_ms=None):
+        """
+        Args:
+            distribution: 分布类型 (fixed / uniform / lognormal / exponential)
+            mean_ms: 中位数（lognormal）或均值（其他分布），单位毫秒
+            spread: uniform 为半宽比例，lognormal 为 sigma，其余分布忽略
+            max_ms: 延迟上限（可选），用于截断长尾
+        """
+        if distribution not in self.DISTRIBUTIONS:
+            raise ValueError(f"不支持的延迟分布: {distribution}")
+        self.distribution = distribution
+        self.mean_ms = float(mean_ms)
+        self.spread = float(spread)
+        self.max_ms = max_ms
+
+    @classmethod
+    def parse(cls, spec):
+        """从 "lognormal:800:0.5" 形式的字符串解析延迟模型"""
+        parts = spec.split(':')
+        distribution = parts[0]
+        mean_ms = float(parts[1]) if len(parts) > 1 else 800.0
+        spread = float(parts[2]) if len(parts) > 2 else 0.5
+        max_ms = float(parts[3]) if len(parts) > 3 else None
+        return cls(distribution, mean_ms, spread, max_ms)
+
+    def sample(self):
+        if self.distribution == "fixed":
+            value = self.mean_ms
+        elif self.distribution == "uniform":
+            half = self.mean_ms * self.spread
+            value = random.uniform(self.mean_ms - half, self.mean_ms + half)
+        elif self.distribution == "lognormal":
+            value = random.lognormvariate(0, self.spread) * self.mean_ms
+        else:
+            value = random.expovariate(1.0 / self.mean_ms) if self.mean_ms > 0 else 0.0
+        if self.max_ms is not None:
+            value = min(value, self.max_ms)
+        return max(value, 0.0) / 1000.0
+
+
+def parse_image_size(spec):
+    """解析 "1024x768" 形式的尺寸"""
+    width, height = (int(v) for v in spec.lower().split('x'))
+    return width, height
+
+
+def make_image_bytes(width, height, image_format="PNG"):
+    """生成随机噪点图片，噪点保证压缩后的体积接近真实生成图"""
+    image = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+# 预生成的图片池，避免每次调用都消耗 CPU 编码
+_image_pools = {}
+_image_pools_lock = threading.Lock()
+
+
+def pooled_image_bytes(width, height, image_format="PNG", pool_size=4):
+    """从预生成的图片池中随机取一张"""
+    key = (width, height, image_format.upper())
+    pool = _image_pools.get(key)
+    if pool is None:
+        with _image_pools_lock:
+            pool = _image_pools.get(key)
+            if pool is None:
+                pool = [make_image_bytes(width, height, image_format) for _ in range(max(1, pool_size))]
+                _image_pools[key] = pool
+    return random.choice(pool)
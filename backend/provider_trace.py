@@ -0,0 +1,162 @@
+"""
+模型调用流量记录（可选）
+
+设置 PROVIDER_TRACE_FILE 后，AIImageGenerator 和 AsyncAIImageGenerator 的每次外部调用都会以一行紧凑 JSON 追加到该文件：
+    {"t":1730000000.123,"cid":"3f2a9c1b","api":"doubao","model":"...","op":"generate",
+     "ms":8421.7,"status":200,"req":1843,"resp":512,"err":null}
+
+只记录时间、状态码、请求/响应字节数和错误类别，不包含 API Key、提示词或图片内容。
+记录文件可由 benchmark.replay 回放到本地模拟服务。
+"""
+import json
+import os
+import threading
+import time
+import uuid
+
+PROVIDER_TRACE_FILE = os.getenv('PROVIDER_TRACE_FILE', '')
+
+
+def classify_status(status):
+    """将 HTTP 状态码归类为错误类别，成功返回 None"""
+    if status is None or 200 <= status < 300:
+        return None
+    if status == 429:
+        return "http_429"
+    if 400 <= status < 500:
+        return "http_4xx"
+    return "http_5xx"
+
+
+def classify_exception(error):
+    """将异常归类为错误类别"""
+    name = type(error).__name__
+    if "Timeout" in name:
+        return "timeout"
+    # requests 为 ConnectionError，httpx 为 ConnectError / ReadError / RemoteProtocolError 等
+    if "Connect" in name or name in ("ReadError", "WriteError", "RemoteProtocolError"):
+        return "connection"
+    # google-genai 的 APIError 带有 HTTP 状态码
+    code = getattr(error, 'code', None)
+    if isinstance(code, int):
+        return classify_status(code) or "exception"
+    return "exception"
+
+
+class ProviderTraceRecorder:
+    """线程安全的 JSON Lines 追加写入器"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def record(self, entry):
+        line = json.dumps(entry, separators=(',', ':'), ensure_ascii=False) + "\n"
+        with self._lock:
+            # 每条记录单独一次追加写，多进程同时写入时不会交错
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+
+class TraceSpan:
+    """一次外部调用的记录，在 with 块结束时写入"""
+
+    def __init__(self, recorder, api_type, model, op, call_id):
+        self.recorder = recorder
+        self.entry = {
+            "t": round(time.time(), 3),
+            "cid": call_id,
+            "api": api_type,
+            "model": model,
+            "op": op,
+            "ms": None,
+            "status": None,
+            "req": 0,
+            "resp": 0,
+            "err": None,
+        }
+        self._started = time.perf_counter()
+
+    def _stop_clock(self):
+        if self.entry["ms"] is None:
+            self.entry["ms"] = round((time.perf_counter() - self._started) * 1000, 1)
+
+    def response(self, response, response_bytes=None):
+        """
+        记录 requests 或 httpx 的响应
+
+        流式读取的响应体不能再通过 response.content 获取，由调用方传入 response_bytes
+        """
+        self._stop_clock()
+        self.entry["status"] = response.status_code
+        # requests 的请求体在 request.body 上，httpx 在 request.content 上
+        body = None
+        if response.request is not None:
+            body = getattr(response.request, 'body', None) or getattr(response.request, 'content', None)
+        self.entry["req"] = len(body) if body else 0
+        self.entry["resp"] = response_bytes if response_bytes is not None else len(response.content or b"")
+        self.entry["err"] = classify_status(response.status_code)
+
+    def sdk_response(self, request_bytes=0, response_bytes=0):
+        """记录 SDK 调用的结果（SDK 不暴露状态码，成功视为 200）"""
+        self._stop_clock()
+        self.entry["status"] = 200
+        self.entry["req"] = request_bytes
+        self.entry["resp"] = response_bytes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop_clock()
+        if exc is not None:
+            self.entry["err"] = classify_exception(exc)
+        try:
+            self.recorder.record(self.entry)
+        except Exception:
+            # 记录失败不能影响生成流程
+            pass
+        return False
+
+
+class _NullSpan:
+    """未开启记录时使用的空实现"""
+
+    def response(self, response, response_bytes=None):
+        pass
+
+    def sdk_response(self, request_bytes=0, response_bytes=0):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+_recorder = ProviderTraceRecorder(PROVIDER_TRACE_FILE) if PROVIDER_TRACE_FILE else None
+
+
+def new_call_id():
+    """一次 generate_image 调用的标识，用于关联生成请求和随后的图片下载"""
+    return uuid.uuid4().hex[:12]
+
+
+def trace_call(api_type, model, op, call_id):
+    """
+    返回记录一次外部调用的上下文管理器
+
+    Args:
+        api_type: API类型
+        model: 模型名称
+        op: 调用类型 ("generate" 或 "download")
+        call_id: new_call_id() 生成的调用标识
+    """
+    if _recorder is None:
+        return _NULL_SPAN
+    return TraceSpan(_recorder, api_type, model, op, call_id)
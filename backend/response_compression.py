@@ -0,0 +1,134 @@
+"""
+JSON 响应压缩
+
+任务列表、任务结果等 JSON 响应中重复的字段名、URL 和 prompt 很多，压缩率很高。
+after_request 中按请求的 Accept-Encoding 协商 br（需安装 brotli）或 gzip，只压缩：
+- 状态码 200 且 Content-Type 为 application/json 的响应
+- 不小于 RESPONSE_COMPRESS_MIN_BYTES 的响应
+/static/ 下的图片、流式响应和已压缩的响应不处理。
+
+每种编码的压缩次数、压缩前后字节数和耗时记录在进程内，通过 /api/metrics 查看，
+用于调整压缩级别（gunicorn 每个 worker 分别统计）。
+"""
+import gzip
+import os
+import threading
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 按优先顺序启用的编码，客户端给出相同权重时使用靠前的编码
+RESPONSE_COMPRESSION = os.getenv('RESPONSE_COMPRESSION', 'br,gzip')
+RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv('RESPONSE_COMPRESS_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', 4))
+
+# 不压缩的路径前缀（图片本身已压缩）
+EXCLUDED_PREFIXES = ('/static/',)
+
+
+class ResponseCompressor:
+    """协商并压缩 JSON 响应，统计压缩耗时"""
+
+    def __init__(self, encodings=RESPONSE_COMPRESSION, min_bytes=RESPONSE_COMPRESS_MIN_BYTES,
+                 gzip_level=GZIP_LEVEL, brotli_quality=BROTLI_QUALITY):
+        """
+        Args:
+            encodings: 逗号分隔的编码（br / gzip），为空表示不压缩；未安装 brotli 时忽略 br
+        """
+        self.encodings = [
+            encoding.strip() for encoding in encodings.split(',')
+            if encoding.strip() == 'gzip' or (encoding.strip() == 'br' and brotli is not None)
+        ]
+        self.min_bytes = min_bytes
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def init_app(self, app):
+        app.after_request(self.compress_response)
+
+    def _negotiate(self, accept_encodings):
+        best, best_quality = None, 0
+        for encoding in self.encodings:
+            quality = accept_encodings[encoding]
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def _compress(self, encoding, data):
+        if encoding == 'br':
+            return brotli.compress(data, quality=self.brotli_quality)
+        return gzip.compress(data, compresslevel=self.gzip_level, mtime=0)
+
+    def compress_response(self, response):
+        from flask import request
+
+        if (not self.encodings
+                or response.status_code != 200
+                or response.direct_passthrough
+                or response.is_streamed
+                or response.mimetype != 'application/json'
+                or 'Content-Encoding' in response.headers
+                or request.path.startswith(EXCLUDED_PREFIXES)):
+            return response
+        response.vary.add('Accept-Encoding')
+        data = response.get_data()
+        if len(data) < self.min_bytes:
+            return response
+        encoding = self._negotiate(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        start = time.perf_counter()
+        compressed = self._compress(encoding, data)
+        elapsed = time.perf_counter() - start
+        self._record(encoding, len(data), len(compressed), elapsed)
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    def _record(self, encoding, original_bytes, compressed_bytes, seconds):
+        with self._lock:
+            stats = self._stats.setdefault(encoding, {
+                "responses": 0, "bytes_in": 0, "bytes_out": 0, "seconds": 0.0, "max_seconds": 0.0,
+            })
+            stats["responses"] += 1
+            stats["bytes_in"] += original_bytes
+            stats["bytes_out"] += compressed_bytes
+            stats["seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+    def stats(self):
+        """
+        Returns:
+            dict: 每种编码的压缩次数、字节数、压缩率和平均 / 最大耗时（毫秒）
+        """
+        with self._lock:
+            snapshot = {encoding: dict(stats) for encoding, stats in self._stats.items()}
+        result = {}
+        for encoding, stats in snapshot.items():
+            result[encoding] = {
+                "responses": stats["responses"],
+                "bytes_in": stats["bytes_in"],
+                "bytes_out": stats["bytes_out"],
+                "ratio": round(stats["bytes_out"] / stats["bytes_in"], 4) if stats["bytes_in"] else None,
+                "avg_ms": round(stats["seconds"] * 1000 / stats["responses"], 3),
+                "max_ms": round(stats["max_seconds"] * 1000, 3),
+            }
+        return {
+            "encodings": self.encodings,
+            "min_bytes": self.min_bytes,
+            "gzip_level": self.gzip_level,
+            "brotli_quality": self.brotli_quality,
+            "compressed": result,
+        }
+
+
+# 全局实例，按环境变量配置
+response_compressor = ResponseCompressor()
@@ -0,0 +1,380 @@
+"""
+生成结果的存储
+
+生成器、缩略图任务和下载接口都通过 result_storage 读写结果文件，不直接访问 RESULT_FOLDER：
+- local（默认）: 写入本地 RESULT_FOLDER 的分层子目录（见 file_layout），由 /static/results/<文件名> 直接返回
+- s3: 写入 S3 兼容的对象存储（AWS S3、MinIO 等），大文件使用分段上传边接收边上传；
+      /static/results/<文件名> 重定向到预签名 URL，配置了 S3_PUBLIC_BASE_URL 时直接返回公开地址
+结果 URL 由 result_storage.url() 生成，多个 web / worker 容器可以共享同一个存储。
+
+使用 s3 需安装 boto3。本地测试可使用 MinIO：
+    docker run -p 9000:9000 -e MINIO_ROOT_USER=minio -e MINIO_ROOT_PASSWORD=minio123 minio/minio server /data
+    RESULT_STORAGE=s3 S3_ENDPOINT_URL=http://localhost:9000 S3_BUCKET=results S3_ACCESS_KEY_ID=minio S3_SECRET_ACCESS_KEY=minio123
+"""
+import mimetypes
+import os
+import tempfile
+import threading
+import uuid
+
+import file_layout
+
+RESULT_STORAGE = os.getenv('RESULT_STORAGE', 'local')
+RESULT_FOLDER = os.getenv('RESULT_FOLDER', 'results')
+# 本地存储在文件改名前后 fsync，写入完成即落盘（条目记为完成后断电也不会丢图片）
+RESULT_FSYNC = os.getenv('RESULT_FSYNC', 'true').lower() == 'true'
+# 结果文件的访问路径，由 app 的 /static/results/<filename> 提供
+RESULT_URL_PREFIX = '/static/results'
+
+S3_BUCKET = os.getenv('S3_BUCKET', '')
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL') or None  # MinIO 等 S3 兼容服务的地址，AWS S3 留空
+S3_REGION = os.getenv('S3_REGION') or None
+S3_ACCESS_KEY_ID = os.getenv('S3_ACCESS_KEY_ID') or None
+S3_SECRET_ACCESS_KEY = os.getenv('S3_SECRET_ACCESS_KEY') or None
+S3_PREFIX = os.getenv('S3_PREFIX', 'results/')
+# 配置后结果 URL 直接指向该地址（公开读的桶或 CDN），不经过 app 重定向
+S3_PUBLIC_BASE_URL = os.getenv('S3_PUBLIC_BASE_URL', '').rstrip('/')
+# 预签名 URL 的有效期（秒），需大于 nginx 对 /static/ 的缓存时间（1h）
+S3_PRESIGN_EXPIRES = int(os.getenv('S3_PRESIGN_EXPIRES', 7200))
+# 分段上传的分段大小，S3 要求除最后一段外不小于 5MB
+S3_PART_SIZE = max(5 * 1024 * 1024, int(os.getenv('S3_PART_SIZE', 8 * 1024 * 1024)))
+# 对象存储的结果文件上传前在本地暂存的目录（见 ResultStorage.spool_path），本地存储直接暂存在结果所在目录
+RESULT_SPOOL_FOLDER = os.getenv('RESULT_SPOOL_FOLDER') or tempfile.gettempdir()
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def _check_name(name):
+    # 结果文件名由生成器生成，只允许单层文件名
+    if not name or name != os.path.basename(name) or name.startswith('.'):
+        raise ValueError(f"无效的结果文件名: {name}")
+    return name
+
+
+def content_type_for(name):
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _remove_temp(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def name_from_url(url):
+    """从结果 URL 中取出文件名"""
+    return url.split('?', 1)[0].rsplit('/', 1)[-1]
+
+
+class ResultWriter:
+    """
+    逐块写入一个结果文件，commit 后文件才可见，abort 丢弃已写入的数据
+
+    用作上下文管理器时正常退出自动 commit，异常时 abort。
+    """
+
+    def write(self, data):
+        raise NotImplementedError
+
+    def commit(self):
+        raise NotImplementedError
+
+    def abort(self):
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+        return False
+
+
+class ResultStorage:
+    """结果存储接口"""
+
+    def open_writer(self, name, content_type=None):
+        """
+        Returns:
+            ResultWriter: 写入 name 的 writer
+        """
+        raise NotImplementedError
+
+    def put(self, name, data, content_type=None):
+        """
+        写入完整的结果文件
+
+        Returns:
+            str: 结果 URL
+        """
+        with self.open_writer(name, content_type) as writer:
+            writer.write(data)
+        return self.url(name)
+
+    def spool_path(self, name):
+        """
+        暂存结果文件的本地临时路径：先在这里写完，再由 put_file 写入存储（如后台 I/O 线程中）
+        """
+        return os.path.join(RESULT_SPOOL_FOLDER, f".{uuid.uuid4().hex}.part")
+
+    def put_file(self, name, path, content_type=None):
+        """
+        写入暂存在本地文件 path 中的结果文件，逐块读取，完成后（包括失败时）删除 path
+
+        Returns:
+            str: 结果 URL
+        """
+        try:
+            with open(path, 'rb') as f, self.open_writer(name, content_type) as writer:
+                while True:
+                    chunk = f.read(READ_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    writer.write(chunk)
+        finally:
+            _remove_temp(path)
+        return self.url(name)
+
+    def get(self, name):
+        """读取整个结果文件（bytes）"""
+        return b''.join(self.stream(name))
+
+    def stream(self, name, chunk_size=READ_CHUNK_SIZE):
+        """逐块读取结果文件"""
+        raise NotImplementedError
+
+    def url(self, name):
+        """写入结果中的访问 URL"""
+        return f"{RESULT_URL_PREFIX}/{_check_name(name)}"
+
+    def presign(self, name, expires=None):
+        """
+        Returns:
+            str | None: 可直接下载的临时 URL；None 表示由 app 直接返回文件
+        """
+        return None
+
+    def delete(self, name):
+        raise NotImplementedError
+
+
+class _LocalWriter(ResultWriter):
+    """先写入同目录的临时文件，commit 时改名，读取方不会看到写了一半的文件"""
+
+    def __init__(self, path):
+        self.path = path
+        self.temp_path = os.path.join(os.path.dirname(path), f".{uuid.uuid4().hex}.part")
+        self._file = open(self.temp_path, 'wb')
+
+    def write(self, data):
+        self._file.write(data)
+
+    def commit(self):
+        if RESULT_FSYNC:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.temp_path, self.path)
+        if RESULT_FSYNC:
+            # 目录项也需要落盘，否则改名可能在断电后丢失
+            _fsync_path(os.path.dirname(self.path))
+
+    def abort(self):
+        self._file.close()
+        _remove_temp(self.temp_path)
+
+
+class LocalResultStorage(ResultStorage):
+    """本地目录"""
+
+    def __init__(self, folder=RESULT_FOLDER):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, name):
+        """已有文件的路径（兼容迁移前的平铺目录）"""
+        return file_layout.resolve_path(self.folder, _check_name(name))
+
+    def open_writer(self, name, content_type=None):
+        return _LocalWriter(file_layout.sharded_path(self.folder, _check_name(name)))
+
+    def spool_path(self, name):
+        # 与结果文件在同一目录，put_file 只需改名
+        path = file_layout.sharded_path(self.folder, _check_name(name))
+        return os.path.join(os.path.dirname(path), f".{uuid.uuid4().hex}.part")
+
+    def put_file(self, name, path, content_type=None):
+        target = file_layout.sharded_path(self.folder, _check_name(name))
+        try:
+            if RESULT_FSYNC:
+                _fsync_path(path)
+            os.replace(path, target)
+        except Exception:
+            _remove_temp(path)
+            raise
+        if RESULT_FSYNC:
+            _fsync_path(os.path.dirname(target))
+        return self.url(name)
+
+    def stream(self, name, chunk_size=READ_CHUNK_SIZE):
+        with file_layout.open_file(self.folder, _check_name(name)) as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def get(self, name):
+        with file_layout.open_file(self.folder, _check_name(name)) as f:
+            return f.read()
+
+    def delete(self, name):
+        file_layout.remove_file(self.folder, _check_name(name))
+
+
+class _S3MultipartWriter(ResultWriter):
+    """
+    缓存不超过一个分段的数据，满一段即上传
+
+    总大小不足一个分段时在 commit 中用一次 PutObject 上传，否则使用分段上传，内存占用不超过 S3_PART_SIZE。
+    """
+
+    def __init__(self, client, bucket, key, content_type, part_size):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.part_size = part_size
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = []
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+
+    def _upload_part(self, data):
+        if self._upload_id is None:
+            upload = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key, ContentType=self.content_type)
+            self._upload_id = upload['UploadId']
+        part_number = len(self._parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id, PartNumber=part_number, Body=data
+        )
+        self._parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+
+    def commit(self):
+        if self._upload_id is None:
+            self.client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer), ContentType=self.content_type)
+        else:
+            if self._buffer:
+                self._upload_part(bytes(self._buffer))
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self._upload_id, MultipartUpload={'Parts': self._parts}
+            )
+        self._buffer = bytearray()
+
+    def abort(self):
+        self._buffer = bytearray()
+        if self._upload_id is not None:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+            self._upload_id = None
+
+
+class S3ResultStorage(ResultStorage):
+    """S3 兼容的对象存储（需安装 boto3）"""
+
+    def __init__(self, bucket=S3_BUCKET, endpoint_url=S3_ENDPOINT_URL, region=S3_REGION,
+                 access_key_id=S3_ACCESS_KEY_ID, secret_access_key=S3_SECRET_ACCESS_KEY, prefix=S3_PREFIX,
+                 public_base_url=S3_PUBLIC_BASE_URL, presign_expires=S3_PRESIGN_EXPIRES, part_size=S3_PART_SIZE):
+        if not bucket:
+            raise ValueError("RESULT_STORAGE=s3 时必须配置 S3_BUCKET")
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.access_key_id = access_key_id
+        self.secret_access_key = secret_access_key
+        self.prefix = prefix
+        self.public_base_url = public_base_url
+        self.presign_expires = presign_expires
+        self.part_size = part_size
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        # boto3 导入较慢，第一次读写时再创建客户端（客户端可在线程间共享）
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import boto3
+                    self._client = boto3.client(
+                        's3',
+                        endpoint_url=self.endpoint_url,
+                        region_name=self.region,
+                        aws_access_key_id=self.access_key_id,
+                        aws_secret_access_key=self.secret_access_key,
+                    )
+        return self._client
+
+    def key(self, name):
+        return f"{self.prefix}{_check_name(name)}"
+
+    def open_writer(self, name, content_type=None):
+        return _S3MultipartWriter(self.client, self.bucket, self.key(name),
+                                  content_type or content_type_for(name), self.part_size)
+
+    def stream(self, name, chunk_size=READ_CHUNK_SIZE):
+        body = self.client.get_object(Bucket=self.bucket, Key=self.key(name))['Body']
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
+    def get(self, name):
+        body = self.client.get_object(Bucket=self.bucket, Key=self.key(name))['Body']
+        try:
+            return body.read()
+        finally:
+            body.close()
+
+    def url(self, name):
+        if self.public_base_url:
+            return f"{self.public_base_url}/{self.key(name)}"
+        return super().url(name)
+
+    def presign(self, name, expires=None):
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': self.key(name)},
+            ExpiresIn=expires or self.presign_expires,
+        )
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+
+
+def create_result_storage(kind=RESULT_STORAGE):
+    if kind == 'local':
+        return LocalResultStorage()
+    if kind == 's3':
+        return S3ResultStorage()
+    raise ValueError(f"不支持的结果存储: {kind}")
+
+
+# 全局实例，按环境变量配置
+result_storage = create_result_storage()
@@ -0,0 +1,273 @@
+"""
+生成结果的后台写入（write-behind）
+
+生成线程数（GENERATION_WORKERS）就是同时进行的模型调用数，原先生成线程拿到图片后还要同步写盘 / 上传，
+写入期间这个调用名额一直被占用。批量任务改为把图片交给有界的 I/O 线程池后立即返回，生成线程去处理下一张图片：
+- 图片写入完成（本地存储会 fsync，见 RESULT_FSYNC）后才把条目记为完成，任务结果中不会出现打不开的 URL
+- 排队和写入中的图片超过 RESULT_IO_MAX_PENDING 张时 submit 阻塞，生成线程随之放慢（反压），内存占用有上限
+- 排队、写入和反压等待的耗时分布记录在进程内，通过 /api/metrics 查看
+
+RESULT_WRITE_BEHIND=false 时在生成线程中同步写入，行为与原先相同。
+"""
+import bisect
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from result_storage import result_storage
+
+logger = logging.getLogger(__name__)
+
+RESULT_WRITE_BEHIND = os.getenv('RESULT_WRITE_BEHIND', 'true').lower() == 'true'
+RESULT_IO_WORKERS = int(os.getenv('RESULT_IO_WORKERS', 4))
+# 排队和写入中的图片数上限，达到上限时 submit 阻塞（每张图片在内存中保留到写入完成）
+RESULT_IO_MAX_PENDING = int(os.getenv('RESULT_IO_MAX_PENDING', 32))
+
+# 延迟直方图各个桶的上界（毫秒）
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+# 生成结果中待完成的写入（Future），记录结果前由 wait_persisted / when_persisted 取出
+PENDING_WRITE_KEY = '_pending_write'
+
+
+class LatencyHistogram:
+    """固定分桶的延迟直方图，调用方负责加锁"""
+
+    def __init__(self, bounds_ms=LATENCY_BUCKETS_MS):
+        self.bounds_ms = bounds_ms
+        self.counts = [0] * (len(bounds_ms) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, seconds):
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(self.bounds_ms, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def quantile(self, q):
+        """分位数的估计值：所在桶的上界（最后一个桶用最大值）"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                if index < len(self.bounds_ms):
+                    return min(self.bounds_ms[index], round(self.max_ms, 3))
+                break
+        return round(self.max_ms, 3)
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: 次数、平均 / 最大耗时、p50 / p95 / p99 和各桶计数（键为桶上界毫秒数，不累计）
+        """
+        buckets = {str(bound): count for bound, count in zip(self.bounds_ms, self.counts)}
+        buckets['+Inf'] = self.counts[-1]
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else None,
+            "max_ms": round(self.max_ms, 3),
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "buckets": buckets,
+        }
+
+
+class ResultWriterPool:
+    """把生成的图片交给 I/O 线程写入 result_storage"""
+
+    def __init__(self, storage=result_storage, workers=RESULT_IO_WORKERS, max_pending=RESULT_IO_MAX_PENDING,
+                 enabled=RESULT_WRITE_BEHIND):
+        """
+        Args:
+            enabled: 为 False 时 submit 在调用线程中同步写入
+        """
+        self.storage = storage
+        self.workers = max(1, workers)
+        self.max_pending = max(self.workers, max_pending)
+        self.enabled = enabled
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+        self._failed = 0
+        self._backpressure = LatencyHistogram()
+        self._queue = LatencyHistogram()
+        self._write = LatencyHistogram()
+
+    def _get_executor(self):
+        # 第一次写入时创建线程，gunicorn 在 fork 之后才会用到
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='result-io')
+            return self._executor
+
+    def submit(self, name, data, content_type=None):
+        """
+        提交一个结果文件，排队和写入中的文件达到 max_pending 时阻塞
+
+        Returns:
+            Future: 写入完成后的结果 URL；写入失败时为异常
+        """
+        return self._submit(name, lambda: self.storage.put(name, data, content_type))
+
+    def submit_file(self, name, path, content_type=None):
+        """
+        提交一个暂存在本地文件中的结果文件（见 ResultStorage.spool_path），图片不需要保留在内存中
+
+        path 交给 I/O 线程，由 storage.put_file 移入存储或上传后删除。
+
+        Returns:
+            Future: 同 submit
+        """
+        return self._submit(name, lambda: self.storage.put_file(name, path, content_type))
+
+    def _submit(self, name, write):
+        if not self.enabled:
+            future = Future()
+            start = time.perf_counter()
+            try:
+                future.set_result(write())
+            except Exception as e:
+                future.set_exception(e)
+            self._finish(0.0, time.perf_counter() - start, future.exception() is not None, pending=False)
+            return future
+
+        if not self._slots.acquire(blocking=False):
+            # I/O 线程跟不上生成速度，生成线程在这里等待
+            start = time.perf_counter()
+            self._slots.acquire()
+            with self._lock:
+                self._backpressure.record(time.perf_counter() - start)
+        with self._lock:
+            self._pending += 1
+        future = Future()
+        try:
+            self._get_executor().submit(self._run, future, name, write, time.perf_counter())
+        except Exception:
+            self._release()
+            raise
+        return future
+
+    def _run(self, future, name, write, submitted_at):
+        # Future 由这里设置结果：done callback（记录条目，见 when_persisted）在本线程中同步执行完后才释放名额，
+        # flush 返回时结果都已记录
+        start = time.perf_counter()
+        url, error = None, None
+        try:
+            url = write()
+        except Exception as e:
+            logger.exception("写入生成结果 %s 失败", name)
+            error = e
+        elapsed = time.perf_counter() - start
+        try:
+            if error is None:
+                future.set_result(url)
+            else:
+                future.set_exception(error)
+        finally:
+            self._finish(start - submitted_at, elapsed, error is not None)
+
+    def _finish(self, queued, elapsed, failed, pending=True):
+        with self._lock:
+            self._queue.record(queued)
+            self._write.record(elapsed)
+            if failed:
+                self._failed += 1
+        if pending:
+            self._release()
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+            if not self._pending:
+                self._idle.notify_all()
+        self._slots.release()
+
+    def flush(self, timeout=None):
+        """
+        等待已提交的文件全部写入，且写入完成时注册的 callback 已执行完（进程退出前调用）
+
+        Returns:
+            bool: 超时前是否全部写入
+        """
+        with self._lock:
+            return self._idle.wait_for(lambda: not self._pending, timeout)
+
+    def stats(self):
+        """
+        Returns:
+            dict: 当前排队 / 写入中的文件数、失败次数，以及排队、写入和反压等待的耗时分布
+        """
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "failed": self._failed,
+                "queue": self._queue.snapshot(),
+                "write": self._write.snapshot(),
+                "backpressure": self._backpressure.snapshot(),
+            }
+
+
+def _apply_write(result, future):
+    """写入失败时把生成结果改为失败"""
+    try:
+        future.result()
+    except Exception as e:
+        result.pop('generated_image_url', None)
+        result['success'] = False
+        result['error'] = f"保存生成的图片失败: {e}"
+    return result
+
+
+def wait_persisted(result):
+    """
+    等待生成结果的后台写入完成
+
+    Returns:
+        dict: result 本身，写入失败时已改为失败结果
+    """
+    future = result.pop(PENDING_WRITE_KEY, None)
+    if future is None:
+        return result
+    return _apply_write(result, future)
+
+
+def when_persisted(result, callback):
+    """
+    生成结果写入完成后调用 callback(result)，不阻塞当前线程
+
+    callback 在 I/O 线程中执行（通常是把条目写入任务管理器）。
+
+    Returns:
+        dict | Future: 没有待完成的写入时直接返回 callback 的返回值，否则返回其 Future
+    """
+    future = result.pop(PENDING_WRITE_KEY, None)
+    if future is None:
+        return callback(result)
+    done = Future()
+
+    def on_written(write_future):
+        try:
+            done.set_result(callback(_apply_write(result, write_future)))
+        except Exception as e:
+            done.set_exception(e)
+
+    future.add_done_callback(on_written)
+    return done
+
+
+# 全局实例，按环境变量配置
+result_writer = ResultWriterPool()
@@ -0,0 +1,222 @@
+"""
+生成任务公平调度器
+
+位于任务提交和生成线程之间：
+- 每个 session 一个队列，同一优先级内按赤字轮询（Deficit Round Robin）服务，
+  单个 session 提交再多的批量任务也只能轮流占用生成线程
+- 优先级之间严格优先：单图 /api/generate 请求（INTERACTIVE）总是先于批量任务（BATCH）被取出
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from enum import IntEnum
+
+# 同时进行的模型调用数（生成线程数）
+GENERATION_WORKERS = int(os.getenv('GENERATION_WORKERS', 4))
+# 每轮给每个 session 补充的额度，任务的 cost 默认为 1（一次模型调用）
+SCHEDULER_QUANTUM = int(os.getenv('SCHEDULER_QUANTUM', 1))
+
+
+class SchedulerShutdown(RuntimeError):
+    """调度器停止时，尚未开始执行的任务以此异常结束"""
+
+
+class JobPriority(IntEnum):
+    INTERACTIVE = 0
+    BATCH = 1
+
+
+class _Job:
+    __slots__ = ("session_id", "priority", "cost", "fn", "args", "kwargs", "future", "enqueued_at")
+
+    def __init__(self, session_id, priority, cost, fn, args, kwargs):
+        self.session_id = session_id
+        self.priority = priority
+        self.cost = cost
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.enqueued_at = time.time()
+
+
+class _PriorityClass:
+    """同一优先级内的 DRR 状态"""
+
+    def __init__(self):
+        self.queues = {}       # session_id -> deque[_Job]
+        self.deficit = {}      # session_id -> 剩余额度
+        self.active = deque()  # 有排队任务的 session，队首为当前服务对象
+
+
+class FairScheduler:
+    """按 session 公平调度的线程池"""
+
+    def __init__(self, max_workers=GENERATION_WORKERS, quantum=SCHEDULER_QUANTUM):
+        self.max_workers = max(1, max_workers)
+        self.quantum = max(1, quantum)
+        self._classes = {priority: _PriorityClass() for priority in JobPriority}
+        self._running = {}  # session_id -> 正在执行的任务数
+        self._condition = threading.Condition()
+        self._workers = []
+        self._shutdown = False
+
+    def submit(self, session_id, fn, *args, priority=JobPriority.BATCH, cost=1, **kwargs):
+        """
+        提交一个生成任务
+
+        Args:
+            session_id: 提交者标识，公平性按此区分
+            fn: 在生成线程中执行的函数
+            priority: JobPriority，数值越小越优先
+            cost: 任务消耗的额度，通常为该任务包含的模型调用次数
+
+        Returns:
+            Future: fn 的执行结果
+        """
+        job = _Job(session_id, JobPriority(priority), max(1, cost), fn, args, kwargs)
+        with self._condition:
+            if self._shutdown:
+                raise SchedulerShutdown("服务正在重启，请稍后重试")
+            cls = self._classes[job.priority]
+            queue = cls.queues.get(session_id)
+            if queue is None:
+                queue = cls.queues[session_id] = deque()
+                cls.deficit[session_id] = self.quantum
+                cls.active.append(session_id)
+            queue.append(job)
+            self._ensure_workers_locked()
+            self._condition.notify()
+        return job.future
+
+    def _ensure_workers_locked(self):
+        # 线程按需创建，避免在 gunicorn preload 的主进程中 fork 前就启动线程
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(target=self._worker_loop, name=f"generation-worker-{len(self._workers)}", daemon=True)
+            self._workers.append(worker)
+            worker.start()
+
+    def _next_job_locked(self):
+        for priority in JobPriority:
+            cls = self._classes[priority]
+            while cls.active:
+                session_id = cls.active[0]
+                queue = cls.queues[session_id]
+                job = queue[0]
+                if cls.deficit[session_id] >= job.cost:
+                    queue.popleft()
+                    cls.deficit[session_id] -= job.cost
+                    if not queue:
+                        # 队列清空的 session 退出轮询，不保留剩余额度
+                        cls.active.popleft()
+                        del cls.queues[session_id]
+                        del cls.deficit[session_id]
+                    return job
+                # 额度不足，补充额度后轮到下一个 session
+                cls.deficit[session_id] += self.quantum
+                cls.active.rotate(-1)
+        return None
+
+    def _worker_loop(self):
+        while True:
+            with self._condition:
+                job = self._next_job_locked()
+                while job is None:
+                    if self._shutdown:
+                        return
+                    self._condition.wait()
+                    job = self._next_job_locked()
+                self._running[job.session_id] = self._running.get(job.session_id, 0) + 1
+            try:
+                if job.future.set_running_or_notify_cancel():
+                    try:
+                        job.future.set_result(job.fn(*job.args, **job.kwargs))
+                    except BaseException as e:
+                        job.future.set_exception(e)
+            finally:
+                with self._condition:
+                    remaining = self._running.get(job.session_id, 1) - 1
+                    if remaining > 0:
+                        self._running[job.session_id] = remaining
+                    else:
+                        self._running.pop(job.session_id, None)
+                    if self._shutdown:
+                        self._condition.notify_all()
+
+    def shutdown(self, timeout=None, wait=True):
+        """
+        停止调度器（优雅退出）
+
+        不再接收新任务；排队中尚未开始的任务以 SchedulerShutdown 结束，
+        调用方据此把对应图片记为失败，用户可重新提交；正在执行的模型调用继续完成。
+
+        Args:
+            timeout: 等待正在执行的任务完成的最长秒数，None 表示一直等待
+            wait: 为 False 时只取消排队任务，不等待正在执行的任务（可在信号处理函数中调用）
+
+        Returns:
+            bool: 超时前所有正在执行的任务是否都已完成
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            self._shutdown = True
+            pending = []
+            for cls in self._classes.values():
+                for queue in cls.queues.values():
+                    pending.extend(queue)
+                cls.queues.clear()
+                cls.deficit.clear()
+                cls.active.clear()
+            self._condition.notify_all()
+
+        for job in pending:
+            if job.future.set_running_or_notify_cancel():
+                job.future.set_exception(SchedulerShutdown("服务正在重启，任务未执行，请重新提交"))
+
+        if not wait:
+            with self._condition:
+                return not self._running
+        with self._condition:
+            while self._running:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def is_shutdown(self):
+        return self._shutdown
+
+    def queue_depths(self, session_id):
+        """返回某个 session 各优先级的排队数和正在执行数"""
+        with self._condition:
+            depths = {
+                priority.name.lower(): len(self._classes[priority].queues.get(session_id, ()))
+                for priority in JobPriority
+            }
+            depths["running"] = self._running.get(session_id, 0)
+        return depths
+
+    def stats(self):
+        """返回调度器整体状态（不包含其他 session 的标识）"""
+        with self._condition:
+            queued = {
+                priority.name.lower(): sum(len(q) for q in self._classes[priority].queues.values())
+                for priority in JobPriority
+            }
+            sessions = {
+                priority.name.lower(): len(self._classes[priority].queues)
+                for priority in JobPriority
+            }
+            return {
+                "workers": self.max_workers,
+                "running": sum(self._running.values()),
+                "queued": queued,
+                "queued_sessions": sessions,
+            }
+
+
+# 全局调度器实例
+generation_scheduler = FairScheduler()
@@ -1,15 +1,43 @@
 from enum import Enum
 from datetime import datetime
 import uuid
-import json
 import redis
 import os
+import threading
+import time
+import logging
+
+from task_serializer import task_serializer
 
 # Redis连接
 redis_host = os.getenv('REDIS_HOST', 'localhost')
 redis_port = int(os.getenv('REDIS_PORT', 6379))
 redis_password = os.getenv('REDIS_PASSWORD', None)
 redis_client = redis.Redis(host=redis_host, port=redis_port, password=redis_password, db=0, decode_responses=True)
+# 任务数据经 task_serializer 编码后是二进制，读写任务使用不解码响应的连接
+task_redis_client = redis.Redis(host=redis_host, port=redis_port, password=redis_password, db=0, decode_responses=False)
+
+# 任务数据过期时间（秒），每次写入时续期
+TASK_TTL = 3600
+# 图片数不超过该值的任务在详情和列表中直接附带所有图片条目，更大的任务需通过分页接口获取
+TASK_INLINE_ITEMS = int(os.getenv('TASK_INLINE_ITEMS', 200))
+# 批量读写图片条目时每次 HMGET / HSET 的字段数
+ITEM_READ_CHUNK = 500
+ITEM_WRITE_CHUNK = 500
+# 任务摘要中保留的结果预览（缩略图）数量
+TASK_PREVIEW_SIZE = int(os.getenv('TASK_PREVIEW_SIZE', 4))
+# 进度更新（非终态）在进程内合并，每个任务最多每隔该时间写入一次 Redis（毫秒），0 表示每次直接写入
+PROGRESS_FLUSH_INTERVAL_MS = int(os.getenv('PROGRESS_FLUSH_INTERVAL_MS', 500))
+
+# 摘要视图（view=summary）返回的字段，大小与任务的图片数无关
+SUMMARY_FIELDS = ("task_id", "status", "created_at", "updated_at", "total_images", "processed_images",
+                  "failed_images", "progress", "api_type", "preview")
+# 需要读取图片条目才能返回的字段
+ITEM_FIELDS = ("images", "items", "results")
+# 变化记录中标记记录起点版本号的成员
+CHANGES_FLOOR = "floor"
+
+logger = logging.getLogger(__name__)
 
 class TaskStatus(Enum):
     PENDING = "pending"
@@ -18,18 +46,175 @@ class TaskStatus(Enum):
     FAILED = "failed"
     CANCELLED = "cancelled"
 
+def _generated_image_entry(item):
+    """图片条目对应的 results.generated_images 项（失败的图片也包含在内，便于前端统一合并渲染）"""
+    entry = {
+        "filename": item["filename"],
+        "generated_url": item.get("result_url"),
+        "generated_filename": item.get("generated_filename"),
+        "prompt": item.get("prompt"),
+        "index": item["index"]
+    }
+    if item["status"] == TaskStatus.FAILED.value:
+        entry["error"] = item.get("error")
+    if item.get("thumbnail_url"):
+        entry["thumbnail_url"] = item["thumbnail_url"]
+    return entry
+
+def _preview_entry(item):
+    return {"index": item["index"], "url": item.get("thumbnail_url") or item.get("result_url")}
+
+def _project(task_data, fields):
+    """只保留指定的顶层字段（task_id 总是保留）"""
+    return {key: value for key, value in task_data.items() if key == "task_id" or key in fields}
+
 class BatchTaskManager:
-    """多用户隔离的批量任务管理器，通过 session_id 区分每个用户的任务"""
-    def __init__(self):
-        self.redis_client = redis_client
+    """
+    多用户隔离的批量任务管理器，通过 session_id 区分每个用户的任务
+
+    任务概要（状态、计数、进度）保存在 batch_task:{session_id}:{task_id}，
+    每张图片的状态和结果保存在 Hash batch_task_items:{session_id}:{task_id}（字段为图片序号），
+    写入单张图片的结果不需要读写整个任务，任务大小不影响每次更新的开销。
+
+    生成每张图片前的进度更新只缓存在进程内，由后台线程每 PROGRESS_FLUSH_INTERVAL_MS 合并写入一次；
+    图片结果和状态变化总是直接写入，并顺带写入该任务尚未写入的进度。
+
+    每次写入任务都会递增该任务和该 session 的版本号（batch_task_version:{session_id}:{task_id}、
+    batch_session_version:{session_id}），查询接口据此生成 ETag，数据未变化时只需读取版本号。
+
+    图片条目的变化记录在 Sorted Set batch_task_changes:{session_id}:{task_id} 中（成员为图片序号，分数为最后一次
+    变化时的任务版本号），get_changes 只返回某个版本之后变化的条目。每张图片只占一个成员，记录大小不超过图片数。
+
+    概要中的 preview 为序号最小的 TASK_PREVIEW_SIZE 张成功结果（缩略图），写入结果时同步维护，
+    任务列表只需读取概要（get_task_summaries），不读取图片条目。
+    """
+    def __init__(self, serializer=task_serializer):
+        self.redis_client = task_redis_client
+        self.serializer = serializer
         self.task_prefix = "batch_task:"
+        self.items_prefix = "batch_task_items:"
+        self.version_prefix = "batch_task_version:"
+        self.session_version_prefix = "batch_session_version:"
+        self.changes_prefix = "batch_task_changes:"
+        self.credentials_prefix = "batch_task_credentials:"
+        # 读-改-写由 _update_task 的 WATCH 事务保证跨进程安全；同一进程内的生成线程先按任务加锁（分段锁，数量固定），
+        # 减少事务冲突重试
+        self._locks = [threading.RLock() for _ in range(64)]
+        self.progress_flush_interval = PROGRESS_FLUSH_INTERVAL_MS / 1000
+        self._pending_progress = {}  # (session_id, task_id) -> (progress, current_image)
+        self._progress_lock = threading.Lock()
+        self._flusher = None
 
     def _make_task_key(self, session_id, task_id):
         return f"{self.task_prefix}{session_id}:{task_id}"
+    def _make_items_key(self, session_id, task_id):
+        return f"{self.items_prefix}{session_id}:{task_id}"
+    def _make_version_key(self, session_id, task_id):
+        return f"{self.version_prefix}{session_id}:{task_id}"
+    def _make_session_version_key(self, session_id):
+        return f"{self.session_version_prefix}{session_id}"
+    def _make_changes_key(self, session_id, task_id):
+        return f"{self.changes_prefix}{session_id}:{task_id}"
+    def _make_credentials_key(self, session_id, task_id):
+        return f"{self.credentials_prefix}{session_id}:{task_id}"
     def _make_all_tasks_key(self, session_id):
         return f"{self.task_prefix}{session_id}:*"
+    def _task_lock(self, session_id, task_id):
+        return self._locks[hash((session_id, task_id)) % len(self._locks)]
+
+    def _bump_versions(self, pipe, session_id, task_id):
+        # 版本号与任务数据一起续期；session 的版本号在该 session 最后写入的任务过期前一直保留
+        for key in (self._make_version_key(session_id, task_id), self._make_session_version_key(session_id)):
+            pipe.incr(key)
+            pipe.expire(key, TASK_TTL)
+
+    def _update_task(self, session_id, task_id, update):
+        """
+        读-改-写任务概要和图片条目
+
+        BATCH_BACKEND=celery 时写入来自多个进程（bookkeeping worker 写入结果、Web 进程取消任务），进程内的锁无法互斥：
+        WATCH 概要和版本号后读取，update 修改后在同一个事务中写回概要、图片条目、变化记录并递增版本号，
+        期间被其他写入修改时重新读取并重试，取消不会被覆盖，计数也不会丢失。
+        图片条目的每次写入都会递增版本号，WATCH 版本号同时保证了 update 读到的图片条目未被修改；
+        读到版本号 N 时，版本号不超过 N 的变化都已可见。
+
+        尚未写入的进度（见 update_task_progress）在 update 之前一并写入。
+
+        Args:
+            update: update(task_data, pipe) 修改 task_data，返回要写入的图片条目 {序号: 编码后的条目}（可为空）；
+                    调用时 pipe 处于 WATCH 状态，可直接读取图片条目。重试时会再次调用，不能有其他副作用
+
+        Returns:
+            dict: 写入后的任务概要，任务不存在时返回 None
+        """
+        task_key = self._make_task_key(session_id, task_id)
+        items_key = self._make_items_key(session_id, task_id)
+        version_key = self._make_version_key(session_id, task_id)
+        changes_key = self._make_changes_key(session_id, task_id)
+        session_version_key = self._make_session_version_key(session_id)
+        with self._progress_lock:
+            pending = self._pending_progress.pop((session_id, task_id), None)
+        with self.redis_client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(task_key, version_key)
+                    raw_task = pipe.get(task_key)
+                    if not raw_task:
+                        return None
+                    task_data = self.serializer.loads(raw_task)
+                    if pending:
+                        self._apply_progress(task_data, *pending)
+                    updates = update(task_data, pipe) or {}
+                    version = int(pipe.get(version_key) or 0) + 1
+                    pipe.multi()
+                    # 概要和图片条目使用相同的过期时间，每次写入同时续期
+                    pipe.setex(task_key, TASK_TTL, self.serializer.dumps(task_data))
+                    fields = list(updates)
+                    for offset in range(0, len(fields), ITEM_WRITE_CHUNK):
+                        chunk = fields[offset:offset + ITEM_WRITE_CHUNK]
+                        pipe.hset(items_key, mapping={index: updates[index] for index in chunk})
+                        pipe.zadd(changes_key, {index: version for index in chunk})
+                    if updates:
+                        # 记录开始之前的变化无从得知，floor 为记录起点的版本号（已有的 floor 不覆盖）
+                        pipe.zadd(changes_key, {CHANGES_FLOOR: version - 1}, nx=True)
+                    pipe.expire(items_key, TASK_TTL)
+                    pipe.expire(changes_key, TASK_TTL)
+                    pipe.set(version_key, version, ex=TASK_TTL)
+                    pipe.incr(session_version_key)
+                    pipe.expire(session_version_key, TASK_TTL)
+                    pipe.execute()
+                    return task_data
+                except redis.WatchError:
+                    continue
+
+    def _read_version(self, key):
+        value = self.redis_client.get(key)
+        return int(value) if value else None
+
+    def get_task_version(self, session_id, task_id):
+        """任务的版本号，每次写入该任务时递增；没有记录时返回 None"""
+        return self._read_version(self._make_version_key(session_id, task_id))
+
+    def get_session_version(self, session_id):
+        """session 的版本号，写入该 session 的任意任务时递增；没有记录时返回 None"""
+        return self._read_version(self._make_session_version_key(session_id))
+
+    def _get_summary(self, session_id, task_id):
+        task_data = self.redis_client.get(self._make_task_key(session_id, task_id))
+        if task_data:
+            return self.serializer.loads(task_data)
+        return None
 
     def create_task(self, session_id, images_data, prompt, api_type="gemini"):
+        """
+        创建任务
+
+        Args:
+            images_data: 每张图片的信息列表，包含 filename，多prompt任务还包含该图片的 prompt
+
+        Returns:
+            tuple: (task_id, 任务详情)
+        """
         task_id = str(uuid.uuid4())
         task_data = {
             "task_id": task_id,
@@ -43,135 +228,399 @@ class BatchTaskManager:
             "progress": 0.0,
             "prompt": prompt,
             "api_type": api_type,
-            "images": [],
             "results": {
                 "success_count": 0,
-                "failed_count": 0,
-                "generated_images": []
-            }
+                "failed_count": 0
+            },
+            "preview": []
         }
-        for image_data in images_data:
-            image_info = {
-                "file_id": str(uuid.uuid4()),
+        items_key = self._make_items_key(session_id, task_id)
+        pipe = self.redis_client.pipeline(transaction=False)
+        batch = {}
+        for index, image_data in enumerate(images_data):
+            item = {
+                "index": index,
                 "filename": image_data.get('filename', ''),
                 "status": TaskStatus.PENDING.value,
-                "result_url": None,
-                "error": None
             }
-            task_data["images"].append(image_info)
-        self.redis_client.setex(
-            self._make_task_key(session_id, task_id),
-            3600,  # 1小时过期
-            json.dumps(task_data)
-        )
-        return task_id, task_data
-
-    def get_task(self, session_id, task_id):
-        task_data = self.redis_client.get(self._make_task_key(session_id, task_id))
-        if task_data:
-            return json.loads(task_data)
-        return None
+            if image_data.get('prompt') is not None:
+                item["prompt"] = image_data['prompt']
+            batch[index] = self.serializer.dumps(item)
+            if len(batch) >= ITEM_WRITE_CHUNK:
+                pipe.hset(items_key, mapping=batch)
+                batch = {}
+        if batch:
+            pipe.hset(items_key, mapping=batch)
+        pipe.setex(self._make_task_key(session_id, task_id), TASK_TTL, self.serializer.dumps(task_data))
+        pipe.expire(items_key, TASK_TTL)
+        self._bump_versions(pipe, session_id, task_id)
+        # 创建后的版本号为 1，之后图片条目的变化都有记录
+        changes_key = self._make_changes_key(session_id, task_id)
+        pipe.zadd(changes_key, {CHANGES_FLOOR: 1})
+        pipe.expire(changes_key, TASK_TTL)
+        pipe.execute()
+        return task_id, self.get_task(session_id, task_id)
+
+    def get_items(self, session_id, task_id, offset=0, limit=100):
+        """
+        分页读取图片条目
+
+        Returns:
+            list: 按序号排列的图片条目
+        """
+        task_data = self._get_summary(session_id, task_id)
+        if not task_data:
+            return []
+        end = min(task_data["total_images"], offset + limit)
+        if offset >= end:
+            return []
+        values = self.redis_client.hmget(self._make_items_key(session_id, task_id), list(range(offset, end)))
+        return [self.serializer.loads(value) for value in values if value]
+
+    def get_changes(self, session_id, task_id, since):
+        """
+        读取版本号 since 之后变化的图片条目
+
+        Args:
+            since: 客户端已有数据的版本号（上次返回的 version 或 ETag 中的版本号）
+
+        Returns:
+            dict | None: 任务不存在时返回 None；否则包含
+                version: 当前版本号，下次以此为 since
+                resync: 为 True 时无法给出增量（since 早于变化记录的起点或不是有效的版本号），需重新获取全部条目
+                items: 变化的图片条目（按序号排列，resync 时为空）
+        """
+        version = self.get_task_version(session_id, task_id)
+        if version is None:
+            return None if self._get_summary(session_id, task_id) is None else {"version": 0, "resync": True, "items": []}
+        changes_key = self._make_changes_key(session_id, task_id)
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.zscore(changes_key, CHANGES_FLOOR)
+        # 只取不超过 version 的变化，更新的变化留到下次（以 version 为 since）返回
+        pipe.zrangebyscore(changes_key, f"({since}", version)
+        floor, changed = pipe.execute()
+        if floor is None or since < floor or since > version:
+            return {"version": version, "resync": True, "items": []}
+        indexes = sorted(int(member) for member in changed if member != CHANGES_FLOOR.encode())
+        items = []
+        for offset in range(0, len(indexes), ITEM_READ_CHUNK):
+            values = self.redis_client.hmget(self._make_items_key(session_id, task_id), indexes[offset:offset + ITEM_READ_CHUNK])
+            items.extend(self.serializer.loads(value) for value in values if value)
+        return {"version": version, "resync": False, "items": items}
+
+    def _iter_items(self, session_id, task_id, total):
+        # 分段读取，避免一次 HGETALL 取回上千条
+        for offset in range(0, total, ITEM_READ_CHUNK):
+            values = self.redis_client.hmget(
+                self._make_items_key(session_id, task_id),
+                list(range(offset, min(total, offset + ITEM_READ_CHUNK)))
+            )
+            for value in values:
+                if value:
+                    yield self.serializer.loads(value)
+
+    def _attach_items(self, session_id, task_data):
+        """按旧格式补充 images / items / results.generated_images，供前端直接渲染"""
+        images = []
+        items = []
+        generated_images = []
+        for item in self._iter_items(session_id, task_data["task_id"], task_data["total_images"]):
+            images.append({
+                "filename": item["filename"],
+                "status": item["status"],
+                "result_url": item.get("result_url"),
+                "error": item.get("error"),
+            })
+            items.append({
+                "index": item["index"],
+                "prompt": item.get("prompt", task_data.get("prompt")),
+                "status": item["status"],
+            })
+            if item["status"] in (TaskStatus.COMPLETED.value, TaskStatus.FAILED.value):
+                generated_images.append(_generated_image_entry(item))
+        task_data["images"] = images
+        task_data["items"] = items
+        task_data["results"]["generated_images"] = generated_images
+        return task_data
+
+    def get_task(self, session_id, task_id, include_items=None, fields=None):
+        """
+        获取任务详情
+
+        Args:
+            include_items: 是否附带所有图片条目；None 表示图片数不超过 TASK_INLINE_ITEMS 时附带，
+                           否则只返回概要（items_paged 为 True），图片条目通过 get_items 分页获取
+            fields: 只返回这些顶层字段，None 表示返回全部；不包含 ITEM_FIELDS 时不读取图片条目
+        """
+        task_data = self._get_summary(session_id, task_id)
+        if not task_data:
+            return None
+        if fields is not None and not any(field in ITEM_FIELDS for field in fields):
+            return _project(task_data, fields)
+        if include_items is None:
+            include_items = task_data["total_images"] <= TASK_INLINE_ITEMS
+        if include_items:
+            task_data = self._attach_items(session_id, task_data)
+        else:
+            task_data["items_paged"] = True
+        return task_data if fields is None else _project(task_data, fields)
 
     def update_task_status(self, session_id, task_id, status, **kwargs):
-        task_data = self.get_task(session_id, task_id)
-        if task_data:
+        def update(task_data, pipe):
             task_data["status"] = status.value if isinstance(status, TaskStatus) else status
             task_data["updated_at"] = datetime.now().isoformat()
             for key, value in kwargs.items():
                 task_data[key] = value
-            self.redis_client.setex(
-                self._make_task_key(session_id, task_id),
-                3600,
-                json.dumps(task_data)
-            )
-            return task_data
-        return None
 
-    def update_task_progress(self, session_id, task_id, progress, current_image=None):
-        task_data = self.get_task(session_id, task_id)
-        if task_data:
-            task_data["progress"] = progress
-            task_data["processed_images"] = int((progress / 100) * task_data["total_images"])
-            if current_image:
-                task_data["current_image"] = current_image
+        with self._task_lock(session_id, task_id):
+            return self._update_task(session_id, task_id, update)
+
+    def update_task_fields(self, session_id, task_id, **fields):
+        """更新任务概要中的其他字段（如 bulk_job_id），不改变任务状态，不会覆盖期间写入的取消"""
+        def update(task_data, pipe):
+            task_data.update(fields)
             task_data["updated_at"] = datetime.now().isoformat()
-            self.redis_client.setex(
-                self._make_task_key(session_id, task_id),
-                3600,
-                json.dumps(task_data)
-            )
-            return task_data
+
+        with self._task_lock(session_id, task_id):
+            return self._update_task(session_id, task_id, update)
+
+    def update_task_progress(self, session_id, task_id, progress, current_image=None):
+        """
+        更新任务进度（开始处理某张图片时调用）
+
+        进度不是终态，先缓存在进程内，由后台线程合并写入；PROGRESS_FLUSH_INTERVAL_MS 为 0 时直接写入
+        """
+        if self.progress_flush_interval <= 0:
+            return self._write_progress(session_id, task_id, progress, current_image)
+        with self._progress_lock:
+            self._pending_progress[(session_id, task_id)] = (progress, current_image)
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self._flush_progress_loop, name="progress-flusher", daemon=True)
+                self._flusher.start()
         return None
 
-    def add_task_result(self, session_id, task_id, image_filename, result):
-        task_data = self.get_task(session_id, task_id)
-        if task_data:
-            for image in task_data["images"]:
-                if image["filename"] == image_filename:
-                    if result["success"]:
-                        image["status"] = TaskStatus.COMPLETED.value
-                        image["result_url"] = result.get("generated_image_url")
-                        task_data["results"]["success_count"] += 1
-                        generated_image = {
-                            "filename": image_filename,
-                            "generated_url": result.get("generated_image_url"),
-                            "generated_filename": result.get("generated_filename"),
-                            "prompt": result.get("prompt")
-                        }
-                        task_data["results"]["generated_images"].append(generated_image)
-                    else:
-                        image["status"] = TaskStatus.FAILED.value
-                        image["error"] = result.get("error")
-                        task_data["results"]["failed_count"] += 1
-                        # 将失败结果也加入 generated_images，便于前端统一合并渲染
-                        failed_image_entry = {
-                            "filename": image_filename,
-                            "generated_url": None,
-                            "generated_filename": None,
-                            "error": result.get("error"),
-                            "prompt": result.get("prompt")
-                        }
-                        task_data["results"]["generated_images"].append(failed_image_entry)
-                    break
-            completed_count = task_data["results"]["success_count"] + task_data["results"]["failed_count"]
-            if completed_count >= task_data["total_images"]:
-                task_data["status"] = TaskStatus.COMPLETED.value
-                task_data["progress"] = 100.0
-            else:
-                task_data["progress"] = (completed_count / task_data["total_images"]) * 100
+    def _write_progress(self, session_id, task_id, progress, current_image=None):
+        def update(task_data, pipe):
+            self._apply_progress(task_data, progress, current_image)
             task_data["updated_at"] = datetime.now().isoformat()
-            self.redis_client.setex(
-                self._make_task_key(session_id, task_id),
-                3600,
-                json.dumps(task_data)
-            )
-            return task_data
+
+        with self._task_lock(session_id, task_id):
+            return self._update_task(session_id, task_id, update)
+
+    def _apply_progress(self, task_data, progress, current_image):
+        # 缓存的进度可能在图片结果之后才写入，进度只增不减，已结束的任务不再更新
+        if task_data["status"] in (TaskStatus.COMPLETED.value, TaskStatus.FAILED.value, TaskStatus.CANCELLED.value):
+            return
+        task_data["progress"] = max(task_data.get("progress", 0), progress)
+        task_data["processed_images"] = max(task_data.get("processed_images", 0),
+                                            int((progress / 100) * task_data["total_images"]))
+        if current_image:
+            task_data["current_image"] = current_image
+
+    def flush_progress(self):
+        """立即写入所有缓存的进度"""
+        with self._progress_lock:
+            pending, self._pending_progress = self._pending_progress, {}
+        for (session_id, task_id), (progress, current_image) in pending.items():
+            try:
+                self._write_progress(session_id, task_id, progress, current_image)
+            except redis.RedisError as e:
+                logger.warning("Error flushing task progress: %s", e)
+
+    def _flush_progress_loop(self):
+        while True:
+            time.sleep(self.progress_flush_interval)
+            self.flush_progress()
+            with self._progress_lock:
+                # 没有待写入的进度时退出，下次更新进度时重新启动
+                if not self._pending_progress:
+                    self._flusher = None
+                    return
+
+    def _find_item_index(self, session_id, task_id, image_filename):
+        # 未提供 index 的旧调用方式：按文件名查找第一张未完成的图片
+        for field, value in self.redis_client.hscan_iter(self._make_items_key(session_id, task_id), count=ITEM_READ_CHUNK):
+            item = self.serializer.loads(value)
+            if item["filename"] == image_filename and item["status"] == TaskStatus.PENDING.value:
+                return int(field)
         return None
 
+    def add_task_result(self, session_id, task_id, image_filename, result, index=None):
+        # index 为图片在任务中的位置；并发处理时结果按完成顺序写入，前端依赖 index 对应到 item
+        if index is None:
+            index = self._find_item_index(session_id, task_id, image_filename)
+        items_key = self._make_items_key(session_id, task_id)
+
+        def update(task_data, pipe):
+            raw_item = pipe.hget(items_key, index) if index is not None else None
+            if not raw_item:
+                self._refresh_progress(task_data)
+                return None
+            item = self.serializer.loads(raw_item)
+            # 同一张图片重复写入结果（例如任务重试）时先撤销上一次的计数
+            if item["status"] == TaskStatus.COMPLETED.value:
+                task_data["results"]["success_count"] -= 1
+            elif item["status"] == TaskStatus.FAILED.value:
+                task_data["results"]["failed_count"] -= 1
+            item["filename"] = image_filename or item["filename"]
+            if result.get("prompt") is not None:
+                item["prompt"] = result["prompt"]
+            if result["success"]:
+                item["status"] = TaskStatus.COMPLETED.value
+                item["result_url"] = result.get("generated_image_url")
+                item["generated_filename"] = result.get("generated_filename")
+                item["error"] = None
+                if result.get("thumbnail_url"):
+                    item["thumbnail_url"] = result["thumbnail_url"]
+                task_data["results"]["success_count"] += 1
+            else:
+                item["status"] = TaskStatus.FAILED.value
+                item["result_url"] = None
+                item["error"] = result.get("error")
+                task_data["results"]["failed_count"] += 1
+            self._update_preview(task_data, item)
+            self._refresh_progress(task_data)
+            return {index: self.serializer.dumps(item)}
+
+        with self._task_lock(session_id, task_id):
+            return self._update_task(session_id, task_id, update)
+
+    def _update_preview(self, task_data, item):
+        # 重复写入的图片先移除旧的预览，预览按序号保留最靠前的几张
+        preview = [entry for entry in task_data.get("preview", []) if entry["index"] != item["index"]]
+        if item["status"] == TaskStatus.COMPLETED.value and _preview_entry(item)["url"]:
+            preview.append(_preview_entry(item))
+            preview.sort(key=lambda entry: entry["index"])
+        task_data["preview"] = preview[:TASK_PREVIEW_SIZE]
+
+    def _refresh_progress(self, task_data):
+        completed_count = task_data["results"]["success_count"] + task_data["results"]["failed_count"]
+        task_data["processed_images"] = completed_count
+        task_data["failed_images"] = task_data["results"]["failed_count"]
+        if completed_count >= task_data["total_images"]:
+            if task_data["status"] != TaskStatus.CANCELLED.value:
+                task_data["status"] = TaskStatus.COMPLETED.value
+            task_data["progress"] = 100.0
+        else:
+            task_data["progress"] = (completed_count / task_data["total_images"]) * 100
+        task_data["updated_at"] = datetime.now().isoformat()
+
+    def fail_pending_items(self, session_id, task_id, error, start_index=0):
+        """
+        将序号不小于 start_index 的未完成图片全部记为失败（服务重启、任务取消时使用）
+
+        Returns:
+            int: 记为失败的图片数
+        """
+        items_key = self._make_items_key(session_id, task_id)
+        failed = {}
+
+        def update(task_data, pipe):
+            failed.clear()
+            for offset in range(start_index, task_data["total_images"], ITEM_READ_CHUNK):
+                fields = list(range(offset, min(task_data["total_images"], offset + ITEM_READ_CHUNK)))
+                for field, value in zip(fields, pipe.hmget(items_key, fields)):
+                    if not value:
+                        continue
+                    item = self.serializer.loads(value)
+                    if item["status"] == TaskStatus.PENDING.value:
+                        item["status"] = TaskStatus.FAILED.value
+                        item["error"] = error
+                        failed[field] = self.serializer.dumps(item)
+            task_data["results"]["failed_count"] += len(failed)
+            self._refresh_progress(task_data)
+            return failed
+
+        with self._task_lock(session_id, task_id):
+            self._update_task(session_id, task_id, update)
+        return len(failed)
+
     def cancel_task(self, session_id, task_id):
         return self.update_task_status(session_id, task_id, TaskStatus.CANCELLED)
 
-    def get_all_tasks(self, session_id):
+    def save_credentials(self, session_id, task_id, api_key, base_url=None):
+        """
+        保存任务的 API key 和 base_url，供 Celery worker 读取（不放进 broker 消息）
+
+        与任务数据同时过期，任务删除时一并删除。
+        """
+        self.redis_client.setex(self._make_credentials_key(session_id, task_id), TASK_TTL,
+                                self.serializer.dumps({"api_key": api_key, "base_url": base_url}))
+
+    def get_credentials(self, session_id, task_id):
+        """
+        Returns:
+            dict: api_key / base_url，任务已过期或已删除时返回 None
+        """
+        value = self.redis_client.get(self._make_credentials_key(session_id, task_id))
+        return self.serializer.loads(value) if value else None
+
+    def is_cancelled(self, session_id, task_id):
+        task_data = self._get_summary(session_id, task_id)
+        return task_data is None or task_data["status"] == TaskStatus.CANCELLED.value
+
+    def get_task_ids(self, session_id):
+        """
+        Returns:
+            list: 该 session 现有任务的 ID（已排序）；任务因过期消失时不会递增版本号，列表接口的 ETag 还需包含任务集合
+        """
+        prefix_length = len(self.task_prefix) + len(session_id) + 1
+        return sorted(key.decode('utf-8')[prefix_length:] for key in self.redis_client.keys(self._make_all_tasks_key(session_id)))
+
+    def get_task_summaries(self, session_id, fields=SUMMARY_FIELDS):
+        """
+        任务列表的摘要视图：一次 MGET 读取所有任务概要，不读取图片条目
+
+        Args:
+            fields: 返回的顶层字段，不能包含 ITEM_FIELDS 中需要图片条目的字段
+        """
+        keys = self.redis_client.keys(self._make_all_tasks_key(session_id))
+        tasks = []
+        for key, value in zip(keys, self.redis_client.mget(keys) if keys else []):
+            if not value:
+                continue
+            try:
+                tasks.append(self.serializer.loads(value))
+            except Exception as e:
+                # 如果某个任务数据损坏，跳过它
+                logger.warning("Error parsing task data for key %s: %s", key, e)
+        tasks.sort(key=lambda x: x.get("created_at", ""), reverse=True)
+        return [_project(task_data, fields) for task_data in tasks]
+
+    def get_all_tasks(self, session_id, fields=None):
+        """
+        Args:
+            fields: 只返回这些顶层字段，None 表示返回全部；不包含 ITEM_FIELDS 时只读取任务概要
+        """
         tasks = []
         try:
+            if fields is not None and not any(field in ITEM_FIELDS for field in fields):
+                return self.get_task_summaries(session_id, fields)
             keys = self.redis_client.keys(self._make_all_tasks_key(session_id))
             for key in keys:
                 try:
-                    task_data = self.redis_client.get(key)
+                    task_id = key.decode('utf-8')[len(self.task_prefix) + len(session_id) + 1:]
+                    task_data = self.get_task(session_id, task_id)
                     if task_data:
-                        tasks.append(json.loads(task_data))
-                except (json.JSONDecodeError, Exception) as e:
+                        tasks.append(task_data)
+                except Exception as e:
                     # 如果某个任务数据损坏，跳过它
-                    print(f"Error parsing task data for key {key}: {str(e)}")
+                    logger.warning("Error parsing task data for key %s: %s", key, e)
                     continue
-            return sorted(tasks, key=lambda x: x.get("created_at", ""), reverse=True)
+            tasks.sort(key=lambda x: x.get("created_at", ""), reverse=True)
+            return tasks if fields is None else [_project(task_data, fields) for task_data in tasks]
         except Exception as e:
             # Redis连接错误或其他错误
-            print(f"Error getting tasks from Redis: {str(e)}")
+            logger.warning("Error getting tasks from Redis: %s", e)
             return []
 
     def delete_task(self, session_id, task_id):
-        return self.redis_client.delete(self._make_task_key(session_id, task_id))
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.delete(self._make_task_key(session_id, task_id), self._make_items_key(session_id, task_id),
+                    self._make_changes_key(session_id, task_id), self._make_credentials_key(session_id, task_id))
+        # 任务的版本号继续递增而不是删除，避免重新计数后与客户端缓存的 ETag 相同
+        self._bump_versions(pipe, session_id, task_id)
+        return pipe.execute()[0]
 
 # 全局任务管理器实例
 task_manager = BatchTaskManager()
@@ -0,0 +1,155 @@
+"""
+任务数据的序列化
+
+任务概要和每张图片的条目原先都是 json.dumps 的字典，每个条目重复保存相同的字段名，
+列表接口每次轮询都要对所有任务 json.loads。这里把编码方式做成可配置的：
+- TASK_SERIALIZER: json（默认，安装了 orjson 时使用 orjson）或 msgpack（需安装 msgpack），
+  plain 表示不带标记的旧 JSON 格式（回滚到旧版本前使用）
+- TASK_COMPRESSION: none / zlib（默认）/ zstd（需安装 zstandard），只压缩不小于 TASK_COMPRESS_MIN_BYTES 的数据
+
+新格式以 3 字节标记开头：格式版本、编码方式、压缩方式。旧数据是以 "{" 开头的 JSON，
+读取时按开头字节区分，新旧数据可以共存，修改配置后已有的数据仍能读取。
+编码结果是二进制，Redis 客户端不能使用 decode_responses。
+"""
+import json
+import os
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+TASK_SERIALIZER = os.getenv('TASK_SERIALIZER', 'json')
+TASK_COMPRESSION = os.getenv('TASK_COMPRESSION', 'zlib')
+# 小于该大小（字节）的数据不压缩，单个图片条目通常只有一两百字节，压缩反而变大
+TASK_COMPRESS_MIN_BYTES = int(os.getenv('TASK_COMPRESS_MIN_BYTES', 1024))
+
+# 格式版本，标记的第一个字节
+FORMAT_VERSION = 1
+_VERSION_BYTE = bytes([FORMAT_VERSION])
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+CODECS = ('json', 'msgpack', 'plain')
+COMPRESSIONS = ('none', 'zlib', 'zstd')
+
+# 标记中编码方式和压缩方式对应的字节
+_CODEC_TAGS = {'json': b'j', 'msgpack': b'm'}
+_COMPRESSION_TAGS = {'none': b'n', 'zlib': b'z', 'zstd': b's'}
+_TAG_CODECS = {tag[0]: name for name, tag in _CODEC_TAGS.items()}
+_TAG_COMPRESSIONS = {tag[0]: name for name, tag in _COMPRESSION_TAGS.items()}
+
+
+def _json_dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _json_loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _require(module, name):
+    if module is None:
+        raise ValueError(f"未安装 {name}")
+    return module
+
+
+def _encode(codec, obj):
+    if codec == 'msgpack':
+        return _require(msgpack, 'msgpack').packb(obj, use_bin_type=True)
+    return _json_dumps(obj)
+
+
+def _decode(codec, data):
+    if codec == 'msgpack':
+        return _require(msgpack, 'msgpack').unpackb(data, raw=False)
+    return _json_loads(data)
+
+
+def _compress(compression, data):
+    if compression == 'zlib':
+        return zlib.compress(data, ZLIB_LEVEL)
+    return _require(zstandard, 'zstandard').compress(data, ZSTD_LEVEL)
+
+
+def _decompress(compression, data):
+    if compression == 'zlib':
+        return zlib.decompress(data)
+    if compression == 'zstd':
+        return _require(zstandard, 'zstandard').decompress(data)
+    return data
+
+
+class TaskSerializer:
+    """带版本标记的任务数据编码"""
+
+    def __init__(self, codec=TASK_SERIALIZER, compression=TASK_COMPRESSION, compress_min_bytes=TASK_COMPRESS_MIN_BYTES):
+        """
+        Args:
+            codec: json / msgpack / plain
+            compression: none / zlib / zstd（plain 格式不压缩）
+            compress_min_bytes: 编码后不小于该大小时才压缩
+        """
+        if codec not in CODECS:
+            raise ValueError(f"不支持的任务序列化方式: {codec}")
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"不支持的任务压缩方式: {compression}")
+        if codec == 'msgpack':
+            _require(msgpack, 'msgpack')
+        if compression == 'zstd':
+            _require(zstandard, 'zstandard')
+        self.codec = codec
+        self.compression = 'none' if codec == 'plain' else compression
+        self.compress_min_bytes = compress_min_bytes
+
+    def dumps(self, obj):
+        """
+        Returns:
+            bytes: 编码后的数据
+        """
+        if self.codec == 'plain':
+            return json.dumps(obj).encode('utf-8')
+        data = _encode(self.codec, obj)
+        compression = 'none'
+        if self.compression != 'none' and len(data) >= self.compress_min_bytes:
+            compressed = _compress(self.compression, data)
+            if len(compressed) < len(data):
+                data, compression = compressed, self.compression
+        return _VERSION_BYTE + _CODEC_TAGS[self.codec] + _COMPRESSION_TAGS[compression] + data
+
+    def loads(self, data):
+        """
+        解码任意版本的数据（与当前配置无关）
+
+        Args:
+            data: bytes，或旧客户端读到的 str（只可能是旧 JSON 格式）
+        """
+        if isinstance(data, str):
+            return json.loads(data)
+        if not data or data[0] != FORMAT_VERSION:
+            # 不带标记的旧 JSON
+            return _json_loads(data)
+        codec = _TAG_CODECS.get(data[1])
+        compression = _TAG_COMPRESSIONS.get(data[2])
+        if codec is None or compression is None:
+            raise ValueError("无法识别的任务数据格式")
+        return _decode(codec, _decompress(compression, data[3:]))
+
+
+# 全局实例，按环境变量配置
+task_serializer = TaskSerializer()
@@ -1,11 +1,8 @@
-from celery import current_task
 from celery_config import celery_app
+import io
+import logging
 import sys
 import os
-from google import genai
-from PIL import Image
-import io
-import uuid
 import time
 from dotenv import load_dotenv
 
@@ -15,9 +12,16 @@ load_dotenv()
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from result_storage import result_storage
+
+logger = logging.getLogger(__name__)
+
 # 从环境变量读取配置
-GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.5-flash-image')
-RESULT_FOLDER = os.getenv('RESULT_FOLDER', 'results')
+THUMBNAIL_SIZE = int(os.getenv('THUMBNAIL_SIZE', 256))
+# 同一批量任务同时提交到生成调度器的图片数，其余图片等前面的完成后再提交
+BATCH_SUBMIT_WINDOW = int(os.getenv('BATCH_SUBMIT_WINDOW', 16))
+# 批量任务的执行方式：thread 在本进程的生成线程中执行；celery 逐张投递到 Celery 队列，由独立的 worker 执行
+BATCH_BACKEND = os.getenv('BATCH_BACKEND', 'thread').lower()
 
 @celery_app.task(bind=True)
 def generate_single_image(self, file_data, filename, prompt, task_id):
@@ -44,50 +48,9 @@ def generate_single_image(self, file_data, filename, prompt, task_id):
         # 现在所有生成都通过 AIImageGenerator 进行，必须使用用户提供的 API key
         raise ValueError("此函数已废弃，请使用批量生成接口")
         
-        # 将二进制数据转换为PIL Image
-        image = Image.open(io.BytesIO(file_data))
-        
-        # 调用Gemini API生成图片
-        full_prompt = f"Create a picture of my image with the following changes: {prompt}"
-        
-        response = client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=[full_prompt, image]
-        )
-        
-        # 处理响应
-        if response and hasattr(response, 'candidates') and response.candidates:
-            candidate = response.candidates[0]
-            if hasattr(candidate, 'content') and candidate.content:
-                for part in candidate.content.parts:
-                    if hasattr(part, 'inline_data') and part.inline_data:
-                        # 保存生成的图片
-                        generated_filename = f"generated_{uuid.uuid4()}.png"
-                        generated_path = os.path.join(RESULT_FOLDER, generated_filename)
-                        
-                        with open(generated_path, 'wb') as f:
-                            f.write(part.inline_data.data)
-                        
-                        return {
-                            'success': True,
-                            'filename': filename,
-                            'generated_filename': generated_filename,
-                            'generated_url': f"/static/results/{generated_filename}",
-                            'description': f"Successfully generated image for {filename}"
-                        }
-        
-        # 如果没有生成图片，返回描述
-        return {
-            'success': True,
-            'filename': filename,
-            'generated_filename': None,
-            'generated_url': None,
-            'description': f"Processed {filename} but no image was generated"
-        }
-        
     except Exception as e:
         # 记录错误但不抛出异常，避免Celery错误处理问题
-        print(f"Error generating image for {filename}: {str(e)}")
+        logger.exception("Error generating image for %s", filename)
         return {
             'success': False,
             'filename': filename,
@@ -163,7 +126,7 @@ def process_batch_task(self, batch_data):
         }
         
     except Exception as e:
-        print(f"Error processing batch task: {str(e)}")
+        logger.exception("Error processing batch task")
         return {
             'success': False,
             'error': str(e)
@@ -204,7 +167,7 @@ def update_task_results(self, task_id, results):
         }
         
     except Exception as e:
-        print(f"Error updating task results: {str(e)}")
+        logger.exception("Error updating task results")
         from task_manager import task_manager
         task_manager.update_task_status(task_id, 'failed')
         return {
@@ -212,13 +175,418 @@ def update_task_results(self, task_id, results):
             'error': str(e)
         }
 
+@celery_app.task(bind=True)
+def generate_batch_item(self, session_id, task_id, index, filename, image_path, prompt,
+                        api_type="gemini", model_name=None, record_prompt=False):
+    """
+    调用模型生成批量任务中的一张图片（provider_io 队列）
+    
+    参考图通过磁盘路径传递，避免把图片内容放进 broker 消息；
+    API key 和 base_url 从任务管理器读取（见 task_manager.save_credentials），同样不放进消息
+    
+    Returns:
+        dict: 生成结果，交给后续的后处理和记录任务
+    """
+    from task_manager import task_manager
+    try:
+        credentials = task_manager.get_credentials(session_id, task_id)
+        if task_manager.is_cancelled(session_id, task_id):
+            error = "任务已取消"
+        elif credentials is None:
+            error = "任务已过期，请重新提交"
+        else:
+            error = _check_item_quota(session_id, api_type)
+        if error:
+            result = {
+                'success': False,
+                'error': error,
+                'api_type': api_type
+            }
+        else:
+            from ai_image_generator import create_image_generator
+            image_data = None
+            if image_path:
+                with open(image_path, 'rb') as f:
+                    image_data = f.read()
+            generator = create_image_generator(api_type, credentials['api_key'], model_name, credentials['base_url'])
+            result = generator.generate_image(image_data, prompt)
+    except Exception as e:
+        result = {
+            'success': False,
+            'error': str(e),
+            'api_type': api_type
+        }
+    result['filename'] = filename
+    if record_prompt:
+        result['prompt'] = prompt
+    return result
+
+@celery_app.task(bind=True)
+def create_result_thumbnail(self, result):
+    """
+    为生成的图片创建缩略图（image_cpu 队列）
+    
+    Args:
+        result: generate_batch_item 的返回值
+    
+    Returns:
+        dict: 补充了 thumbnail_url 的结果
+    """
+    generated_url = result.get('generated_image_url') if result.get('success') else None
+    if not generated_url:
+        return result
+    from PIL import Image
+    from result_storage import name_from_url
+    try:
+        generated_filename = name_from_url(generated_url)
+        thumbnail_filename = f"thumb_{os.path.splitext(generated_filename)[0]}.webp"
+        with Image.open(io.BytesIO(result_storage.get(generated_filename))) as image:
+            image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+            thumbnail = io.BytesIO()
+            image.save(thumbnail, format='WEBP', quality=80)
+        result['thumbnail_url'] = result_storage.put(thumbnail_filename, thumbnail.getvalue())
+    except Exception as e:
+        # 缩略图失败不影响生成结果
+        logger.exception("Error creating thumbnail for %s", generated_url)
+    return result
+
+@celery_app.task(bind=True)
+def record_batch_item_result(self, result, session_id, task_id, index):
+    """
+    将单张图片的结果写入任务管理器（bookkeeping 队列）
+    
+    Args:
+        result: 前序任务的生成结果
+        index: 图片在任务中的位置
+    """
+    from task_manager import task_manager
+    task_manager.add_task_result(session_id, task_id, result.get('filename'), result, index=index)
+    return {
+        'success': True,
+        'task_id': task_id,
+        'index': index
+    }
+
+def dispatch_batch_item(session_id, task_id, index, filename, image_path, prompt,
+                        api_type="gemini", model_name=None, record_prompt=False):
+    """
+    通过Celery处理批量任务中的一张图片：生成 -> 缩略图 -> 记录结果，三步分别进入各自的队列
+    
+    调用前需用 task_manager.save_credentials 保存任务的 API key。
+    
+    Returns:
+        AsyncResult: 整条任务链的结果
+    """
+    from celery import chain
+    return chain(
+        generate_batch_item.s(session_id, task_id, index, filename, image_path, prompt,
+                              api_type, model_name, record_prompt),
+        create_result_thumbnail.s(),
+        record_batch_item_result.s(session_id, task_id, index),
+    ).apply_async()
+
+def _check_item_quota(session_id, api_type):
+    """
+    生成单张图片前检查并扣减每日限额（Mock API 不计入）
+    
+    Returns:
+        str: 超出限额时的错误信息，未超出返回 None
+    """
+    if api_type == "mock":
+        return None
+    from daily_limit_manager import daily_limit_manager
+    allowed, _, _ = daily_limit_manager.check_and_increment(session_id, 1)
+    if not allowed:
+        return f"今日生成数量已达上限（{daily_limit_manager.daily_limit}张），请明天再试"
+    return None
+
+def _generate_batch_item(session_id, task_id, index, total_images, filename, image_path, prompt,
+                         api_type="gemini", api_key=None, model_name=None, base_url=None, record_prompt=False,
+                         check_quota=True):
+    """
+    在生成线程中处理批量任务的一张图片，结果写入任务管理器
+    
+    Args:
+        index: 图片在任务中的位置
+        total_images: 任务图片总数
+        filename: 结果对应的文件名
+        image_path: 参考图片在磁盘上的路径（可选），轮到该图片时才读取
+        record_prompt: 是否在结果中保存该图片的prompt（多prompt任务使用）
+        check_quota: 是否检查每日限额（组图请求未生成的图片已扣过限额）
+    
+    Returns:
+        dict | Future: 生成结果；图片在后台写入时为写入并记录结果后完成的 Future
+    """
+    from task_manager import task_manager
+    from ai_image_generator import create_image_generator
+    from result_writer import when_persisted
+    
+    # 更新进度
+    progress = (index / total_images) * 100
+    task_manager.update_task_progress(session_id, task_id, progress, index + 1)
+    
+    try:
+        quota_error = _check_item_quota(session_id, api_type) if check_quota else None
+        if quota_error:
+            result = {
+                'success': False,
+                'error': quota_error,
+                'api_type': api_type
+            }
+        else:
+            image_data = None
+            if image_path:
+                with open(image_path, 'rb') as f:
+                    image_data = f.read()
+            # 必须使用用户提供的API key，不再使用服务器配置
+            # 图片交给 I/O 线程写入，生成线程不等待写盘
+            generator = create_image_generator(api_type, api_key, model_name, base_url, write_behind=True)
+            result = generator.generate_image(image_data, prompt)
+            # 逐张图片的日志只按 LOG_SAMPLE_RATE 抽样保留
+            logger.debug("生成图片 %d/%d: success=%s", index + 1, total_images, result.get('success'),
+                         extra={'task_id': task_id, 'api_type': api_type, 'error': result.get('error'), 'sampled': True})
+    except Exception as e:
+        # 单张失败只影响当前图片，不中断整个批量任务
+        result = {
+            'success': False,
+            'error': str(e),
+            'api_type': api_type
+        }
+    
+    # 添加文件名信息
+    result['filename'] = filename
+    if record_prompt:
+        result['prompt'] = prompt  # 保存每个item的具体prompt
+    
+    # 图片写入完成后才更新任务结果
+    def record(result):
+        task_manager.add_task_result(session_id, task_id, filename, result, index=index)
+        return result
+    return when_persisted(result, record)
+
+def _generate_batch_group(session_id, task_id, items, total_images, image_path, prompt,
+                          api_type="gemini", api_key=None, model_name=None, base_url=None):
+    """
+    在生成线程中用一次组图请求生成同一 prompt 的多张图片，返回的图片依次分配给各个条目
+    
+    API 返回的图片少于条目数（或请求失败）时，剩余条目作为 fallback_items 返回，由调用方逐张生成。
+    
+    Args:
+        items: (index, filename) 列表
+        image_path: 参考图片在磁盘上的路径（可选）
+    
+    Returns:
+        dict: success_count / failed_count / fallback_items（_generate_batch_item 的参数元组列表）/
+              persisting（图片在后台写入的条目，(index, filename, 写入并记录结果后完成的 Future) 列表，不计入上述数量）
+    """
+    from concurrent.futures import Future
+    from task_manager import task_manager
+    from ai_image_generator import create_image_generator
+    from result_writer import when_persisted
+    
+    counts = {'success_count': 0, 'failed_count': 0, 'fallback_items': [], 'persisting': []}
+    first_index = items[0][0]
+    task_manager.update_task_progress(session_id, task_id, (first_index / total_images) * 100, first_index + 1)
+    
+    # 限额按图片逐张检查，超出限额的图片直接记为失败
+    allowed = []
+    for index, filename in items:
+        quota_error = _check_item_quota(session_id, api_type)
+        if quota_error:
+            result = {'success': False, 'error': quota_error, 'api_type': api_type, 'filename': filename}
+            task_manager.add_task_result(session_id, task_id, filename, result, index=index)
+            counts['failed_count'] += 1
+        else:
+            allowed.append((index, filename))
+    if not allowed:
+        return counts
+    
+    results = []
+    try:
+        image_data = None
+        if image_path:
+            with open(image_path, 'rb') as f:
+                image_data = f.read()
+        generator = create_image_generator(api_type, api_key, model_name, base_url, write_behind=True)
+        results = [result for result in generator.generate_images(image_data, prompt, len(allowed)) if result.get('success')]
+        logger.debug("组图生成 %d/%d 张（从第 %d 张开始）", len(results), len(allowed), first_index + 1,
+                     extra={'task_id': task_id, 'api_type': api_type, 'sampled': True})
+    except Exception:
+        logger.warning("组图生成失败，改为逐张生成", exc_info=True, extra={'task_id': task_id, 'api_type': api_type})
+    
+    def recorder(index, filename):
+        def record(result):
+            task_manager.add_task_result(session_id, task_id, filename, result, index=index)
+            return result
+        return record
+    
+    for (index, filename), result in zip(allowed, results):
+        result['filename'] = filename
+        persisted = when_persisted(result, recorder(index, filename))
+        if isinstance(persisted, Future):
+            counts['persisting'].append((index, filename, persisted))
+        else:
+            counts['success_count'] += 1
+    
+    counts['fallback_items'] = [
+        (session_id, task_id, index, total_images, filename, image_path, prompt,
+         api_type, api_key, model_name, base_url, False, False)
+        for index, filename in allowed[len(results):]
+    ]
+    return counts
+
+def _dispatch_batch_items(session_id, task_id, items):
+    """
+    BATCH_BACKEND=celery 时把批量任务的图片逐张投递到 Celery 队列（见 dispatch_batch_item），不等待结果
+    
+    API key 和 base_url 只保存一次到任务管理器，投递的消息中不包含它们。
+    结果由 record_batch_item_result 写入任务管理器，全部写入后任务标记为完成。
+    
+    Args:
+        items: _generate_batch_item 的参数元组（可迭代对象）
+    
+    Returns:
+        dict: success_count / failed_count / cancelled / dispatched_count
+    """
+    from task_manager import task_manager
+    
+    counts = {'success_count': 0, 'failed_count': 0, 'cancelled': False, 'dispatched_count': 0}
+    for item in items:
+        (_, _, index, _, filename, image_path, prompt, api_type, api_key, model_name, base_url) = item[:11]
+        record_prompt = item[11] if len(item) > 11 else False
+        if not counts['dispatched_count']:
+            task_manager.save_credentials(session_id, task_id, api_key, base_url)
+        # 投递前检查任务是否已被取消，已投递的图片由 worker 按取消处理，其余图片在这里记为失败
+        if task_manager.is_cancelled(session_id, task_id):
+            counts['cancelled'] = True
+            counts['failed_count'] += task_manager.fail_pending_items(session_id, task_id, "任务已取消", index)
+            break
+        dispatch_batch_item(session_id, task_id, index, filename, image_path, prompt,
+                            api_type, model_name, record_prompt)
+        counts['dispatched_count'] += 1
+    return counts
+
+def _fail_items(session_id, task_id, entries, error):
+    """
+    把处理时出错的图片记为失败，记录失败本身出错时只写日志
+    
+    Returns:
+        int: 图片数
+    """
+    from task_manager import task_manager
+    for index, filename in entries:
+        try:
+            task_manager.add_task_result(session_id, task_id, filename,
+                                         {'success': False, 'error': error, 'filename': filename}, index=index)
+        except Exception:
+            logger.exception("记录图片 %d 的失败结果出错", index, extra={'task_id': task_id})
+    return len(entries)
+
+def _run_batch_items(session_id, task_id, items, job_fn=None):
+    """
+    将批量任务的图片逐批提交到公平调度器，并等待全部完成
+    
+    items 可以是生成器：同一任务最多只有 BATCH_SUBMIT_WINDOW 个生成任务在调度器中排队或执行，
+    其余图片的参数和参考图都留在原处，任务再大内存占用也不变。
+    
+    Args:
+        session_id: 用户会话ID，调度器按此在用户之间轮流分配生成线程
+        task_id: 任务ID
+        items: job_fn 的参数元组（可迭代对象）
+        job_fn: 在生成线程中执行的函数，默认 _generate_batch_item；
+                _generate_batch_group 返回的 fallback_items 会再以 _generate_batch_item 逐张提交。
+                BATCH_BACKEND=celery 时忽略，条目交给 _dispatch_batch_items
+    
+    Returns:
+        dict: success_count / failed_count / cancelled
+    """
+    from collections import deque
+    from concurrent.futures import Future, wait, FIRST_COMPLETED
+    from scheduler import generation_scheduler, JobPriority, SchedulerShutdown
+    from task_manager import task_manager
+    
+    if BATCH_BACKEND == 'celery':
+        return _dispatch_batch_items(session_id, task_id, items)
+    job_fn = job_fn or _generate_batch_item
+    counts = {'success_count': 0, 'failed_count': 0, 'cancelled': False}
+    pending = set()
+    owners = {}  # 进行中的 Future -> 对应的 (index, filename) 列表，Future 抛出异常时把这些图片记为失败
+    fallback = deque()  # 组图未生成的图片，优先于后续条目提交
+    
+    def track(future, entries):
+        owners[future] = entries
+        pending.add(future)
+    
+    def collect(done):
+        for future in done:
+            entries = owners.pop(future)
+            try:
+                result = future.result()
+            except SchedulerShutdown:
+                # 已在下方统一记为失败
+                continue
+            except Exception as e:
+                # 例如 I/O 线程中记录结果时 Redis 出错：只影响这些图片，继续处理其余图片
+                logger.exception("批量任务图片处理失败", extra={'task_id': task_id})
+                counts['failed_count'] += _fail_items(session_id, task_id, entries, str(e))
+                continue
+            if isinstance(result, Future):
+                # 图片仍在后台写入，写入并记录结果后再计数，同时占用提交窗口
+                track(result, entries)
+            elif 'fallback_items' in result:
+                counts['success_count'] += result['success_count']
+                counts['failed_count'] += result['failed_count']
+                fallback.extend(result['fallback_items'])
+                for index, filename, persisting in result['persisting']:
+                    track(persisting, [(index, filename)])
+            else:
+                counts['success_count' if result.get('success') else 'failed_count'] += 1
+    
+    items = iter(items)
+    try:
+        while True:
+            while len(pending) >= BATCH_SUBMIT_WINDOW:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            if fallback:
+                fn, item = _generate_batch_item, fallback.popleft()
+            else:
+                fn, item = job_fn, next(items, None)
+            if item is None:
+                if not pending:
+                    break
+                # 条目已全部提交，等待进行中的组图请求返回可能需要逐张生成的图片
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+                continue
+            # 每次补充排队前检查任务是否已被取消，已排队的图片继续完成
+            if task_manager.is_cancelled(session_id, task_id):
+                counts['cancelled'] = True
+                break
+            # 组图条目的第 3 个参数是 (index, filename) 列表
+            entries = item[2] if fn is _generate_batch_group else [(item[2], item[4])]
+            track(generation_scheduler.submit(session_id, fn, *item, priority=JobPriority.BATCH), entries)
+    except SchedulerShutdown:
+        pass
+    while pending:
+        done, pending = wait(pending)
+        collect(done)
+    
+    if counts['cancelled']:
+        # 已提交的图片都已完成，未提交的图片记为失败，任务的进度才能到达 100%
+        counts['failed_count'] += task_manager.fail_pending_items(session_id, task_id, "任务已取消")
+    elif generation_scheduler.is_shutdown():
+        # 服务重启时尚未开始的图片记为失败，已生成的结果保留，用户可重新提交失败的图片
+        counts['failed_count'] += task_manager.fail_pending_items(session_id, task_id, "服务正在重启，任务未执行，请重新提交")
+    return counts
+
 def process_batch_task_sync(session_id, task_id, images_data, prompt, api_type="gemini", api_key=None, model_name=None, base_url=None):
     """
     同步处理批量任务（不使用Celery）
     
     Args:
         task_id: 任务ID
-        images_data: 图片数据列表
+        images_data: 图片信息列表，每项包含 filename 和 file_path（图片已保存在磁盘上）
         prompt: 生成提示词
         api_type: API类型 ("gemini" 或 "doubao")
         api_key: API密钥（可选）
@@ -229,40 +597,23 @@ def process_batch_task_sync(session_id, task_id, images_data, prompt, api_type="
         dict: 批量任务结果
     """
     try:
-        from task_manager import task_manager
-        
-        results = []
         total_images = len(images_data)
         
-        for i, image_data in enumerate(images_data):
-            # 更新进度
-            progress = (i / total_images) * 100
-            task_manager.update_task_progress(session_id, task_id, progress, i + 1)
-            
-            # 使用统一的API生成器
-            from ai_image_generator import create_image_generator
-            # 必须使用用户提供的API key，不再使用服务器配置
-            generator = create_image_generator(api_type, api_key, model_name, base_url)
-            result = generator.generate_image(image_data['file_data'], prompt)
-            
-            results.append(result)
-            
-            # 更新任务结果
-            task_manager.add_task_result(session_id, task_id, image_data['filename'], result)
-            
-            # 短暂延迟，避免API限制
-            time.sleep(1)
+        counts = _run_batch_items(session_id, task_id, (
+            (session_id, task_id, i, total_images, image_data['filename'], image_data['file_path'], prompt,
+             api_type, api_key, model_name, base_url)
+            for i, image_data in enumerate(images_data)
+        ))
         
         return {
             'success': True,
             'task_id': task_id,
-            'results': results,
             'total_images': total_images,
-            'completed_images': len(results)
+            **counts
         }
         
     except Exception as e:
-        print(f"Error processing batch task sync: {str(e)}")
+        logger.exception("Error processing batch task sync")
         return {
             'success': False,
             'error': str(e)
@@ -286,62 +637,21 @@ def generate_single_image_sync(file_data, filename, prompt, task_id):
         # 现在所有生成都通过 AIImageGenerator 进行，必须使用用户提供的 API key
         raise ValueError("此函数已废弃，请使用批量生成接口")
         
-        # 将二进制数据转换为PIL Image
-        image = Image.open(io.BytesIO(file_data))
-        
-        # 调用Gemini API生成图片
-        full_prompt = f"Create a picture of my image with the following changes: {prompt}"
-        
-        response = client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=[full_prompt, image]
-        )
-        
-        # 处理响应
-        if response and hasattr(response, 'candidates') and response.candidates:
-            candidate = response.candidates[0]
-            if hasattr(candidate, 'content') and candidate.content:
-                for part in candidate.content.parts:
-                    if hasattr(part, 'inline_data') and part.inline_data:
-                        # 保存生成的图片
-                        generated_filename = f"generated_{uuid.uuid4()}.png"
-                        generated_path = os.path.join(RESULT_FOLDER, generated_filename)
-                        
-                        with open(generated_path, 'wb') as f:
-                            f.write(part.inline_data.data)
-                        
-                        return {
-                            'success': True,
-                            'filename': filename,
-                            'generated_filename': generated_filename,
-                            'generated_url': f"/static/results/{generated_filename}",
-                            'description': f"Successfully generated image for {filename}"
-                        }
-        
-        # 如果没有生成图片，返回描述
-        return {
-            'success': True,
-            'filename': filename,
-            'generated_filename': None,
-            'generated_url': None,
-            'description': f"Processed {filename} but no image was generated"
-        }
-        
     except Exception as e:
-        print(f"Error generating image for {filename}: {str(e)}")
+        logger.exception("Error generating image for %s", filename)
         return {
             'success': False,
             'filename': filename,
             'error': str(e)
         }
 
-def process_batch_generate_sync(session_id, task_id, reference_image_data, prompt, image_count, api_type="gemini", api_key=None, model_name=None, base_url=None):
+def process_batch_generate_sync(session_id, task_id, reference_image_path, prompt, image_count, api_type="gemini", api_key=None, model_name=None, base_url=None):
     """
     批量生图：使用同一张参考图和prompt重复生成多张图片
     
     Args:
         task_id: 任务ID
-        reference_image_data: 参考图片的二进制数据
+        reference_image_path: 参考图片在磁盘上的路径（可选）
         prompt: 生成提示词
         image_count: 生成图片数量
         api_type: API类型 ("gemini" 或 "doubao")
@@ -353,67 +663,47 @@ def process_batch_generate_sync(session_id, task_id, reference_image_data, promp
         dict: 批量任务结果
     """
     try:
-        from task_manager import task_manager
-        
-        results = []
+        from ai_image_generator import images_per_call
         total_images = image_count
-        
-        for i in range(image_count):
-            # 更新进度
-            progress = (i / total_images) * 100
-            task_manager.update_task_progress(session_id, task_id, progress, i + 1)
-            
-            # 生成文件名
-            filename = f"generated_{i+1}.png"
-            
-            print(f"  [任务处理] 使用 {api_type}，模型: {model_name}, base_url: {base_url}")
-            
-            # 使用统一的API生成器
-            from ai_image_generator import create_image_generator
-            # 如果没有提供API key，传递None，让create_image_generator使用服务器配置的
-            print(f"  [任务处理] 创建生成器: api_type={api_type}, model={model_name}, base_url={base_url}")
-            generator = create_image_generator(api_type, api_key, model_name, base_url)
-            print(f"  [任务处理] 生成器类型: {type(generator).__name__}")
-            print(f"  [任务处理] 开始生成图片...")
-            result = generator.generate_image(reference_image_data, prompt)
-            print(f"  [任务处理] 生成结果: success={result.get('success')}, error={result.get('error', 'N/A')}")
-            
-            # 添加文件名信息
-            if result['success']:
-                result['filename'] = filename
-            else:
-                result['filename'] = filename
-            
-            results.append(result)
-            
-            # 更新任务结果
-            task_manager.add_task_result(session_id, task_id, filename, result)
-            
-            # 短暂延迟，避免API限制
-            time.sleep(1)
+        logger.info("开始处理批量任务", extra={'task_id': task_id, 'api_type': api_type, 'model_name': model_name,
+                                              'base_url': base_url, 'image_count': total_images})
+        
+        group_size = images_per_call(api_type)
+        if group_size > 1 and image_count > 1 and BATCH_BACKEND != 'celery':
+            # API 支持组图时，同一 prompt 的多张图片合并为一次请求
+            counts = _run_batch_items(session_id, task_id, (
+                (session_id, task_id, [(i, f"generated_{i+1}.png") for i in range(start, min(start + group_size, image_count))],
+                 total_images, reference_image_path, prompt, api_type, api_key, model_name, base_url)
+                for start in range(0, image_count, group_size)
+            ), job_fn=_generate_batch_group)
+        else:
+            counts = _run_batch_items(session_id, task_id, (
+                (session_id, task_id, i, total_images, f"generated_{i+1}.png", reference_image_path, prompt,
+                 api_type, api_key, model_name, base_url)
+                for i in range(image_count)
+            ))
         
         return {
             'success': True,
             'task_id': task_id,
-            'results': results,
             'total_images': total_images,
-            'completed_images': len(results)
+            **counts
         }
         
     except Exception as e:
-        print(f"Error processing batch generate sync: {str(e)}")
+        logger.exception("Error processing batch generate sync")
         return {
             'success': False,
             'error': str(e)
         }
 
-def process_batch_generate_multi_prompt_sync(session_id, task_id, reference_image_data, prompts, api_type="gemini", api_key=None, model_name=None, base_url=None):
+def process_batch_generate_multi_prompt_sync(session_id, task_id, reference_image_path, prompts, api_type="gemini", api_key=None, model_name=None, base_url=None):
     """
     批量生图：使用同一张参考图，但每个prompt生成一张图片（用于变量功能）
     
     Args:
         task_id: 任务ID
-        reference_image_data: 参考图片的二进制数据（可选）
+        reference_image_path: 参考图片在磁盘上的路径（可选）
         prompts: 提示词列表
         api_type: API类型 ("gemini" 或 "doubao")
         api_key: API密钥（可选）
@@ -424,58 +714,174 @@ def process_batch_generate_multi_prompt_sync(session_id, task_id, reference_imag
         dict: 批量任务结果
     """
     try:
-        from task_manager import task_manager
-        
-        results = []
         total_images = len(prompts)
+        logger.info("开始处理批量任务", extra={'task_id': task_id, 'api_type': api_type, 'model_name': model_name,
+                                              'base_url': base_url, 'image_count': total_images})
         
-        for i, prompt in enumerate(prompts):
-            # 更新进度
-            progress = (i / total_images) * 100
-            task_manager.update_task_progress(session_id, task_id, progress, i + 1)
-            
-            # 生成文件名
-            filename = f"generated_{i+1}.png"
-            
-            print(f"  [任务处理] 使用 {api_type}，模型: {model_name}, base_url: {base_url}")
-            
-            # 使用统一的API生成器
-            from ai_image_generator import create_image_generator
-            # 如果没有提供API key，传递None，让create_image_generator使用服务器配置的
-            print(f"  [任务处理] 创建生成器: api_type={api_type}, model={model_name}, base_url={base_url}")
-            generator = create_image_generator(api_type, api_key, model_name, base_url)
-            print(f"  [任务处理] 生成器类型: {type(generator).__name__}")
-            print(f"  [任务处理] 开始生成图片...")
-            result = generator.generate_image(reference_image_data, prompt)
-            print(f"  [任务处理] 生成结果: success={result.get('success')}, error={result.get('error', 'N/A')}")
-            
-            # 添加文件名信息和prompt
-            if result['success']:
-                result['filename'] = filename
-            else:
-                result['filename'] = filename
-            
-            result['prompt'] = prompt  # 保存每个item的具体prompt
-            
-            results.append(result)
-            
-            # 更新任务结果
-            task_manager.add_task_result(session_id, task_id, filename, result)
-            
-            # 短暂延迟，避免API限制
-            time.sleep(1)
+        counts = _run_batch_items(session_id, task_id, (
+            (session_id, task_id, i, total_images, f"generated_{i+1}.png", reference_image_path, prompt,
+             api_type, api_key, model_name, base_url, True)
+            for i, prompt in enumerate(prompts)
+        ))
         
         return {
             'success': True,
             'task_id': task_id,
-            'results': results,
             'total_images': total_images,
-            'completed_images': len(results)
+            **counts
         }
         
     except Exception as e:
-        print(f"Error processing batch generate multi-prompt sync: {str(e)}")
+        logger.exception("Error processing batch generate multi-prompt sync")
         return {
             'success': False,
             'error': str(e)
         }
+
+def process_bulk_job_sync(session_id, task_id, items, api_type="gemini", api_key=None, model_name=None, base_url=None,
+                          provider=None, poll_initial=None, poll_max=None):
+    """
+    bulk 模式：把任务的所有图片打包为一个 API 批量作业，轮询到作业结束后把结果写入任务管理器
+
+    不占用生成线程，轮询期间只有一个后台线程在等待，详见 bulk_jobs。
+
+    Args:
+        task_id: 任务ID
+        items: (index, filename, image_path, prompt, record_prompt) 列表，image_path 为参考图路径（可选）
+        api_type: API类型（见 bulk_jobs.bulk_supported）
+        provider: 批量作业接口实例（可选，默认由 create_bulk_provider 创建）
+        poll_initial / poll_max: 轮询间隔（可选，默认 BULK_POLL_INITIAL / BULK_POLL_MAX）
+
+    Returns:
+        dict: 批量任务结果
+    """
+    from bulk_jobs import BULK_JOB_FOLDER, BULK_JOB_TIMEOUT, BulkJobState, create_bulk_provider, poll_intervals
+    from task_manager import task_manager
+    from image_preprocess import image_preprocessor
+
+    try:
+        provider = provider or create_bulk_provider(api_type, api_key, model_name, base_url)
+        total_images = len(items)
+        counts = {'success_count': 0, 'failed_count': 0, 'cancelled': False}
+        submitted = {}  # key -> (index, filename, prompt)
+
+        # 打包作业文件：限额逐张检查，同一参考图只读取和预处理一次
+        os.makedirs(BULK_JOB_FOLDER, exist_ok=True)
+        job_path = os.path.join(BULK_JOB_FOLDER, f"{task_id}.jsonl")
+        reference_path, reference_data = None, None
+        with open(job_path, 'w', encoding='utf-8') as f:
+            for index, filename, image_path, prompt, record_prompt in items:
+                quota_error = _check_item_quota(session_id, api_type)
+                if quota_error:
+                    result = {'success': False, 'error': quota_error, 'api_type': api_type, 'filename': filename}
+                    task_manager.add_task_result(session_id, task_id, filename, result, index=index)
+                    counts['failed_count'] += 1
+                    continue
+                if image_path and image_path != reference_path:
+                    with open(image_path, 'rb') as image_file:
+                        reference_data = image_preprocessor.prepare(image_file.read(), api_type)
+                    reference_path = image_path
+                provider.write_request(f, str(index), reference_data if image_path else None, prompt)
+                submitted[str(index)] = (index, filename, prompt if record_prompt else None)
+
+        if not submitted or task_manager.is_cancelled(session_id, task_id):
+            os.remove(job_path)
+            if submitted:
+                # 提交前已取消：与轮询期间取消相同，未生成的图片记为失败
+                counts['cancelled'] = True
+                counts['failed_count'] += task_manager.fail_pending_items(session_id, task_id, "任务已取消")
+            return {'success': True, 'task_id': task_id, 'total_images': total_images, **counts}
+
+        job_id = provider.submit(job_path, f"batchgen-{task_id}")
+        if os.path.exists(job_path):
+            os.remove(job_path)
+        logger.info("批量作业已提交", extra={'task_id': task_id, 'bulk_job_id': job_id, 'image_count': len(submitted)})
+        # 任务在创建时已是 processing，这里只记录作业ID：上传作业文件可能需要几分钟，期间的取消不能被覆盖
+        task_manager.update_task_fields(session_id, task_id, bulk_job_id=job_id)
+        if task_manager.is_cancelled(session_id, task_id):
+            provider.cancel(job_id)
+            counts['cancelled'] = True
+
+        # 按退避间隔轮询，每次轮询同时更新进度并续期任务数据
+        status = {'state': BulkJobState.RUNNING, 'completed': None, 'error': None}
+        waited = 0.0
+        for delay in poll_intervals(poll_initial, poll_max):
+            if counts['cancelled']:
+                break
+            time.sleep(delay)
+            waited += delay
+            if task_manager.is_cancelled(session_id, task_id):
+                provider.cancel(job_id)
+                counts['cancelled'] = True
+                break
+            status = provider.poll(job_id)
+            if status['state'] in BulkJobState.FINISHED:
+                break
+            if waited >= BULK_JOB_TIMEOUT:
+                provider.cancel(job_id)
+                status['error'] = "批量作业超时"
+                break
+            if status['completed'] is not None:
+                done = counts['failed_count'] + status['completed']
+                task_manager.update_task_progress(session_id, task_id, (done / total_images) * 100, done)
+            else:
+                task_manager.update_task_progress(session_id, task_id, (counts['failed_count'] / total_images) * 100)
+
+        # 写入结果：作业失败时已完成的部分结果同样写入，已取消的任务不再读取结果；未返回结果的图片记为失败
+        if not counts['cancelled']:
+            for key, result in provider.iter_results(job_id):
+                entry = submitted.pop(key, None)
+                if entry is None:
+                    continue
+                index, filename, prompt = entry
+                result['filename'] = filename
+                if prompt is not None:
+                    result['prompt'] = prompt
+                task_manager.add_task_result(session_id, task_id, filename, result, index=index)
+                counts['success_count' if result.get('success') else 'failed_count'] += 1
+        provider.cleanup(job_id)
+
+        if submitted:
+            error = "任务已取消" if counts['cancelled'] else f"批量作业未返回结果: {status.get('error') or status['state']}"
+            counts['failed_count'] += task_manager.fail_pending_items(session_id, task_id, error)
+
+        return {
+            'success': True,
+            'task_id': task_id,
+            'total_images': total_images,
+            **counts
+        }
+
+    except Exception as e:
+        logger.exception("Error processing bulk job")
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+def start_batch_in_background(session_id, task_id, process_fn, *args):
+    """
+    在后台线程中运行批量处理函数，接口创建任务后立即返回，前端轮询任务状态
+    
+    Args:
+        process_fn: process_batch_*_sync 之一，参数为 (session_id, task_id, *args)
+    
+    Returns:
+        threading.Thread: 已启动的后台线程
+    """
+    import threading
+    from task_manager import task_manager, TaskStatus
+    
+    def run():
+        try:
+            result = process_fn(session_id, task_id, *args)
+            if not result['success']:
+                task_manager.update_task_status(session_id, task_id, TaskStatus.FAILED, error=result.get('error'))
+        except Exception as e:
+            logger.exception("Error running batch task %s", task_id)
+            task_manager.update_task_status(session_id, task_id, TaskStatus.FAILED, error=str(e))
+    
+    # 任务的图片全部写入结果后由任务管理器标记为完成，这里只处理整体失败
+    thread = threading.Thread(target=run, name=f"batch-{task_id[:8]}", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,50 @@
+"""
+测试公共配置
+
+各模块在导入时读取环境变量，这里在导入前把上传 / 结果目录指向临时目录，并关闭参考图预处理的进程池。
+Redis 使用 fakeredis，每个测试一个独立的服务端。
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+_DATA_DIR = tempfile.mkdtemp(prefix='batchgen-tests-')
+os.environ.update({
+    'UPLOAD_FOLDER': os.path.join(_DATA_DIR, 'uploads'),
+    'RESULT_FOLDER': os.path.join(_DATA_DIR, 'results'),
+    'RESULT_STORAGE': 'local',
+    'SUPPORTED_APIS': 'gemini,doubao,mock',
+    'MOCK_LATENCY': 'fixed:0',
+    'INPUT_PREPROCESS': 'false',
+    'LOG_LEVEL': 'WARNING',
+})
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 最小的 PNG 文件头，足以通过 sniff_image_type
+PNG_BYTES = b'\x89PNG\r\n\x1a\n' + b'\x00' * 64
+
+
+@pytest.fixture
+def redis_server(monkeypatch):
+    """把各模块的 Redis 客户端替换为同一个 fakeredis 服务端"""
+    fakeredis = pytest.importorskip('fakeredis')
+    server = fakeredis.FakeServer()
+    decoded = fakeredis.FakeRedis(server=server, decode_responses=True)
+    binary = fakeredis.FakeRedis(server=server)
+
+    import daily_limit_manager
+    import task_manager
+    import upload_store
+    monkeypatch.setattr(task_manager.task_manager, 'redis_client', binary)
+    monkeypatch.setattr(daily_limit_manager.daily_limit_manager, 'redis_client', decoded)
+    monkeypatch.setattr(upload_store.upload_store, 'redis_client', decoded)
+    return decoded
+
+
+@pytest.fixture
+def client(redis_server):
+    import app as app_module
+    return app_module.app.test_client()
@@ -0,0 +1,129 @@
+"""异步生成器"""
+import asyncio
+import base64
+import io
+import json
+import threading
+
+import httpx
+import pytest
+
+import ai_image_generator
+import async_ai_image_generator
+from conftest import PNG_BYTES
+from result_storage import name_from_url, result_storage
+
+
+def _run_with_transport(handler, coroutine_fn):
+    """在新的事件循环中运行，共享的 httpx 客户端改用 MockTransport"""
+    async def main():
+        loop = asyncio.get_running_loop()
+        async_ai_image_generator._http_clients[loop] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            return await coroutine_fn()
+        finally:
+            await async_ai_image_generator.close_async_http_client()
+    return asyncio.run(main())
+
+
+def _stored(result):
+    return result_storage.get(name_from_url(result['generated_image_url']))
+
+
+def _gemini_response(request):
+    return httpx.Response(200, content=json.dumps({"candidates": [{"content": {"parts": [
+        {"inlineData": {"mimeType": "image/png", "data": base64.b64encode(PNG_BYTES).decode('ascii')}}
+    ]}}]}).encode('utf-8'))
+
+
+def test_gemini_http_response_is_parsed_off_the_event_loop(monkeypatch):
+    loop_thread = threading.get_ident()
+    parse_threads = []
+    original_json = httpx.Response.json
+
+    def parse(self, **kwargs):
+        parse_threads.append(threading.get_ident())
+        return original_json(self, **kwargs)
+
+    monkeypatch.setattr(httpx.Response, 'json', parse)
+    generator = async_ai_image_generator.create_async_image_generator('gemini', 'key', None,
+                                                                      'https://proxy.example.com')
+
+    result = _run_with_transport(_gemini_response, lambda: generator.generate_image(None, 'a cat'))
+
+    assert result['success'] is True
+    assert parse_threads and loop_thread not in parse_threads
+    assert _stored(result) == PNG_BYTES
+
+
+def _b64_response(request):
+    return httpx.Response(200, content=json.dumps({"data": [
+        {"b64_json": base64.b64encode(image).decode('ascii')} for image in (PNG_BYTES, PNG_BYTES + b'\x01')
+    ]}).encode('utf-8'))
+
+
+def test_doubao_b64_json_is_written_off_the_event_loop(monkeypatch):
+    from inline_image_decoder import InlineImageExtractor
+
+    monkeypatch.setattr(ai_image_generator, 'DOUBAO_RESPONSE_FORMAT', 'b64_json')
+    loop_thread = threading.get_ident()
+    feed_threads = []
+    original_feed = InlineImageExtractor.feed
+
+    def feed(self, chunk):
+        feed_threads.append(threading.get_ident())
+        return original_feed(self, chunk)
+
+    monkeypatch.setattr(InlineImageExtractor, 'feed', feed)
+    generator = async_ai_image_generator.create_async_image_generator('doubao', 'key', None,
+                                                                      'https://proxy.example.com')
+
+    result = _run_with_transport(_b64_response, lambda: generator.generate_image(None, 'a cat'))
+
+    assert result['success'] is True
+    assert feed_threads and loop_thread not in feed_threads
+    assert _stored(result) == PNG_BYTES
+
+
+def _reference_png():
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), 'red').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def _without_url(result):
+    return {key: value for key, value in result.items() if key != 'generated_image_url'}
+
+
+@pytest.mark.parametrize('api_type,response_format', [('gemini', None), ('doubao', 'url'), ('doubao', 'b64_json')])
+def test_async_results_match_sync(api_type, response_format, monkeypatch):
+    from benchmark.mock_provider_server import MockProviderConfig, MockProviderServer
+    from mock_provider import LatencyModel
+
+    if response_format:
+        monkeypatch.setattr(ai_image_generator, 'DOUBAO_RESPONSE_FORMAT', response_format)
+    config = MockProviderConfig(latency=LatencyModel('fixed', 0), download_latency=LatencyModel('fixed', 0),
+                                image_width=16, image_height=16, image_pool_size=1)
+    with MockProviderServer(config) as server:
+        reference = _reference_png()
+        base_url = server.gemini_base_url if api_type == 'gemini' else server.doubao_base_url
+        sync_result = ai_image_generator.create_image_generator(api_type, 'key', None, base_url).generate_image(
+            reference, 'a cat')
+        generator = async_ai_image_generator.create_async_image_generator(api_type, 'key', None, base_url)
+
+        async def generate():
+            try:
+                return await async_ai_image_generator.generate_many(
+                    generator, [(reference, 'a cat'), (None, 'a dog')], concurrency=1)
+            finally:
+                await async_ai_image_generator.close_async_http_client()
+
+        async_results = asyncio.run(generate())
+
+    assert sync_result['success'] is True
+    assert _without_url(async_results[0]) == _without_url(sync_result)
+    assert 'a dog' in async_results[1]['description']
+    stored = [_stored(result) for result in (sync_result, *async_results)]
+    assert stored[0] == stored[1] == stored[2]
@@ -0,0 +1,57 @@
+"""POST /api/batch/generate：流式接收后不能再访问 request.form"""
+import io
+
+import pytest
+
+from conftest import PNG_BYTES
+
+
+@pytest.fixture
+def started(monkeypatch):
+    """记录后台任务的启动参数，不实际调用模型"""
+    import tasks
+    calls = []
+    monkeypatch.setattr(tasks, 'start_batch_in_background', lambda *args: calls.append(args))
+    return calls
+
+
+def post_batch(client, headers, **fields):
+    data = {'prompt': 'a cat', 'files': [(io.BytesIO(PNG_BYTES), f'{i}.png') for i in range(2)]}
+    data.update(fields)
+    return client.post('/api/batch/generate', data=data, headers={'X-Session-ID': 's1', **headers},
+                       content_type='multipart/form-data')
+
+
+def test_doubao_without_base_url_header(client, started):
+    response = post_batch(client, {'X-API-Key': 'k', 'X-API-Type': 'doubao'}, api_type='doubao')
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['task_data']['total_images'] == 2
+    # (session_id, task_id, fn, images_data, prompt, api_type, api_key, model_name, base_url)
+    assert started[0][5] == 'doubao'
+    assert started[0][-1] is None
+
+
+def test_base_url_from_ingested_form(client, started):
+    response = post_batch(client, {'X-API-Key': 'k', 'X-API-Type': 'doubao'},
+                          api_type='doubao', doubao_base_url='https://proxy.example.com/api/')
+    assert response.status_code == 200, response.get_json()
+    assert started[0][-1] == 'https://proxy.example.com/api'
+
+
+def test_bulk_mode_reads_ingested_form(client, started):
+    # 第三方 Gemini 接口（表单中的 base_url）不支持 bulk 模式
+    response = post_batch(client, {'X-API-Key': 'k', 'X-API-Type': 'gemini'},
+                          mode='bulk', gemini_base_url='https://proxy.example.com')
+    assert response.status_code == 400
+    assert 'bulk' in response.get_json()['error']
+
+    response = post_batch(client, {'X-API-Key': 'k', 'X-API-Type': 'gemini'}, mode='bulk')
+    assert response.status_code == 200, response.get_json()
+
+
+def test_rejects_non_image_file(client, started):
+    data = {'prompt': 'a cat', 'files': [(io.BytesIO(b'not an image' * 10), 'x.png')]}
+    response = client.post('/api/batch/generate', data=data,
+                           headers={'X-Session-ID': 's1', 'X-API-Type': 'mock'}, content_type='multipart/form-data')
+    assert response.status_code == 415
+    assert not started
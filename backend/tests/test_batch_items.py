@@ -0,0 +1,51 @@
+"""批量任务的图片提交和结果汇总（_run_batch_items）"""
+import tasks
+from task_manager import task_manager
+
+
+def test_record_failure_only_fails_that_item(redis_server, monkeypatch):
+    task_id, _ = task_manager.create_task('s1', [{'filename': f'generated_{i+1}.png'} for i in range(3)],
+                                          'a cat', 'mock')
+    original = task_manager.add_task_result
+    failures = []
+
+    def add_task_result(session_id, task_id, filename, result, index=None):
+        if index == 1 and not failures:
+            failures.append(index)
+            raise ConnectionError("redis down")
+        return original(session_id, task_id, filename, result, index=index)
+
+    monkeypatch.setattr(task_manager, 'add_task_result', add_task_result)
+
+    result = tasks.process_batch_generate_sync('s1', task_id, None, 'a cat', 3, 'mock', 'key')
+
+    assert result['success'] is True
+    assert (result['success_count'], result['failed_count']) == (2, 1)
+    items = task_manager.get_task('s1', task_id)['images']
+    assert [item['status'] for item in items] == ['completed', 'failed', 'completed']
+    assert items[1]['error'] == 'redis down'
+
+
+def test_cancel_midway_fails_unsubmitted_items(redis_server, monkeypatch):
+    total = tasks.BATCH_SUBMIT_WINDOW * 3
+    task_id, _ = task_manager.create_task('s1', [{'filename': f'generated_{i+1}.png'} for i in range(total)],
+                                          'a cat', 'mock')
+    original = tasks._generate_batch_item
+
+    def generate(session_id, task_id, index, *args):
+        if index == 2:
+            task_manager.cancel_task(session_id, task_id)
+        return original(session_id, task_id, index, *args)
+
+    monkeypatch.setattr(tasks, '_generate_batch_item', generate)
+
+    result = tasks.process_batch_generate_multi_prompt_sync('s1', task_id, None, ['a cat'] * total, 'mock', 'key')
+
+    assert result['cancelled'] is True
+    assert result['success_count'] + result['failed_count'] == total
+    task = task_manager.get_task('s1', task_id)
+    assert task['status'] == 'cancelled'
+    assert (task['processed_images'], task['progress']) == (total, 100.0)
+    statuses = [item['status'] for item in task_manager.get_items('s1', task_id, 0, total)]
+    assert 'pending' not in statuses
+    assert statuses.count('failed') >= total - tasks.BATCH_SUBMIT_WINDOW - 3
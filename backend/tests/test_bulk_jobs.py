@@ -0,0 +1,90 @@
+"""bulk 模式的批量作业"""
+from task_manager import task_manager
+
+
+def test_cancel_before_submit_fails_pending_items(redis_server):
+    from tasks import process_bulk_job_sync
+
+    images_data = [{'filename': f'{i}.png'} for i in range(3)]
+    task_id, _ = task_manager.create_task('s1', images_data, 'a cat', 'mock')
+    task_manager.cancel_task('s1', task_id)
+
+    result = process_bulk_job_sync('s1', task_id, [(i, f'{i}.png', None, 'a cat', False) for i in range(3)],
+                                   api_type='mock')
+
+    assert result['cancelled'] is True
+    assert result['failed_count'] == 3
+    items = task_manager.get_task('s1', task_id)['images']
+    assert [item['status'] for item in items] == ['failed'] * 3
+    assert all(item['error'] == '任务已取消' for item in items)
+
+
+def test_cancel_during_submit_cancels_job(redis_server):
+    from bulk_jobs import LocalBulkProvider
+    from tasks import process_bulk_job_sync
+
+    class CancelledWhileUploading(LocalBulkProvider):
+        cancelled_jobs = []
+
+        def submit(self, job_path, display_name):
+            job_id = super().submit(job_path, display_name)
+            task_manager.cancel_task('s1', task_id)
+            return job_id
+
+        def cancel(self, job_id):
+            self.cancelled_jobs.append(job_id)
+            super().cancel(job_id)
+
+    images_data = [{'filename': f'{i}.png'} for i in range(3)]
+    task_id, _ = task_manager.create_task('s1', images_data, 'a cat', 'mock')
+    provider = CancelledWhileUploading()
+
+    result = process_bulk_job_sync('s1', task_id, [(i, f'{i}.png', None, 'a cat', False) for i in range(3)],
+                                   api_type='mock', provider=provider, poll_initial=0.01, poll_max=0.01)
+
+    assert result['cancelled'] is True
+    task = task_manager.get_task('s1', task_id)
+    assert provider.cancelled_jobs == [task['bulk_job_id']]
+    assert task['status'] == 'cancelled'
+    assert [item['status'] for item in task['images']] == ['failed'] * 3
+
+
+class _FakeFiles:
+    def __init__(self):
+        self.uploaded = []
+        self.deleted = []
+
+    def upload(self, file, config=None):
+        self.uploaded.append(file.read())
+        name = f"files/{len(self.uploaded)}"
+        return type('File', (), {'name': name, 'uri': f"https://files.example.com/{name}"})()
+
+    def delete(self, name):
+        self.deleted.append(name)
+
+
+def test_gemini_reference_image_is_uploaded_once(tmp_path):
+    import io
+    import json
+
+    from bulk_jobs import GeminiBulkProvider
+    from conftest import PNG_BYTES
+
+    provider = GeminiBulkProvider('test-key', job_folder=str(tmp_path))
+    provider.client = type('Client', (), {'files': _FakeFiles()})()
+    f = io.StringIO()
+
+    for key in range(3):
+        provider.write_request(f, str(key), PNG_BYTES, 'a cat')
+    provider.write_request(f, '3', None, 'a dog')
+
+    assert provider.client.files.uploaded == [PNG_BYTES]
+    lines = [json.loads(line) for line in f.getvalue().splitlines()]
+    for line in lines[:3]:
+        assert line['request']['contents'][0]['parts'][1] == {
+            'file_data': {'mime_type': 'image/png', 'file_uri': 'https://files.example.com/files/1'}}
+    assert 'inline_data' not in f.getvalue()
+    assert len(lines[3]['request']['contents'][0]['parts']) == 1
+
+    provider.cleanup('batches/1')
+    assert provider.client.files.deleted == ['files/1']
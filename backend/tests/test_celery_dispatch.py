@@ -0,0 +1,83 @@
+"""BATCH_BACKEND=celery：批量任务逐张投递到 Celery 任务链"""
+import pytest
+
+import tasks
+from celery_config import celery_app
+from task_manager import task_manager
+
+
+@pytest.fixture
+def celery_backend(redis_server, monkeypatch):
+    """任务链在当前进程中同步执行，并记录投递的消息参数"""
+    monkeypatch.setattr(tasks, 'BATCH_BACKEND', 'celery')
+    monkeypatch.setattr(celery_app.conf, 'task_always_eager', True)
+    messages = []
+    original = tasks.generate_batch_item.s
+
+    def record(*args, **kwargs):
+        messages.append(args)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(tasks.generate_batch_item, 's', record)
+    return messages
+
+
+def test_batch_runs_through_celery_chain(celery_backend):
+    task_id, _ = task_manager.create_task('s1', [{'filename': f'generated_{i+1}.png'} for i in range(3)],
+                                          'a cat', 'mock')
+
+    result = tasks.process_batch_generate_sync('s1', task_id, None, 'a cat', 3, 'mock', 'secret-key', None,
+                                               'https://proxy.example.com')
+
+    assert result['success'] is True
+    assert result['dispatched_count'] == 3
+    assert len(celery_backend) == 3
+    for args in celery_backend:
+        assert 'secret-key' not in args
+        assert 'https://proxy.example.com' not in args
+    assert task_manager.get_credentials('s1', task_id) == {
+        'api_key': 'secret-key', 'base_url': 'https://proxy.example.com'}
+    task = task_manager.get_task('s1', task_id)
+    assert task['status'] == 'completed'
+    assert [item['status'] for item in task['images']] == ['completed'] * 3
+
+
+def test_cancelled_task_stops_dispatch(celery_backend):
+    task_id, _ = task_manager.create_task('s1', [{'filename': f'generated_{i+1}.png'} for i in range(3)],
+                                          'a cat', 'mock')
+    task_manager.cancel_task('s1', task_id)
+
+    result = tasks.process_batch_generate_sync('s1', task_id, None, 'a cat', 3, 'mock', 'secret-key')
+
+    assert result['cancelled'] is True
+    assert celery_backend == []
+
+
+def test_worker_fails_item_without_credentials(redis_server):
+    task_id, _ = task_manager.create_task('s1', [{'filename': 'generated_1.png'}], 'a cat', 'mock')
+
+    result = tasks.generate_batch_item.run('s1', task_id, 0, 'generated_1.png', None, 'a cat', 'mock')
+
+    assert result['success'] is False
+    assert result['filename'] == 'generated_1.png'
+
+
+def test_cancel_midway_fails_undispatched_items(celery_backend, monkeypatch):
+    task_id, _ = task_manager.create_task('s1', [{'filename': f'generated_{i+1}.png'} for i in range(5)],
+                                          'a cat', 'mock')
+    original = tasks.dispatch_batch_item
+
+    def dispatch(session_id, task_id, index, *args):
+        if index == 2:
+            task_manager.cancel_task(session_id, task_id)
+        return original(session_id, task_id, index, *args)
+
+    monkeypatch.setattr(tasks, 'dispatch_batch_item', dispatch)
+
+    result = tasks.process_batch_generate_sync('s1', task_id, None, 'a cat', 5, 'mock', 'secret-key')
+
+    assert result['cancelled'] is True
+    assert result['dispatched_count'] == 3
+    task = task_manager.get_task('s1', task_id)
+    assert [item['status'] for item in task['images']] == ['completed', 'completed', 'failed', 'failed', 'failed']
+    assert (task['status'], task['progress']) == ('cancelled', 100.0)
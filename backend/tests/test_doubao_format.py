@@ -0,0 +1,75 @@
+"""豆包 b64_json 被拒绝时改用 url 模式重试"""
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import ai_image_generator
+import async_ai_image_generator
+
+POLICY_ERROR = '{"error": {"code": "OutputImageSensitiveContentDetected", "message": "The request failed"}}'
+FORMAT_ERROR = '{"error": {"code": "InvalidParameter", "message": "The parameter `response_format` is not supported"}}'
+
+
+@pytest.fixture(autouse=True)
+def b64_json(monkeypatch):
+    monkeypatch.setattr(ai_image_generator, 'DOUBAO_RESPONSE_FORMAT', 'b64_json')
+    monkeypatch.setattr(ai_image_generator, '_DOUBAO_URL_ONLY_ENDPOINTS', set())
+    monkeypatch.setattr(async_ai_image_generator, '_DOUBAO_URL_ONLY_ENDPOINTS', set())
+
+
+class _Response:
+    request = None
+    content = b''
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    def close(self):
+        pass
+
+
+def _sync_formats(monkeypatch, status_code, text):
+    formats = []
+
+    def post(endpoint, **kwargs):
+        formats.append(kwargs['json']['response_format'])
+        return _Response(status_code, text)
+
+    monkeypatch.setattr(ai_image_generator.requests, 'post', post)
+    generator = ai_image_generator.create_image_generator('doubao', 'key')
+    result = generator.generate_image(None, 'a cat')
+    assert result['success'] is False
+    return formats
+
+
+def _async_formats(monkeypatch, status_code, text):
+    formats = []
+
+    def handler(request):
+        formats.append(json.loads(request.content)['response_format'])
+        return httpx.Response(status_code, text=text)
+
+    async def run():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        monkeypatch.setattr(async_ai_image_generator, 'get_async_http_client', lambda: client)
+        generator = async_ai_image_generator.create_async_image_generator('doubao', 'key')
+        try:
+            return await generator.generate_image(None, 'a cat')
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(run())['success'] is False
+    return formats
+
+
+@pytest.mark.parametrize('formats', [_sync_formats, _async_formats])
+def test_content_policy_error_is_not_retried(monkeypatch, formats):
+    assert formats(monkeypatch, 400, POLICY_ERROR) == ['b64_json']
+
+
+@pytest.mark.parametrize('formats', [_sync_formats, _async_formats])
+def test_unsupported_response_format_falls_back_to_url(monkeypatch, formats):
+    assert formats(monkeypatch, 400, FORMAT_ERROR) == ['b64_json', 'url']
@@ -0,0 +1,86 @@
+"""结果和上传目录的分层布局：平铺路径回退和迁移"""
+import os
+import time
+
+import pytest
+
+import file_layout
+
+
+def _write(path, data=b'data', age=0):
+    with open(path, 'wb') as f:
+        f.write(data)
+    if age:
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+
+
+def test_sharded_path_uses_two_level_directories(tmp_path):
+    path = file_layout.sharded_path(str(tmp_path), 'a.png')
+
+    relative = os.path.relpath(path, str(tmp_path)).split(os.sep)
+    assert len(relative) == 3 and relative[-1] == 'a.png'
+    assert all(len(part) == 2 for part in relative[:2])
+    assert os.path.isdir(os.path.dirname(path))
+    assert file_layout.sharded_path(str(tmp_path), 'a.png', create=False) == path
+
+
+def test_legacy_flat_file_is_still_resolved(tmp_path):
+    folder = str(tmp_path)
+    _write(os.path.join(folder, 'old.png'), b'old')
+
+    assert file_layout.resolve_path(folder, 'old.png') == os.path.join(folder, 'old.png')
+    assert file_layout.relative_path(folder, 'old.png') == 'old.png'
+    with file_layout.open_file(folder, 'old.png') as f:
+        assert f.read() == b'old'
+
+    # 分层路径优先
+    _write(file_layout.sharded_path(folder, 'old.png'), b'new')
+    with file_layout.open_file(folder, 'old.png') as f:
+        assert f.read() == b'new'
+
+    file_layout.remove_file(folder, 'old.png')
+    assert not os.path.exists(os.path.join(folder, 'old.png'))
+    with pytest.raises(FileNotFoundError):
+        file_layout.open_file(folder, 'old.png')
+    file_layout.remove_file(folder, 'old.png')
+
+
+def test_migrate_moves_only_old_files(tmp_path):
+    folder = str(tmp_path)
+    _write(os.path.join(folder, 'old.png'), b'old', age=3600)
+    _write(os.path.join(folder, 'recent.png'), b'recent')
+    _write(os.path.join(folder, '.tmp.part'), age=3600)
+    os.mkdir(os.path.join(folder, '.partial'))
+
+    stats = file_layout.migrate(folder, min_age=600)
+
+    assert stats == {'scanned': 2, 'moved': 1, 'skipped': 1}
+    assert file_layout.resolve_path(folder, 'old.png') == file_layout.sharded_path(folder, 'old.png', create=False)
+    with file_layout.open_file(folder, 'old.png') as f:
+        assert f.read() == b'old'
+    assert os.path.exists(os.path.join(folder, 'recent.png'))
+    assert os.path.exists(os.path.join(folder, '.tmp.part'))
+
+
+def test_migrate_keeps_flat_file_when_sharded_copy_exists(tmp_path):
+    folder = str(tmp_path)
+    _write(os.path.join(folder, 'a.png'), b'flat', age=3600)
+    _write(file_layout.sharded_path(folder, 'a.png'), b'sharded')
+
+    stats = file_layout.migrate(folder, min_age=0)
+
+    assert stats['skipped'] == 1 and stats['moved'] == 0
+    assert os.path.exists(os.path.join(folder, 'a.png'))
+
+
+def test_dry_run_moves_nothing(tmp_path):
+    folder = str(tmp_path)
+    _write(os.path.join(folder, 'a.png'), age=3600)
+
+    assert file_layout.main(['migrate', folder, '--min-age', '0', '--dry-run']) == 0
+    assert os.listdir(folder) == ['a.png']
+
+    assert file_layout.main(['migrate', folder, '--min-age', '0']) == 0
+    assert not os.path.exists(os.path.join(folder, 'a.png'))
+    assert os.path.exists(file_layout.sharded_path(folder, 'a.png', create=False))
@@ -0,0 +1,66 @@
+"""gunicorn 配置中的退出钩子"""
+import importlib.util
+import logging
+import os
+import types
+
+import pytest
+
+
+@pytest.fixture
+def conf():
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'gunicorn.conf.py')
+    spec = importlib.util.spec_from_file_location('gunicorn_conf', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_worker_exit_waits_only_for_the_rest_of_the_grace_period(conf, monkeypatch):
+    from scheduler import generation_scheduler
+
+    clock = [104.0]
+    monkeypatch.setattr(conf, 'time', types.SimpleNamespace(monotonic=lambda: clock[0]))
+    monkeypatch.setattr(conf, 'graceful_timeout', 10)
+    # 收到 SIGTERM 后等待请求完成用了 4 秒
+    monkeypatch.setattr(conf, '_term_received_at', 100.0)
+    waits = []
+
+    def shutdown(timeout=None):
+        waits.append(timeout)
+        return True
+
+    monkeypatch.setattr(generation_scheduler, 'shutdown', shutdown)
+    server = types.SimpleNamespace(log=logging.getLogger('gunicorn'))
+
+    conf.worker_exit(server, types.SimpleNamespace(pid=1))
+
+    assert waits == [6]
+
+
+def test_worker_exit_shares_one_deadline(conf, monkeypatch):
+    from result_writer import result_writer
+    from scheduler import generation_scheduler
+
+    clock = [104.0]
+    monkeypatch.setattr(conf, 'time', types.SimpleNamespace(monotonic=lambda: clock[0]))
+    monkeypatch.setattr(conf, 'graceful_timeout', 10)
+    monkeypatch.setattr(conf, '_term_received_at', 100.0)
+    waits = []
+
+    def shutdown(timeout=None):
+        waits.append(timeout)
+        clock[0] += 4
+        return True
+
+    def flush(timeout=None):
+        waits.append(timeout)
+        return True
+
+    monkeypatch.setattr(generation_scheduler, 'shutdown', shutdown)
+    monkeypatch.setattr(result_writer, 'flush', flush)
+    server = types.SimpleNamespace(log=logging.getLogger('gunicorn'))
+
+    conf.worker_exit(server, types.SimpleNamespace(pid=1))
+
+    assert waits == [6, 2]
@@ -0,0 +1,88 @@
+"""参考图预处理：缩放、重新编码和缓存"""
+import io
+
+import pytest
+from PIL import Image
+
+import image_preprocess
+from image_preprocess import ImagePreprocessor, process_image
+
+
+def _image_bytes(size, mode='RGB', image_format='JPEG', exif=None):
+    output = io.BytesIO()
+    kwargs = {'exif': exif} if exif is not None else {}
+    Image.new(mode, size, (200, 10, 10, 128) if mode == 'RGBA' else (200, 10, 10)).save(
+        output, format=image_format, **kwargs)
+    return output.getvalue()
+
+
+def _open(data):
+    return Image.open(io.BytesIO(data))
+
+
+def test_large_image_is_downscaled_to_max_dimension():
+    processed = _open(process_image(_image_bytes((3000, 2000)), 1536, 90))
+
+    assert processed.format == 'JPEG'
+    assert processed.size == (1536, 1024)
+
+
+def test_small_image_without_metadata_is_unchanged():
+    data = _image_bytes((64, 64), image_format='PNG')
+
+    assert process_image(data, 1536, 90) is data
+
+
+def test_transparent_image_stays_png():
+    processed = _open(process_image(_image_bytes((2000, 1000), mode='RGBA', image_format='PNG'), 1000, 90))
+
+    assert processed.format == 'PNG'
+    assert processed.mode == 'RGBA'
+    assert processed.size == (1000, 500)
+
+
+def test_exif_orientation_is_applied_and_metadata_removed():
+    exif = Image.Exif()
+    exif[0x0112] = 6  # 顺时针旋转 90 度显示
+    data = _image_bytes((200, 100), exif=exif.tobytes())
+
+    processed = _open(process_image(data, 1536, 90))
+
+    assert processed.size == (100, 200)
+    assert not processed.getexif()
+
+
+@pytest.fixture
+def preprocessor(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_preprocess, 'INPUT_PREPROCESS', True)
+    calls = []
+    original = image_preprocess.process_image
+
+    def counting(image_data, max_dimension, jpeg_quality):
+        calls.append(max_dimension)
+        return original(image_data, max_dimension, jpeg_quality)
+
+    monkeypatch.setattr(image_preprocess, 'process_image', counting)
+    preprocessor = ImagePreprocessor(workers=0, cache_folder=str(tmp_path / 'cache'))
+    preprocessor.calls = calls
+    return preprocessor
+
+
+def test_repeated_reference_is_processed_once(preprocessor, tmp_path):
+    data = _image_bytes((3000, 2000))
+
+    first = preprocessor.prepare(data, 'gemini')
+    second = preprocessor.prepare(data, 'gemini')
+
+    assert first == second
+    assert preprocessor.calls == [image_preprocess.INPUT_MAX_DIMENSION['gemini']]
+    assert len(list((tmp_path / 'cache').iterdir())) == 1
+    # 不同 API 的最大边长不同，分别缓存
+    preprocessor.prepare(data, 'doubao')
+    assert len(preprocessor.calls) == 2
+
+
+def test_unreadable_image_is_sent_unchanged(preprocessor):
+    data = b'not an image at all'
+
+    assert preprocessor.prepare(data, 'gemini') == data
@@ -0,0 +1,89 @@
+"""multipart 请求的流式接收"""
+import hashlib
+import io
+import os
+
+import pytest
+from werkzeug.test import EnvironBuilder
+
+from conftest import PNG_BYTES
+from ingest import IngestError, ingest_multipart
+
+
+def _environ(files, **fields):
+    data = dict(fields)
+    data['files'] = [(io.BytesIO(content), name) for name, content in files]
+    return EnvironBuilder(method='POST', data=data).get_environ()
+
+
+def _stored(folder):
+    return [name for _, _, names in os.walk(folder) for name in names]
+
+
+def test_files_are_written_with_hash_and_type(tmp_path):
+    environ = _environ([('a.png', PNG_BYTES), ('b.png', PNG_BYTES + b'\x01')], prompt='一只猫')
+
+    form, files = ingest_multipart(environ, upload_folder=str(tmp_path))
+
+    assert form['prompt'] == '一只猫'
+    assert [f.filename for f in files] == ['a.png', 'b.png']
+    with open(files[1].file_path, 'rb') as f:
+        assert f.read() == PNG_BYTES + b'\x01'
+    assert files[0].sha256 == hashlib.sha256(PNG_BYTES).hexdigest()
+    assert files[0].size == len(PNG_BYTES)
+    assert files[0].mime_type == 'image/png'
+
+
+def test_unsupported_extension_is_skipped(tmp_path):
+    form, files = ingest_multipart(_environ([('a.txt', b'hello'), ('b.png', PNG_BYTES)]),
+                                   upload_folder=str(tmp_path))
+    assert [f.filename for f in files] == ['b.png']
+
+
+def test_non_image_is_rejected_and_files_removed(tmp_path):
+    environ = _environ([('a.png', PNG_BYTES), ('b.png', b'GIF? no, just text')])
+
+    with pytest.raises(IngestError) as error:
+        ingest_multipart(environ, upload_folder=str(tmp_path))
+
+    assert error.value.status_code == 415
+    assert _stored(tmp_path) == []
+
+
+def test_file_size_limit(tmp_path):
+    environ = _environ([('a.png', PNG_BYTES + b'\x00' * 100)])
+
+    with pytest.raises(IngestError) as error:
+        ingest_multipart(environ, upload_folder=str(tmp_path), max_file_size=len(PNG_BYTES))
+
+    assert error.value.status_code == 413
+    assert _stored(tmp_path) == []
+
+
+def test_max_files(tmp_path):
+    environ = _environ([('a.png', PNG_BYTES), ('b.png', PNG_BYTES)])
+
+    with pytest.raises(IngestError) as error:
+        ingest_multipart(environ, upload_folder=str(tmp_path), max_files=1)
+
+    assert error.value.status_code == 400
+    assert _stored(tmp_path) == []
+
+
+def test_truncated_request(tmp_path):
+    environ = _environ([('a.png', PNG_BYTES)])
+    body = environ['wsgi.input'].read()
+    environ['wsgi.input'] = io.BytesIO(body[:len(body) // 2])
+    environ['CONTENT_LENGTH'] = str(len(body) // 2)
+
+    with pytest.raises(IngestError):
+        ingest_multipart(environ, upload_folder=str(tmp_path))
+    assert _stored(tmp_path) == []
+
+
+def test_requires_multipart(tmp_path):
+    environ = EnvironBuilder(method='POST', json={'prompt': 'a cat'}).get_environ()
+
+    with pytest.raises(IngestError) as error:
+        ingest_multipart(environ, upload_folder=str(tmp_path))
+    assert error.value.status_code == 400
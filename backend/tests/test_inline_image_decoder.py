@@ -0,0 +1,162 @@
+"""JSON 响应中内联 base64 图片的流式解码"""
+import base64
+import json
+import os
+
+import pytest
+
+import file_layout
+from conftest import PNG_BYTES
+from inline_image_decoder import InlineImageExtractor
+from result_storage import result_storage
+
+
+def _response(*images):
+    return json.dumps({"data": [{"b64_json": base64.b64encode(image).decode('ascii'), "size": "2048x2048"}
+                                for image in images]}).encode('utf-8')
+
+
+def _feed(extractor, body, chunk_size):
+    for start in range(0, len(body), chunk_size):
+        extractor.feed(body[start:start + chunk_size])
+    return json.loads(extractor.close())
+
+
+def _stored(name):
+    return os.path.exists(file_layout.resolve_path(result_storage.folder, name))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 64 * 1024])
+def test_images_are_decoded_to_storage(chunk_size):
+    jpeg = b'\xff\xd8\xff\xe0' + b'\x10' * 40
+    extractor = InlineImageExtractor(result_storage, "doubao")
+
+    data = _feed(extractor, _response(PNG_BYTES, jpeg), chunk_size)
+
+    names = [entry["b64_json"] for entry in data["data"]]
+    assert names == extractor.filenames
+    assert names[0].startswith("doubao_generated_") and names[0].endswith(".png")
+    assert names[1].endswith(".jpg")
+    assert [result_storage.get(name) for name in names] == [PNG_BYTES, jpeg]
+    assert data["data"][0]["size"] == "2048x2048"
+    assert extractor.bytes_received == len(_response(PNG_BYTES, jpeg))
+
+
+def test_json_escaped_slashes_are_decoded():
+    image = PNG_BYTES + b'\xff' * 30  # base64 中包含 "/"
+    encoded = base64.b64encode(image).decode('ascii')
+    assert '/' in encoded
+    body = ('{"data": [{"b64_json": "%s"}]}' % encoded.replace('/', '\\/')).encode('ascii')
+    extractor = InlineImageExtractor(result_storage, "doubao")
+
+    data = _feed(extractor, body, 3)
+
+    assert result_storage.get(data["data"][0]["b64_json"]) == image
+
+
+def test_truncated_response_removes_written_files():
+    extractor = InlineImageExtractor(result_storage, "doubao")
+    body = _response(PNG_BYTES, PNG_BYTES)
+    # 第一张图片已写完，响应在第二张图片中间结束
+    extractor.feed(body[:body.rindex(b'"b64_json"') + 40])
+    written = list(extractor.filenames)
+    assert len(written) == 1 and _stored(written[0])
+
+    with pytest.raises(ValueError):
+        extractor.close()
+    assert not _stored(written[0])
+
+
+def test_invalid_base64_is_rejected():
+    extractor = InlineImageExtractor(result_storage, "doubao")
+    with pytest.raises(ValueError):
+        extractor.feed(b'{"data": [{"b64_json": "iVBO*&^%"}]}')
+
+
+def test_spool_mode_writes_images_to_temp_files():
+    extractor = InlineImageExtractor(result_storage, "doubao", spool=True)
+
+    data = _feed(extractor, _response(PNG_BYTES, PNG_BYTES + b'\x01'), 5)
+
+    assert [entry["b64_json"] for entry in data["data"]] == [name for name, _ in extractor.images]
+    spooled = [open(path, 'rb').read() for _, path in extractor.images]
+    assert spooled == [PNG_BYTES, PNG_BYTES + b'\x01']
+    assert not any(_stored(name) for name in extractor.filenames)
+
+    for name, path in extractor.images:
+        assert result_storage.put_file(name, path) == result_storage.url(name)
+        assert not os.path.exists(path)
+    assert [result_storage.get(name) for name in extractor.filenames] == spooled
+
+
+def test_spool_mode_abort_removes_temp_files():
+    extractor = InlineImageExtractor(result_storage, "doubao", spool=True)
+    body = _response(PNG_BYTES, PNG_BYTES)
+    # 第一张图片已暂存，响应在第二张图片中间结束
+    extractor.feed(body[:body.rindex(b'"b64_json"') + 40])
+    spooled = [path for _, path in extractor.images]
+    assert len(spooled) == 1 and os.path.exists(spooled[0])
+
+    with pytest.raises(ValueError):
+        extractor.close()
+    assert extractor.images == []
+    assert not os.path.exists(spooled[0])
+
+
+class _StreamedResponse:
+    status_code = 200
+    request = None
+
+    def __init__(self, body):
+        self.body = body
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+def test_doubao_b64_json_goes_through_result_writer(monkeypatch):
+    import ai_image_generator
+    from result_writer import result_writer, wait_persisted, PENDING_WRITE_KEY
+
+    monkeypatch.setattr(ai_image_generator, 'DOUBAO_RESPONSE_FORMAT', 'b64_json')
+    monkeypatch.setattr(ai_image_generator.requests, 'post',
+                        lambda *args, **kwargs: _StreamedResponse(_response(PNG_BYTES)))
+    submitted = []
+
+    original_submit = result_writer.submit_file
+
+    def submit(name, path, content_type=None):
+        submitted.append(name)
+        return original_submit(name, path, content_type)
+
+    monkeypatch.setattr(result_writer, 'submit_file', submit)
+    generator = ai_image_generator.create_image_generator('doubao', 'key', None, 'https://proxy.example.com',
+                                                          write_behind=True)
+
+    result = generator.generate_image(None, 'a cat')
+
+    assert result['success'] is True
+    assert PENDING_WRITE_KEY in result
+    result = wait_persisted(result)
+    assert result['success'] is True
+    assert len(submitted) == 1
+    assert result['generated_image_url'] == result_storage.url(submitted[0])
+    assert result_storage.get(submitted[0]) == PNG_BYTES
+
+
+@pytest.mark.parametrize('spool', [False, True])
+def test_images_beyond_max_images_are_not_written(spool):
+    extractor = InlineImageExtractor(result_storage, "doubao", spool=spool, max_images=1)
+
+    data = _feed(extractor, _response(PNG_BYTES, PNG_BYTES + b'\x01'), 7)
+
+    assert len(extractor.filenames) == 1
+    assert data["data"][0]["b64_json"] == extractor.filenames[0]
+    assert data["data"][1]["b64_json"] is None
+    assert data["data"][1]["size"] == "2048x2048"
+    assert len(extractor.images) == (1 if spool else 0)
+    extractor.abort()
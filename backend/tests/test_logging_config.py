@@ -0,0 +1,64 @@
+"""日志配置：隐去 API Key、采样和非阻塞入队"""
+import json
+import logging
+import queue
+
+import pytest
+
+from logging_config import JsonFormatter, NonBlockingQueueHandler, RedactingFilter, SamplingFilter, redact
+
+
+def _record(msg, level=logging.INFO, **extra):
+    return logging.makeLogRecord({'name': 'tasks', 'levelno': level, 'levelname': logging.getLevelName(level),
+                                  'msg': msg, **extra})
+
+
+@pytest.mark.parametrize('text,expected', [
+    ('key AIzaSyA1234567890abcdefghijklmn used', 'key *** used'),
+    ('token sk-abcdefghijklmnop1234', 'token ***'),
+    ('Authorization: Bearer abc.def.ghi', 'Authorization: Bearer ***'),
+    ('GET /v1?api_key=abc123&x=1', 'GET /v1?api_key=***&x=1'),
+    ('{"X-API-Key": "abc123"}', '{"X-API-Key": "***"}'),
+    ('nothing secret here', 'nothing secret here'),
+])
+def test_redact(text, expected):
+    assert redact(text) == expected
+
+
+def test_redacting_filter_hides_secret_fields_and_messages():
+    record = _record('calling with sk-abcdefghijklmnop1234', api_key='plain-key', base_url='https://x?api_key=abc',
+                     task_id='t1')
+
+    assert RedactingFilter().filter(record) is True
+
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry['msg'] == 'calling with ***'
+    assert entry['api_key'] == '***'
+    assert entry['base_url'] == 'https://x?api_key=***'
+    assert entry['task_id'] == 't1'
+
+
+def test_sampling_filter_keeps_unsampled_and_warnings():
+    dropping = SamplingFilter(0)
+
+    assert dropping.filter(_record('per item', logging.DEBUG, sampled=True)) is False
+    assert dropping.filter(_record('per item', logging.WARNING, sampled=True)) is True
+    assert dropping.filter(_record('batch done')) is True
+    assert SamplingFilter(1).filter(_record('per item', logging.DEBUG, sampled=True)) is True
+
+
+def test_full_queue_drops_without_blocking_and_reports():
+    log_queue = queue.Queue(maxsize=2)
+    handler = NonBlockingQueueHandler(log_queue)
+
+    for msg in ('first', 'second', 'dropped'):
+        handler.emit(_record(msg))
+    assert handler.dropped == 1
+
+    log_queue.get_nowait()
+    log_queue.get_nowait()
+    handler.emit(_record('third'))
+    assert log_queue.get_nowait().msg == 'third'
+    notice = log_queue.get_nowait()
+    assert (notice.levelno, notice.dropped) == (logging.WARNING, 1)
+    assert handler.dropped == 0
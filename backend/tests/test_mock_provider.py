@@ -0,0 +1,54 @@
+"""进程内 Mock provider：延迟分布和注入失败"""
+import pytest
+
+import ai_image_generator
+from mock_provider import LatencyModel, parse_image_size
+
+
+def test_latency_model_parse_and_cap():
+    model = LatencyModel.parse('uniform:100:0.5:120')
+
+    samples = [model.sample() for _ in range(200)]
+
+    assert (model.distribution, model.mean_ms, model.spread, model.max_ms) == ('uniform', 100.0, 0.5, 120.0)
+    assert all(0.05 <= sample <= 0.12 for sample in samples)
+    assert LatencyModel.parse('fixed:250').sample() == 0.25
+
+
+def test_latency_model_rejects_unknown_distribution():
+    with pytest.raises(ValueError):
+        LatencyModel.parse('normal:100')
+
+
+def test_parse_image_size():
+    assert parse_image_size('1024X768') == (1024, 768)
+
+
+def _generator(monkeypatch, failure_rate, latency='fixed:30'):
+    monkeypatch.setattr(ai_image_generator, 'MOCK_LATENCY', latency)
+    monkeypatch.setattr(ai_image_generator, 'MOCK_IMAGE_SIZE', '8x8')
+    monkeypatch.setattr(ai_image_generator, 'MOCK_FAILURE_RATE', failure_rate)
+    slept = []
+    monkeypatch.setattr(ai_image_generator.time, 'sleep', slept.append)
+    return ai_image_generator.create_image_generator('mock'), slept
+
+
+def test_mock_generation_sleeps_sampled_latency(monkeypatch):
+    generator, slept = _generator(monkeypatch, 0)
+
+    result = generator.generate_image(None, 'a cat')
+
+    assert result['success'] is True
+    assert result['api_type'] == 'mock'
+    assert result['generated_image_url'].rsplit('/', 1)[-1].startswith('mock_generated_')
+    assert slept == [0.03]
+
+
+def test_mock_generation_injects_failures(monkeypatch):
+    generator, slept = _generator(monkeypatch, 1.0)
+
+    result = generator.generate_image(None, 'a cat')
+
+    assert result['success'] is False
+    assert ai_image_generator.MOCK_FAILURE_ERROR in result['error']
+    assert slept == [0.03]
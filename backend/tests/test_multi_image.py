@@ -0,0 +1,78 @@
+"""同一 prompt 的批量任务使用组图请求"""
+import pytest
+
+import ai_image_generator
+import tasks
+from task_manager import task_manager
+
+CALLS_PER_GROUP = ai_image_generator.images_per_call('mock')
+
+
+class _MockCalls:
+    """Mock 组图请求的图片数；returned 为每次请求最多返回的图片数（None 表示按请求返回）"""
+
+    def __init__(self):
+        self.calls = []
+        self.returned = None
+
+
+@pytest.fixture
+def mock_calls(monkeypatch):
+    recorded = _MockCalls()
+    original = ai_image_generator.AIImageGenerator._generate_many_with_mock
+
+    def generate_many(self, image_data, prompt, count):
+        recorded.calls.append(count)
+        results = original(self, image_data, prompt, count)
+        return results if recorded.returned is None else results[:recorded.returned]
+
+    monkeypatch.setattr(ai_image_generator.AIImageGenerator, '_generate_many_with_mock', generate_many)
+    return recorded
+
+
+def _run(total):
+    task_id, _ = task_manager.create_task('s1', [{'filename': f'generated_{i+1}.png'} for i in range(total)],
+                                          'a cat', 'mock')
+    result = tasks.process_batch_generate_sync('s1', task_id, None, 'a cat', total, 'mock', 'key')
+    return result, task_manager.get_task('s1', task_id)
+
+
+def test_same_prompt_batch_uses_group_requests(redis_server, mock_calls):
+    total = CALLS_PER_GROUP + 2
+
+    result, task = _run(total)
+
+    assert sorted(mock_calls.calls, reverse=True) == [CALLS_PER_GROUP, 2]
+    assert (result['success_count'], result['failed_count']) == (total, 0)
+    assert [item['status'] for item in task['images']] == ['completed'] * total
+    urls = [item['result_url'] for item in task['images']]
+    assert len(set(urls)) == total
+
+
+def test_missing_group_images_fall_back_to_single_requests(redis_server, mock_calls):
+    mock_calls.returned = 1
+    total = CALLS_PER_GROUP
+
+    result, task = _run(total)
+
+    # 组图请求只返回 1 张，其余条目逐张生成（每次请求 1 张）
+    assert mock_calls.calls[0] == CALLS_PER_GROUP
+    assert mock_calls.calls[1:] == [1] * (total - 1)
+    assert result['success_count'] == total
+    assert [item['status'] for item in task['images']] == ['completed'] * total
+
+
+def test_doubao_group_request_returns_every_image(monkeypatch):
+    from benchmark.mock_provider_server import MockProviderConfig, MockProviderServer
+    from mock_provider import LatencyModel
+
+    config = MockProviderConfig(latency=LatencyModel('fixed', 0), download_latency=LatencyModel('fixed', 0),
+                                image_width=16, image_height=16)
+    with MockProviderServer(config) as server:
+        generator = ai_image_generator.create_image_generator('doubao', 'key', None, server.doubao_base_url)
+        results = generator.generate_images(None, 'a cat', 3)
+        stats = server.stats()
+
+    assert [result['success'] for result in results] == [True] * 3
+    assert len({result['generated_image_url'] for result in results}) == 3
+    assert stats['doubao_requests'] == 1
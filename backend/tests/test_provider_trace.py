@@ -0,0 +1,71 @@
+"""模型调用流量的记录和回放"""
+import json
+
+import pytest
+
+import ai_image_generator
+import provider_trace
+from benchmark.mock_provider_server import MockProviderConfig, MockProviderServer
+from benchmark.replay import load_trace, replay
+from mock_provider import LatencyModel
+
+
+@pytest.fixture
+def server():
+    config = MockProviderConfig(latency=LatencyModel('fixed', 0), download_latency=LatencyModel('fixed', 0),
+                                image_width=16, image_height=16)
+    with MockProviderServer(config) as server:
+        yield server
+
+
+def test_doubao_call_is_recorded_without_secrets(server, tmp_path, monkeypatch):
+    trace_path = tmp_path / 'trace.jsonl'
+    monkeypatch.setattr(provider_trace, '_recorder', provider_trace.ProviderTraceRecorder(str(trace_path)))
+    monkeypatch.setattr(ai_image_generator, 'DOUBAO_RESPONSE_FORMAT', 'url')
+    generator = ai_image_generator.create_image_generator('doubao', 'secret-key', None, server.doubao_base_url)
+
+    result = generator.generate_image(None, 'a secret prompt')
+
+    assert result['success'] is True
+    text = trace_path.read_text(encoding='utf-8')
+    assert 'secret' not in text
+    entries = [json.loads(line) for line in text.splitlines()]
+    assert [entry['op'] for entry in entries] == ['generate', 'download']
+    assert entries[0]['cid'] == entries[1]['cid']
+    assert all(entry['status'] == 200 and entry['err'] is None for entry in entries)
+    assert entries[1]['resp'] > 0
+
+
+def test_classify_errors():
+    assert provider_trace.classify_status(200) is None
+    assert provider_trace.classify_status(429) == 'http_429'
+    assert provider_trace.classify_status(404) == 'http_4xx'
+    assert provider_trace.classify_status(503) == 'http_5xx'
+    assert provider_trace.classify_exception(TimeoutError()) == 'timeout'
+    assert provider_trace.classify_exception(ConnectionError()) == 'connection'
+
+
+def _trace_line(cid, t, op, status, err=None, ms=5.0):
+    return json.dumps({'t': t, 'cid': cid, 'api': 'doubao', 'model': 'm', 'op': op, 'ms': ms,
+                       'status': status, 'req': 100, 'resp': 2000, 'err': err})
+
+
+def test_replay_reproduces_recorded_status(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(ai_image_generator, 'DOUBAO_RESPONSE_FORMAT', 'url')
+    trace_path = tmp_path / 'trace.jsonl'
+    trace_path.write_text('\n'.join([
+        _trace_line('b', 2.0, 'generate', 429, 'http_429'),
+        _trace_line('a', 1.0, 'generate', 200),
+        _trace_line('a', 1.5, 'download', 200),
+        'not json',
+        json.dumps({'t': 3.0, 'cid': 'c', 'api': 'mock', 'op': 'generate'}),
+    ]) + '\n', encoding='utf-8')
+
+    calls = load_trace(str(trace_path))
+    report = replay(calls, server, speedup=100, concurrency=2)
+
+    assert [call['cid'] for call in calls] == ['a', 'b']
+    assert 'download' in calls[0]
+    assert (report['calls'], report['failed']) == (2, 1)
+    assert report['recorded_errors'] == {'generate:http_429': 1}
+    assert server.stats().get('replay_http_429') == 1
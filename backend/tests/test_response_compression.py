@@ -0,0 +1,87 @@
+"""JSON 响应的 gzip / br 协商压缩"""
+import gzip
+import json
+
+import pytest
+from flask import Flask, jsonify
+
+import response_compression
+from response_compression import ResponseCompressor
+
+PAYLOAD = {'tasks': [{'task_id': f'task-{i}', 'status': 'completed', 'prompt': 'a cat'} for i in range(100)]}
+
+
+def _client(encodings='br,gzip', min_bytes=1024):
+    app = Flask(__name__)
+    compressor = ResponseCompressor(encodings, min_bytes)
+    compressor.init_app(app)
+
+    @app.route('/api/tasks')
+    def tasks():
+        return jsonify(PAYLOAD)
+
+    @app.route('/api/small')
+    def small():
+        return jsonify({'success': True})
+
+    @app.route('/api/text')
+    def text():
+        return 'x' * 4096
+
+    @app.route('/static/results/a.json')
+    def static_json():
+        return jsonify(PAYLOAD)
+
+    return app.test_client(), compressor
+
+
+def test_gzip_when_only_gzip_is_accepted():
+    client, compressor = _client()
+
+    response = client.get('/api/tasks', headers={'Accept-Encoding': 'gzip'})
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert json.loads(gzip.decompress(response.data)) == PAYLOAD
+    stats = compressor.stats()['compressed']['gzip']
+    assert stats['responses'] == 1 and stats['bytes_out'] < stats['bytes_in']
+
+
+def test_brotli_preferred_at_equal_weight():
+    brotli = pytest.importorskip('brotli')
+    client, _ = _client()
+
+    response = client.get('/api/tasks', headers={'Accept-Encoding': 'gzip, deflate, br'})
+
+    assert response.headers['Content-Encoding'] == 'br'
+    assert json.loads(brotli.decompress(response.data)) == PAYLOAD
+
+
+def test_client_weights_win_over_server_order():
+    client, _ = _client()
+
+    response = client.get('/api/tasks', headers={'Accept-Encoding': 'br;q=0.5, gzip;q=1.0'})
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+
+
+@pytest.mark.parametrize('path,accept', [
+    ('/api/tasks', None),
+    ('/api/tasks', 'identity'),
+    ('/api/small', 'gzip'),
+    ('/api/text', 'gzip'),
+    ('/static/results/a.json', 'gzip'),
+])
+def test_responses_left_uncompressed(path, accept):
+    client, _ = _client()
+    headers = {'Accept-Encoding': accept} if accept else {}
+
+    response = client.get(path, headers=headers)
+
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_brotli_ignored_when_not_installed(monkeypatch):
+    monkeypatch.setattr(response_compression, 'brotli', None)
+
+    assert ResponseCompressor('br,gzip').encodings == ['gzip']
@@ -0,0 +1,107 @@
+"""结果存储：S3 分段上传和本地存储"""
+import pytest
+
+from result_storage import LocalResultStorage, S3ResultStorage, _S3MultipartWriter
+
+PART_SIZE = 16
+
+
+class _FakeS3:
+    """记录调用的 S3 客户端"""
+
+    def __init__(self, fail_part=None):
+        self.calls = []
+        self.objects = {}
+        self.fail_part = fail_part
+        self._uploads = {}
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        self.calls.append('put_object')
+        self.objects[Key] = Body
+
+    def create_multipart_upload(self, Bucket, Key, ContentType):
+        self.calls.append('create_multipart_upload')
+        self._uploads['u1'] = {}
+        return {'UploadId': 'u1'}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.calls.append(('upload_part', PartNumber, len(Body)))
+        if PartNumber == self.fail_part:
+            raise ConnectionError("upload failed")
+        self._uploads[UploadId][PartNumber] = Body
+        return {'ETag': f'etag-{PartNumber}'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.calls.append('complete_multipart_upload')
+        parts = self._uploads.pop(UploadId)
+        assert [part['PartNumber'] for part in MultipartUpload['Parts']] == sorted(parts)
+        self.objects[Key] = b''.join(parts[number] for number in sorted(parts))
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.calls.append('abort_multipart_upload')
+        self._uploads.pop(UploadId)
+
+
+def _writer(client):
+    return _S3MultipartWriter(client, 'bucket', 'results/a.png', 'image/png', PART_SIZE)
+
+
+def test_small_file_uses_single_put():
+    client = _FakeS3()
+
+    with _writer(client) as writer:
+        writer.write(b'x' * 10)
+
+    assert client.calls == ['put_object']
+    assert client.objects['results/a.png'] == b'x' * 10
+
+
+def test_large_file_is_uploaded_in_parts_and_completed():
+    client = _FakeS3()
+    data = bytes(range(40))
+
+    with _writer(client) as writer:
+        for start in range(0, len(data), 7):
+            writer.write(data[start:start + 7])
+
+    assert client.calls == ['create_multipart_upload', ('upload_part', 1, 16), ('upload_part', 2, 16),
+                            ('upload_part', 3, 8), 'complete_multipart_upload']
+    assert client.objects['results/a.png'] == data
+
+
+def test_failure_aborts_multipart_upload():
+    client = _FakeS3(fail_part=2)
+
+    with pytest.raises(ConnectionError):
+        with _writer(client) as writer:
+            writer.write(b'x' * 40)
+
+    assert client.calls[-1] == 'abort_multipart_upload'
+    assert 'complete_multipart_upload' not in client.calls
+    assert client.objects == {}
+
+
+def test_s3_storage_urls():
+    storage = S3ResultStorage(bucket='bucket', prefix='results/', public_base_url='https://cdn.example.com')
+
+    assert storage.key('a.png') == 'results/a.png'
+    assert storage.url('a.png') == 'https://cdn.example.com/results/a.png'
+    assert S3ResultStorage(bucket='bucket').url('a.png') == '/static/results/a.png'
+    with pytest.raises(ValueError):
+        storage.key('../a.png')
+
+
+def test_local_writer_commits_atomically(tmp_path):
+    storage = LocalResultStorage(str(tmp_path))
+
+    writer = storage.open_writer('a.png')
+    writer.write(b'partial')
+    with pytest.raises(FileNotFoundError):
+        storage.get('a.png')
+    writer.commit()
+
+    assert storage.get('a.png') == b'partial'
+    assert storage.put('b.png', b'data') == '/static/results/b.png'
+    storage.delete('a.png')
+    with pytest.raises(FileNotFoundError):
+        storage.get('a.png')
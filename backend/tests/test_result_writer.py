@@ -0,0 +1,138 @@
+"""生成结果的后台写入"""
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from result_writer import PENDING_WRITE_KEY, ResultWriterPool, wait_persisted, when_persisted
+
+
+class _Storage:
+    """记录写入的内存存储，gate 未放行时写入阻塞"""
+
+    def __init__(self, fail=()):
+        self.files = {}
+        self.fail = set(fail)
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def put(self, name, data, content_type=None):
+        self.gate.wait(5)
+        if name in self.fail:
+            raise OSError("disk full")
+        self.files[name] = data
+        return f"/static/results/{name}"
+
+
+def test_submit_writes_in_background_and_flush_waits():
+    storage = _Storage()
+    storage.gate.clear()
+    pool = ResultWriterPool(storage, workers=2, max_pending=4)
+    futures = [pool.submit(f'{i}.png', b'x') for i in range(3)]
+
+    assert pool.stats()['pending'] == 3
+    assert pool.flush(timeout=0.05) is False
+    storage.gate.set()
+
+    assert pool.flush(timeout=5) is True
+    assert [future.result() for future in futures] == [f'/static/results/{i}.png' for i in range(3)]
+    stats = pool.stats()
+    assert (stats['pending'], stats['failed'], stats['write']['count']) == (0, 0, 3)
+
+
+def test_submit_blocks_when_pending_limit_reached():
+    storage = _Storage()
+    storage.gate.clear()
+    pool = ResultWriterPool(storage, workers=1, max_pending=1)
+    pool.submit('a.png', b'a')
+    submitted = threading.Event()
+
+    def submit():
+        pool.submit('b.png', b'b')
+        submitted.set()
+
+    thread = threading.Thread(target=submit)
+    thread.start()
+    assert not submitted.wait(0.1)
+
+    storage.gate.set()
+    assert submitted.wait(5)
+    thread.join()
+    assert pool.flush(timeout=5)
+    assert set(storage.files) == {'a.png', 'b.png'}
+    assert pool.stats()['backpressure']['count'] == 1
+
+
+def test_failed_write_marks_result_failed():
+    pool = ResultWriterPool(_Storage(fail={'a.png'}), workers=1, max_pending=1)
+    result = {'success': True, 'generated_image_url': '/static/results/a.png',
+              PENDING_WRITE_KEY: pool.submit('a.png', b'a')}
+
+    result = wait_persisted(result)
+
+    assert result['success'] is False
+    assert 'generated_image_url' not in result
+    assert 'disk full' in result['error']
+    assert pool.stats()['failed'] == 1
+
+
+def test_disabled_pool_writes_synchronously():
+    storage = _Storage()
+    pool = ResultWriterPool(storage, enabled=False)
+
+    future = pool.submit('a.png', b'a')
+
+    assert future.done() and storage.files == {'a.png': b'a'}
+    assert pool.stats()['pending'] == 0
+
+
+def test_when_persisted_without_pending_write_calls_back_directly():
+    assert when_persisted({'success': False}, lambda result: 'recorded') == 'recorded'
+
+
+def test_when_persisted_runs_callback_after_write():
+    write = Future()
+    recorded = []
+    done = when_persisted({'success': True, PENDING_WRITE_KEY: write}, lambda result: recorded.append(result) or 1)
+
+    assert isinstance(done, Future) and not done.done()
+    write.set_result('/static/results/a.png')
+
+    assert done.result(5) == 1
+    assert recorded == [{'success': True}]
+
+
+def test_when_persisted_propagates_callback_errors():
+    write = Future()
+
+    def record(result):
+        raise ConnectionError("redis down")
+
+    done = when_persisted({'success': True, PENDING_WRITE_KEY: write}, record)
+    write.set_result('/static/results/a.png')
+
+    with pytest.raises(ConnectionError):
+        done.result(5)
+
+
+def test_flush_waits_for_recording_callback():
+    storage = _Storage()
+    storage.gate.clear()
+    pool = ResultWriterPool(storage, workers=1, max_pending=1)
+    recording = threading.Event()
+    release = threading.Event()
+    recorded = []
+
+    def record(result):
+        recording.set()
+        release.wait(5)
+        recorded.append(result)
+
+    when_persisted({'success': True, PENDING_WRITE_KEY: pool.submit('a.png', b'a')}, record)
+    storage.gate.set()
+    assert recording.wait(5)
+
+    assert pool.flush(timeout=0.05) is False
+    release.set()
+    assert pool.flush(timeout=5) is True
+    assert recorded == [{'success': True}]
@@ -0,0 +1,66 @@
+"""生成任务公平调度器"""
+import threading
+
+import pytest
+
+from scheduler import FairScheduler, JobPriority, SchedulerShutdown
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = FairScheduler(max_workers=1)
+    yield scheduler
+    scheduler.shutdown(timeout=5)
+
+
+def _block(scheduler):
+    """占住唯一的生成线程，返回放行用的 Event"""
+    release = threading.Event()
+    started = threading.Event()
+
+    def run():
+        started.set()
+        release.wait(5)
+
+    scheduler.submit('blocker', run)
+    assert started.wait(5)
+    return release
+
+
+def test_sessions_take_turns_and_interactive_goes_first(scheduler):
+    release = _block(scheduler)
+    order = []
+    futures = [scheduler.submit('a', order.append, f'a{i}') for i in range(3)]
+    futures += [scheduler.submit('b', order.append, f'b{i}') for i in range(2)]
+    futures.append(scheduler.submit('c', order.append, 'c0', priority=JobPriority.INTERACTIVE))
+    assert scheduler.queue_depths('a') == {'interactive': 0, 'batch': 3, 'running': 0}
+
+    release.set()
+    for future in futures:
+        future.result(5)
+
+    assert order == ['c0', 'a0', 'b0', 'a1', 'b1', 'a2']
+
+
+def test_job_exception_is_returned_through_future(scheduler):
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        scheduler.submit('a', fail).result(5)
+    assert scheduler.submit('a', lambda: 1).result(5) == 1
+
+
+def test_shutdown_fails_queued_jobs_and_rejects_new_ones(scheduler):
+    release = _block(scheduler)
+    queued = scheduler.submit('a', lambda: 1)
+
+    assert scheduler.shutdown(wait=False) is False
+    with pytest.raises(SchedulerShutdown):
+        queued.result(5)
+    with pytest.raises(SchedulerShutdown):
+        scheduler.submit('a', lambda: 1)
+
+    release.set()
+    assert scheduler.shutdown(timeout=5) is True
+    assert scheduler.stats()['running'] == 0
@@ -0,0 +1,56 @@
+"""任务的增量变化接口"""
+from task_manager import task_manager
+
+HEADERS = {'X-Session-ID': 's1'}
+
+
+def _create(count=3):
+    task_id, _ = task_manager.create_task('s1', [{'filename': f'{i}.png'} for i in range(count)], 'a cat', 'mock')
+    return task_id
+
+
+def _result(task_id, index, success=True):
+    result = {'success': success, 'generated_image_url': f'/static/results/{index}.png', 'error': 'boom'}
+    task_manager.add_task_result('s1', task_id, f'{index}.png', result, index=index)
+
+
+def test_changes_since_version_returns_only_changed_items(redis_server):
+    task_id = _create()
+    since = task_manager.get_changes('s1', task_id, 0)['version']
+
+    _result(task_id, 2)
+    _result(task_id, 0, success=False)
+    changes = task_manager.get_changes('s1', task_id, since)
+
+    assert changes['resync'] is False
+    assert [(item['filename'], item['status']) for item in changes['items']] == [('0.png', 'failed'), ('2.png', 'completed')]
+    assert changes['version'] > since
+
+    unchanged = task_manager.get_changes('s1', task_id, changes['version'])
+    assert unchanged == {'version': changes['version'], 'resync': False, 'items': []}
+
+
+def test_future_or_stale_version_requires_resync(redis_server):
+    task_id = _create()
+    version = task_manager.get_task_version('s1', task_id)
+
+    assert task_manager.get_changes('s1', task_id, version + 10)['resync'] is True
+    assert task_manager.get_changes('s1', task_id, -1)['resync'] is True
+    assert task_manager.get_changes('s1', 'missing', 0) is None
+
+
+def test_changes_endpoint(client):
+    task_id = _create()
+    version = client.get(f'/api/batch/tasks/{task_id}', headers=HEADERS).get_json()['version']
+    _result(task_id, 1)
+
+    response = client.get(f'/api/batch/tasks/{task_id}/changes?since={version}', headers=HEADERS)
+
+    body = response.get_json()
+    assert response.status_code == 200
+    assert [item['filename'] for item in body['items']] == ['1.png']
+    # 摘要中不包含图片条目
+    assert body['task']['task_id'] == task_id
+    assert 'images' not in body['task']
+    assert client.get(f'/api/batch/tasks/{task_id}/changes?since=x', headers=HEADERS).status_code == 400
+    assert client.get('/api/batch/tasks/missing/changes?since=0', headers=HEADERS).status_code == 404
@@ -0,0 +1,70 @@
+"""任务接口的 ETag / 304"""
+from task_manager import task_manager
+
+HEADERS = {'X-Session-ID': 's1'}
+
+
+def _create():
+    task_id, _ = task_manager.create_task('s1', [{'filename': f'{i}.png'} for i in range(2)], 'a cat', 'mock')
+    return task_id
+
+
+def _get(client, url, etag=None):
+    headers = dict(HEADERS)
+    if etag:
+        headers['If-None-Match'] = etag
+    return client.get(url, headers=headers)
+
+
+def test_task_detail_not_modified_until_task_changes(client):
+    task_id = _create()
+    url = f'/api/batch/tasks/{task_id}'
+
+    first = _get(client, url)
+    etag = first.headers['ETag']
+    assert first.status_code == 200
+    assert _get(client, url, etag).status_code == 304
+
+    task_manager.add_task_result('s1', task_id, '0.png', {'success': True, 'generated_image_url': '/r.png'}, index=0)
+
+    changed = _get(client, url, etag)
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert changed.get_json()['task']['images'][0]['status'] == 'completed'
+
+
+def test_views_of_same_version_use_different_etags(client):
+    task_id = _create()
+
+    full = _get(client, f'/api/batch/tasks/{task_id}').headers['ETag']
+    summary = _get(client, f'/api/batch/tasks/{task_id}?view=summary').headers['ETag']
+    status = _get(client, f'/api/batch/tasks/{task_id}/status').headers['ETag']
+
+    assert len({full, summary, status}) == 3
+    assert _get(client, f'/api/batch/tasks/{task_id}/status', full).status_code == 200
+
+
+def test_task_list_etag_follows_session_version(client):
+    _create()
+    etag = _get(client, '/api/batch/tasks').headers['ETag']
+    assert _get(client, '/api/batch/tasks', etag).status_code == 304
+
+    _create()
+
+    response = _get(client, '/api/batch/tasks', etag)
+    assert response.status_code == 200
+    assert len(response.get_json()['tasks']) == 2
+
+
+def test_task_list_etag_changes_when_task_expires(client, redis_server):
+    expiring = _create()
+    _create()
+    etag = _get(client, '/api/batch/tasks').headers['ETag']
+
+    # 任务数据过期，版本号不变
+    redis_server.delete(f'batch_task:s1:{expiring}')
+
+    response = _get(client, '/api/batch/tasks', etag)
+    assert response.status_code == 200
+    assert len(response.get_json()['tasks']) == 1
+    assert response.get_json()['tasks'][0]['task_id'] != expiring
@@ -0,0 +1,59 @@
+"""任务接口的摘要视图（view=summary）和字段选择（fields=）"""
+from task_manager import SUMMARY_FIELDS, task_manager
+
+HEADERS = {'X-Session-ID': 's1'}
+
+
+def _create():
+    task_id, _ = task_manager.create_task('s1', [{'filename': f'{i}.png'} for i in range(3)], 'a cat', 'mock')
+    task_manager.add_task_result('s1', task_id, '0.png', {'success': True, 'generated_image_url': '/r/0.png'}, index=0)
+    return task_id
+
+
+def _fail_item_reads(monkeypatch):
+    def read_items(*args, **kwargs):
+        raise AssertionError("摘要视图不应读取图片条目")
+
+    monkeypatch.setattr(task_manager, '_iter_items', read_items)
+
+
+def test_summary_view_returns_only_summary_fields(client, monkeypatch):
+    task_id = _create()
+    _fail_item_reads(monkeypatch)
+
+    task = client.get(f'/api/batch/tasks/{task_id}?view=summary', headers=HEADERS).get_json()['task']
+
+    assert set(task) == set(SUMMARY_FIELDS)
+    assert task['processed_images'] == 1
+    assert task['preview'] == [{'index': 0, 'url': '/r/0.png'}]
+
+
+def test_fields_selects_top_level_fields(client):
+    task_id = _create()
+
+    task = client.get(f'/api/batch/tasks/{task_id}?fields=status, progress', headers=HEADERS).get_json()['task']
+    with_images = client.get(f'/api/batch/tasks/{task_id}?fields=images', headers=HEADERS).get_json()['task']
+
+    assert set(task) == {'task_id', 'status', 'progress'}
+    assert set(with_images) == {'task_id', 'images'}
+    assert [image['status'] for image in with_images['images']] == ['completed', 'pending', 'pending']
+
+
+def test_task_list_summary_view(client, monkeypatch):
+    _create()
+    _create()
+    _fail_item_reads(monkeypatch)
+
+    tasks = client.get('/api/batch/tasks?view=summary', headers=HEADERS).get_json()['tasks']
+
+    assert len(tasks) == 2
+    assert all(set(task) == set(SUMMARY_FIELDS) for task in tasks)
+
+
+def test_unknown_view_is_rejected(client):
+    task_id = _create()
+
+    response = client.get(f'/api/batch/tasks/{task_id}?view=compact', headers=HEADERS)
+
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
@@ -0,0 +1,135 @@
+"""任务管理器：进度、状态和结果"""
+import threading
+
+import pytest
+
+from task_manager import BatchTaskManager, task_manager
+
+
+def _create(count=2):
+    task_id, _ = task_manager.create_task('s1', [{'filename': f'{i}.png'} for i in range(count)], 'a cat', 'mock')
+    return task_id
+
+
+def test_progress_after_cancel_is_ignored(redis_server):
+    task_id = _create()
+    task_manager.cancel_task('s1', task_id)
+
+    task_manager.update_task_progress('s1', task_id, 50, 1)
+    task_manager.flush_progress()
+
+    task = task_manager.get_task('s1', task_id)
+    assert task['status'] == 'cancelled'
+    assert task['progress'] == 0
+
+
+def test_late_progress_does_not_move_backwards(redis_server):
+    task_id = _create()
+    task_manager.add_task_result('s1', task_id, '1.png', {'success': True, 'generated_image_url': '/r.png'}, 1)
+
+    task_manager.update_task_progress('s1', task_id, 0, 1)
+    task_manager.flush_progress()
+
+    assert task_manager.get_task('s1', task_id)['progress'] == 50
+
+
+def _other_process(monkeypatch, write):
+    """另一个进程中的任务管理器（独立的进程内锁），在本进程读取概要之后、写回之前执行 write"""
+    other = BatchTaskManager()
+    other.redis_client = task_manager.redis_client
+    original = task_manager._refresh_progress
+    calls = []
+
+    def refresh(task_data):
+        if not calls:
+            calls.append(task_data["task_id"])
+            write(other)
+        original(task_data)
+
+    monkeypatch.setattr(task_manager, '_refresh_progress', refresh)
+
+
+def test_result_does_not_overwrite_cancel_from_other_process(redis_server, monkeypatch):
+    task_id = _create()
+    task_manager.update_task_status('s1', task_id, 'processing')
+    _other_process(monkeypatch, lambda other: other.cancel_task('s1', task_id))
+
+    task_manager.add_task_result('s1', task_id, '0.png', {'success': True, 'generated_image_url': '/r/0.png'}, index=0)
+
+    task = task_manager.get_task('s1', task_id)
+    assert task['status'] == 'cancelled'
+    assert task['results']['success_count'] == 1
+
+
+def test_results_from_two_processes_are_both_counted(redis_server, monkeypatch):
+    task_id = _create()
+    _other_process(monkeypatch, lambda other: other.add_task_result(
+        's1', task_id, '1.png', {'success': False, 'error': 'boom'}, index=1))
+
+    task_manager.add_task_result('s1', task_id, '0.png', {'success': True, 'generated_image_url': '/r/0.png'}, index=0)
+
+    task = task_manager.get_task('s1', task_id)
+    assert task['results'] == {**task['results'], 'success_count': 1, 'failed_count': 1}
+    assert [item['status'] for item in task['images']] == ['completed', 'failed']
+    assert (task['status'], task['progress']) == ('completed', 100.0)
+
+
+@pytest.fixture
+def coalescing(monkeypatch):
+    """进度只缓存不自动写入（不启动后台线程），由测试调用 flush_progress"""
+    monkeypatch.setattr(task_manager, 'progress_flush_interval', 60)
+    monkeypatch.setattr(task_manager, '_flusher', threading.current_thread())
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    """记录写入任务概要的次数"""
+    calls = []
+    original = task_manager._update_task
+
+    def update_task(session_id, task_id, update):
+        calls.append(task_id)
+        return original(session_id, task_id, update)
+
+    monkeypatch.setattr(task_manager, '_update_task', update_task)
+    return calls
+
+
+def test_progress_updates_are_coalesced(redis_server, coalescing, writes):
+    task_id = _create(10)
+
+    for done in range(1, 4):
+        task_manager.update_task_progress('s1', task_id, done * 10, done)
+
+    assert writes == []
+    assert task_manager.get_task('s1', task_id)['progress'] == 0
+
+    task_manager.flush_progress()
+
+    task = task_manager.get_task('s1', task_id)
+    assert (task['progress'], task['current_image']) == (30, 3)
+    assert writes == [task_id]
+
+
+def test_pending_progress_is_written_with_result(redis_server, coalescing, writes):
+    task_id = _create(10)
+    task_manager.update_task_progress('s1', task_id, 10, 2)
+
+    task_manager.add_task_result('s1', task_id, '0.png', {'success': True, 'generated_image_url': '/r/0.png'}, index=0)
+
+    task = task_manager.get_task('s1', task_id)
+    assert task['current_image'] == 2
+    # 缓存的进度已随结果写入，之后不会再单独写入一次
+    task_manager.flush_progress()
+    assert writes == [task_id]
+
+
+def test_progress_never_moves_backwards(redis_server, monkeypatch):
+    monkeypatch.setattr(task_manager, 'progress_flush_interval', 0)
+    task_id = _create(10)
+
+    task_manager.update_task_progress('s1', task_id, 50, 5)
+    task_manager.update_task_progress('s1', task_id, 20, 2)
+
+    task = task_manager.get_task('s1', task_id)
+    assert (task['progress'], task['processed_images'], task['current_image']) == (50, 5, 2)
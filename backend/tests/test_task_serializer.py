@@ -0,0 +1,66 @@
+"""任务数据的序列化"""
+import json
+
+import pytest
+
+import task_serializer
+from task_serializer import TaskSerializer
+
+TASK = {"task_id": "t1", "status": "processing", "prompt": "一只猫", "progress": 12.5,
+        "results": {"success_count": 1, "failed_count": 0}, "preview": [None, {"url": "/static/results/a.png"}]}
+LARGE = {"images": [{"filename": f"{i}.png", "status": "pending", "result_url": None} for i in range(200)]}
+
+
+def _codecs():
+    codecs = [('json', 'none'), ('json', 'zlib'), ('plain', 'none')]
+    if task_serializer.msgpack is not None:
+        codecs.append(('msgpack', 'zlib'))
+    if task_serializer.zstandard is not None:
+        codecs.append(('json', 'zstd'))
+    return codecs
+
+
+@pytest.mark.parametrize('codec, compression', _codecs())
+@pytest.mark.parametrize('obj', [TASK, LARGE])
+def test_round_trip(codec, compression, obj):
+    serializer = TaskSerializer(codec, compression)
+
+    data = serializer.dumps(obj)
+
+    assert isinstance(data, bytes)
+    assert serializer.loads(data) == obj
+    # 任何配置都能读取其他配置写入的数据
+    assert TaskSerializer('json', 'none').loads(data) == obj
+
+
+def test_small_data_is_not_compressed():
+    data = TaskSerializer('json', 'zlib', compress_min_bytes=1024).dumps(TASK)
+    assert data[:3] == b'\x01jn'
+
+
+def test_large_data_is_compressed():
+    serializer = TaskSerializer('json', 'zlib', compress_min_bytes=1024)
+    data = serializer.dumps(LARGE)
+    assert data[:3] == b'\x01jz'
+    assert len(data) < len(json.dumps(LARGE))
+
+
+@pytest.mark.parametrize('legacy', [json.dumps(TASK), json.dumps(TASK).encode('utf-8'),
+                                    json.dumps(TASK, ensure_ascii=False).encode('utf-8')])
+def test_legacy_json_is_decoded(legacy):
+    assert TaskSerializer().loads(legacy) == TASK
+
+
+def test_plain_writes_legacy_format():
+    data = TaskSerializer('plain').dumps(TASK)
+    assert json.loads(data) == TASK
+
+
+def test_unknown_tag_is_rejected():
+    with pytest.raises(ValueError):
+        TaskSerializer().loads(b'\x01xn{}')
+
+
+def test_unknown_codec_is_rejected():
+    with pytest.raises(ValueError):
+        TaskSerializer('pickle')
@@ -0,0 +1,97 @@
+"""可续传的分块上传"""
+import io
+import os
+import threading
+
+import pytest
+
+from conftest import PNG_BYTES
+from upload_store import UploadError, UploadStore
+
+
+@pytest.fixture
+def store(redis_server, tmp_path):
+    store = UploadStore(upload_folder=str(tmp_path), max_file_size=1024, chunk_size=32)
+    store.redis_client = redis_server
+    return store
+
+
+def _upload(store, data, filename='a.png'):
+    upload = store.create('s1', filename, len(data))
+    for offset in range(0, len(data), store.chunk_size):
+        chunk = data[offset:offset + store.chunk_size]
+        upload = store.write_chunk('s1', upload['upload_id'], offset, io.BytesIO(chunk), len(chunk))
+    return upload
+
+
+def test_chunked_upload_and_complete(store):
+    upload = _upload(store, PNG_BYTES)
+    assert upload['offset'] == len(PNG_BYTES)
+
+    completed = store.complete('s1', upload['upload_id'])
+
+    assert completed['status'] == 'completed'
+    assert store.complete('s1', upload['upload_id']) == completed
+    [image] = store.resolve('s1', [upload['upload_id']])
+    with open(image['file_path'], 'rb') as f:
+        assert f.read() == PNG_BYTES
+
+
+def test_wrong_offset_returns_current_offset(store):
+    upload = store.create('s1', 'a.png', len(PNG_BYTES))
+    store.write_chunk('s1', upload['upload_id'], 0, io.BytesIO(PNG_BYTES[:10]), 10)
+
+    with pytest.raises(UploadError) as error:
+        store.write_chunk('s1', upload['upload_id'], 0, io.BytesIO(PNG_BYTES[:10]), 10)
+    assert error.value.status_code == 409
+    assert error.value.details == {'offset': 10}
+
+
+def test_incomplete_upload_cannot_complete(store):
+    upload = store.create('s1', 'a.png', len(PNG_BYTES))
+    store.write_chunk('s1', upload['upload_id'], 0, io.BytesIO(PNG_BYTES[:10]), 10)
+
+    with pytest.raises(UploadError) as error:
+        store.complete('s1', upload['upload_id'])
+    assert error.value.status_code == 409
+
+
+def test_complete_rejects_non_image(store):
+    upload = _upload(store, b'not an image at all')
+
+    with pytest.raises(UploadError) as error:
+        store.complete('s1', upload['upload_id'])
+    assert error.value.status_code == 415
+    assert store.get('s1', upload['upload_id'])['status'] == 'uploading'
+
+
+def test_concurrent_complete(store):
+    upload = _upload(store, PNG_BYTES)
+    results, errors = [], []
+
+    def complete():
+        try:
+            results.append(store.complete('s1', upload['upload_id']))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=complete) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert [result['status'] for result in results] == ['completed'] * 8
+
+
+def test_complete_after_partial_moved(store):
+    upload = _upload(store, PNG_BYTES)
+    store.complete('s1', upload['upload_id'])
+    # 模拟另一个请求已移走文件、但尚未保存完成状态
+    raw = store._load('s1', upload['upload_id'])
+    raw['status'] = 'uploading'
+    store._save('s1', raw)
+
+    assert store.complete('s1', upload['upload_id'])['status'] == 'completed'
+    assert not os.path.exists(store._partial_path(upload['upload_id']))
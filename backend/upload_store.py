@@ -0,0 +1,298 @@
+"""
+可续传的分块上传
+
+multipart 上传受 MAX_CONTENT_LENGTH 限制的是整个请求，多张图片的批量请求总共只能有 10MB，连接中断后需要整体重传。
+分块上传按文件处理：
+    1. POST   /api/uploads                      创建上传会话（文件名、总大小），单个文件不超过 MAX_FILE_SIZE
+    2. PUT    /api/uploads/<id>?offset=N        请求体为从 N 开始的一块数据，直接追加写入磁盘
+    3. GET    /api/uploads/<id>                 查询已接收的字节数，中断后从该偏移量继续上传
+    4. POST   /api/uploads/<id>/complete        完成上传，文件移入 UPLOAD_FOLDER
+完成后批量接口可通过 upload_ids / upload_id 引用文件，不再需要在请求中携带图片。
+
+会话元数据保存在 Redis（按 session 隔离），已接收的数据以磁盘上未完成文件的大小为准，
+同一上传的并发写入通过文件锁串行化，多个 gunicorn worker 处理同一上传也不会写乱。
+"""
+import fcntl
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+
+import redis
+from werkzeug.utils import secure_filename
+
+import file_layout
+from image_preprocess import sniff_image_type
+
+# Redis连接
+redis_host = os.getenv('REDIS_HOST', 'localhost')
+redis_port = int(os.getenv('REDIS_PORT', 6379))
+redis_password = os.getenv('REDIS_PASSWORD', None)
+redis_client = redis.Redis(host=redis_host, port=redis_port, password=redis_password, db=0, decode_responses=True)
+
+UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'uploads')
+MAX_FILE_SIZE = int(os.getenv('MAX_FILE_SIZE', 10 * 1024 * 1024))  # 单个文件的大小上限
+ALLOWED_EXTENSIONS = set(os.getenv('ALLOWED_EXTENSIONS', 'png,jpg,jpeg,gif,webp').split(','))
+# 建议的分块大小，单块不能超过 MAX_CONTENT_LENGTH（即 MAX_FILE_SIZE）
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 4 * 1024 * 1024))
+# 上传会话的保留时间（秒），超时未完成的上传会被清理
+UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', 86400))
+
+# 写入磁盘时每次从请求中读取的字节数
+COPY_BUFFER_SIZE = 64 * 1024
+# 清理过期未完成文件的最小间隔（秒）
+PARTIAL_SWEEP_INTERVAL = 600
+# 完成上传时读取的文件头字节数，用于判断图片格式
+SNIFF_BYTES = 12
+
+
+class UploadStatus:
+    UPLOADING = "uploading"
+    COMPLETED = "completed"
+
+
+class UploadError(ValueError):
+    """上传请求不合法，status_code 为对应的 HTTP 状态码"""
+
+    def __init__(self, message, status_code=400, **details):
+        super().__init__(message)
+        self.status_code = status_code
+        self.details = details
+
+
+class UploadStore:
+    """分块上传会话管理，通过 session_id 区分每个用户的上传"""
+
+    def __init__(self, upload_folder=UPLOAD_FOLDER, max_file_size=MAX_FILE_SIZE, chunk_size=UPLOAD_CHUNK_SIZE):
+        self.redis_client = redis_client
+        self.upload_prefix = "upload:"
+        self.upload_folder = upload_folder
+        self.partial_folder = os.path.join(upload_folder, '.partial')
+        self.max_file_size = max_file_size
+        self.chunk_size = min(chunk_size, max_file_size)
+        self._last_sweep = 0.0
+
+    def _make_key(self, session_id, upload_id):
+        return f"{self.upload_prefix}{session_id}:{upload_id}"
+
+    def _partial_path(self, upload_id):
+        return os.path.join(self.partial_folder, upload_id)
+
+    def _save(self, session_id, upload):
+        self.redis_client.setex(self._make_key(session_id, upload['upload_id']), UPLOAD_SESSION_TTL, json.dumps(upload))
+
+    def _load(self, session_id, upload_id):
+        data = self.redis_client.get(self._make_key(session_id, upload_id))
+        if not data:
+            raise UploadError("上传不存在或已过期", 404)
+        return json.loads(data)
+
+    def _received_bytes(self, upload):
+        if upload['status'] == UploadStatus.COMPLETED:
+            return upload['size']
+        try:
+            return os.path.getsize(self._partial_path(upload['upload_id']))
+        except FileNotFoundError:
+            return 0
+
+    def _view(self, upload):
+        """返回给客户端的上传状态（不包含服务器路径）"""
+        return {
+            'upload_id': upload['upload_id'],
+            'filename': upload['filename'],
+            'size': upload['size'],
+            'offset': self._received_bytes(upload),
+            'status': upload['status'],
+            'chunk_size': self.chunk_size,
+            'created_at': upload['created_at']
+        }
+
+    def _sweep_partials(self):
+        """删除超过保留时间仍未完成的文件（会话已随 Redis 过期）"""
+        now = time.time()
+        if now - self._last_sweep < PARTIAL_SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        try:
+            with os.scandir(self.partial_folder) as entries:
+                for entry in entries:
+                    try:
+                        if now - entry.stat().st_mtime > UPLOAD_SESSION_TTL:
+                            os.remove(entry.path)
+                    except OSError:
+                        pass
+        except FileNotFoundError:
+            pass
+
+    def create(self, session_id, filename, size):
+        """
+        创建上传会话
+
+        Args:
+            filename: 原始文件名
+            size: 文件总字节数
+
+        Returns:
+            dict: 上传状态（upload_id、offset、chunk_size 等）
+        """
+        filename = secure_filename(filename or '')
+        if '.' not in filename or filename.rsplit('.', 1)[1].lower() not in ALLOWED_EXTENSIONS:
+            raise UploadError(f"不支持的文件类型，仅支持 {', '.join(sorted(ALLOWED_EXTENSIONS))}")
+        if not isinstance(size, int) or size <= 0:
+            raise UploadError("文件大小必须是正整数")
+        if size > self.max_file_size:
+            raise UploadError(f"文件大小超过上限 {self.max_file_size} 字节", 413)
+
+        self._sweep_partials()
+        os.makedirs(self.partial_folder, exist_ok=True)
+        upload_id = str(uuid.uuid4())
+        # 先创建空文件，已接收的字节数以该文件大小为准
+        open(self._partial_path(upload_id), 'wb').close()
+        upload = {
+            'upload_id': upload_id,
+            'filename': filename,
+            'size': size,
+            'status': UploadStatus.UPLOADING,
+            'file_path': None,
+            'created_at': datetime.now().isoformat()
+        }
+        self._save(session_id, upload)
+        return self._view(upload)
+
+    def get(self, session_id, upload_id):
+        """查询上传状态，offset 为已接收的字节数"""
+        return self._view(self._load(session_id, upload_id))
+
+    def write_chunk(self, session_id, upload_id, offset, stream, length):
+        """
+        将一块数据写入磁盘
+
+        offset 必须等于已接收的字节数（否则返回 409 和当前偏移量，客户端据此续传），
+        数据边读边写，不在内存中保存整块。连接中断时已写入的部分会保留。
+
+        Args:
+            offset: 本块的起始偏移量
+            stream: 请求体流
+            length: 本块的字节数（Content-Length）
+
+        Returns:
+            dict: 写入后的上传状态
+        """
+        upload = self._load(session_id, upload_id)
+        if upload['status'] == UploadStatus.COMPLETED:
+            raise UploadError("上传已完成", 409, offset=upload['size'])
+        if length is None:
+            raise UploadError("缺少 Content-Length", 411)
+        if length <= 0 or length > self.chunk_size:
+            raise UploadError(f"分块大小必须在 1 到 {self.chunk_size} 字节之间", 413)
+        if offset + length > upload['size']:
+            raise UploadError("数据超出文件大小", 400)
+
+        path = self._partial_path(upload_id)
+        try:
+            f = open(path, 'r+b')
+        except FileNotFoundError:
+            raise UploadError("上传不存在或已过期", 404)
+        with f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            current = os.fstat(f.fileno()).st_size
+            if offset != current:
+                raise UploadError("偏移量与已接收的字节数不一致", 409, offset=current)
+            f.seek(offset)
+            remaining = length
+            while remaining > 0:
+                block = stream.read(min(COPY_BUFFER_SIZE, remaining))
+                if not block:
+                    break
+                f.write(block)
+                remaining -= len(block)
+            f.flush()
+
+        # 续期会话
+        self._save(session_id, upload)
+        if remaining:
+            raise UploadError("数据未完整接收，请查询偏移量后重试", 400, offset=offset + length - remaining)
+        return self._view(upload)
+
+    def complete(self, session_id, upload_id):
+        """
+        完成上传，检查文件头是否为支持的图片格式后将文件移入 UPLOAD_FOLDER
+
+        与 write_chunk 使用同一个文件锁；重复或并发调用返回相同结果。
+
+        Returns:
+            dict: 上传状态
+        """
+        upload = self._load(session_id, upload_id)
+        if upload['status'] == UploadStatus.COMPLETED:
+            return self._view(upload)
+
+        file_path = file_layout.sharded_path(self.upload_folder, f"{upload_id}_{upload['filename']}")
+        try:
+            f = open(self._partial_path(upload_id), 'rb')
+        except FileNotFoundError:
+            return self._completed_elsewhere(session_id, upload_id, file_path)
+        with f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            # 等待锁期间文件可能已被另一个请求移走
+            upload = self._load(session_id, upload_id)
+            if upload['status'] == UploadStatus.COMPLETED:
+                return self._view(upload)
+            if not os.path.exists(f.name):
+                return self._completed_elsewhere(session_id, upload_id, file_path)
+
+            received = os.fstat(f.fileno()).st_size
+            if received != upload['size']:
+                raise UploadError(f"文件未上传完整（{received}/{upload['size']} 字节）", 409, offset=received)
+            extensions, _ = sniff_image_type(f.read(SNIFF_BYTES))
+            if not extensions or not extensions & ALLOWED_EXTENSIONS:
+                raise UploadError(f"文件 {upload['filename']} 不是支持的图片格式", 415)
+
+            os.replace(f.name, file_path)
+            upload['status'] = UploadStatus.COMPLETED
+            upload['file_path'] = file_path
+            self._save(session_id, upload)
+        return self._view(upload)
+
+    def _completed_elsewhere(self, session_id, upload_id, file_path):
+        """未完成文件已不存在：另一个请求已完成上传时返回完成状态，否则上传已过期"""
+        upload = self._load(session_id, upload_id)
+        if upload['status'] != UploadStatus.COMPLETED:
+            if not os.path.exists(file_path):
+                raise UploadError("上传不存在或已过期", 404)
+            # 文件已移入 UPLOAD_FOLDER，完成状态尚未保存
+            upload['status'] = UploadStatus.COMPLETED
+            upload['file_path'] = file_path
+        return self._view(upload)
+
+    def resolve(self, session_id, upload_ids):
+        """
+        将已完成的上传转换为批量任务使用的图片数据
+
+        Returns:
+            list: [{'filename', 'file_path'}, ...]，顺序与 upload_ids 一致
+        """
+        keys = [self._make_key(session_id, upload_id) for upload_id in upload_ids]
+        images_data = []
+        for upload_id, data in zip(upload_ids, self.redis_client.mget(keys) if keys else []):
+            upload = json.loads(data) if data else None
+            if not upload or upload['status'] != UploadStatus.COMPLETED:
+                raise UploadError(f"上传 {upload_id} 不存在或未完成")
+            images_data.append({'filename': upload['filename'], 'file_path': upload['file_path']})
+        return images_data
+
+    def delete(self, session_id, upload_id):
+        """放弃未完成的上传（已完成的文件由批量任务使用，不删除）"""
+        upload = self._load(session_id, upload_id)
+        if upload['status'] != UploadStatus.COMPLETED:
+            try:
+                os.remove(self._partial_path(upload_id))
+            except FileNotFoundError:
+                pass
+        self.redis_client.delete(self._make_key(session_id, upload_id))
+        return True
+
+
+# 全局实例
+upload_store = UploadStore()